@@ -0,0 +1,275 @@
+"""
+benchmark suite of the feed parse -> filter -> download pipeline against synthetic feeds and a local HTTP server.
+
+for every feed size (10, 1k and 10k items by default) it measures parsing with feedparser and the streaming parser,
+selecting the newer vodcasts and the memory the parsed vodcasts keep alive. it compares the throughput of parsing
+many feeds at once in process and in a FeedParserPool of one and of --processes processes, and measures downloading
+enclosures of configurable size, latency and bandwidth (MB/s), the per item overhead of downloading tiny enclosures
+and the cost of a progress hook call. every case runs in a process of its own, so its peak RSS is reported as well.
+
+the results are written as JSON (with the commit they were measured at) and can be compared with an earlier run:
+
+    python benchmarks/pipeline_benchmark.py --output before.json
+    git checkout my-change
+    python benchmarks/pipeline_benchmark.py --output after.json --compare before.json
+"""
+import gc
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import types
+from multiprocessing.pool import ThreadPool
+from datetime import datetime, timedelta
+from optparse import OptionParser
+sys.path.insert(0,os.path.abspath(__file__+"/../.."))
+sys.path.insert(0,os.path.abspath(__file__+"/../../tests"))
+from rss.rss_feed_downloader import VodcastDownloadManager, VodcastDownloader, DownloadProgressHook, FeedParserPool, LOCAL_TIMEZONE, create_download_pool, parse_feed
+from rss.integrity import DEFAULT_ALGORITHM
+from rss.storage import DEFAULT_BUFFER_SIZE
+from rss.transport import HttpTransport
+from range_http_server import RangeHTTPServer, Resource
+from progress_hook_benchmark import measure as measure_progress_hook
+
+FEED_START = datetime(2010, 10, 28, 9, 53, 49)
+PROGRESS_HOOK_CALLS = 100000
+
+def synthetic_feed(items, enclosure_url):
+    """
+    RSS 2.0 feed of items entries published an hour apart, newest first. enclosure_url % number is the enclosure
+    of an entry
+    """
+    entries = []
+    for number in range(items):
+        published = (FEED_START - timedelta(hours=number)).strftime('%a, %d %b %Y %H:%M:%S +0000')
+        entries.append('<item><title>episode %d</title><guid>episode-%d</guid><pubDate>%s</pubDate>'
+                       '<description>synthetic episode number %d of the benchmark feed</description>'
+                       '<enclosure url="%s" type="video/mp4" length="0" /></item>' % (number, number, published, number, enclosure_url % number))
+    return ("<?xml version='1.0' encoding='UTF-8'?><rss version='2.0'><channel><title>benchmark</title>%s</channel></rss>"
+            % ''.join(entries))
+
+def reference_date(items):
+    """
+    local reference date selecting the newer half of a synthetic feed
+    """
+    return LOCAL_TIMEZONE.localize(FEED_START - timedelta(hours=items // 2) + timedelta(minutes=30))
+
+def retained_size(objects):
+    """
+    bytes of objects and everything they reference, except classes and modules
+    """
+    seen = set()
+    size = 0
+    pending = list(objects)
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen or isinstance(obj, (type, types.ClassType, types.ModuleType)):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        pending.extend(gc.get_referents(obj))
+    return size
+
+class Case:
+    def __init__(self, name, items, function):
+        self.name = name
+        self.items = items
+        self.function = function
+
+def parse_case(items, options):
+    feed = synthetic_feed(items, 'http://127.0.0.1/episode%d.mp4')
+    started = timeit.default_timer()
+    manager = VodcastDownloadManager(feed, tempfile.gettempdir())
+    elapsed = timeit.default_timer() - started
+    return {'seconds' : elapsed, 'count' : len(manager.vodcasts), 'retained_kb' : retained_size(manager.vodcasts) / 1024}
+
+def filter_case(items, options):
+    manager = VodcastDownloadManager(synthetic_feed(items, 'http://127.0.0.1/episode%d.mp4'), tempfile.gettempdir())
+    started = timeit.default_timer()
+    selected = manager.select_newer(reference_date(items))
+    return {'seconds' : timeit.default_timer() - started, 'count' : items, 'selected' : len(selected)}
+
+def stream_case(items, options):
+    feed = synthetic_feed(items, 'http://127.0.0.1/episode%d.mp4')
+    started = timeit.default_timer()
+    manager = VodcastDownloadManager(feed, tempfile.gettempdir(), streaming=True)
+    selected = manager.select_newer(reference_date(items))
+    return {'seconds' : timeit.default_timer() - started, 'count' : items, 'selected' : len(selected)}
+
+def parse_many_case(processes):
+    """
+    parse options.parse_feeds feeds of items entries each, concurrently from as many threads as feeds (like
+    BatchDownloadManager fetching them), in a FeedParserPool of processes or, if None, in process
+    """
+    def run(items, options):
+        feeds = [synthetic_feed(items, 'http://127.0.0.1/%d/episode%%d.mp4' % feed) for feed in range(options.parse_feeds)]
+        parser = FeedParserPool(processes) if processes else None
+        threads = ThreadPool(len(feeds))
+        try:
+            started = timeit.default_timer()
+            parsed = threads.map(parser.parse if parser else parse_feed, feeds)
+            elapsed = timeit.default_timer() - started
+        finally:
+            threads.close()
+            if parser:
+                parser.close()
+        return {'seconds' : elapsed, 'count' : sum(len(parsed_feed.vodcasts) for parsed_feed in parsed)}
+    return run
+
+def download_case(path, throughput=True):
+    def run(items, options):
+        feed = synthetic_feed(items, options.server_url + path)
+        manager = VodcastDownloadManager(feed, tempfile.gettempdir())
+        directory = tempfile.mkdtemp(dir=options.directory)
+        transport = HttpTransport(buffer_size=DEFAULT_BUFFER_SIZE)
+        try:
+            # as VodcastDownloadManager builds it, through the pooled transport
+            downloader = VodcastDownloader(directory, url_retriever=transport.retrieve, url_opener=transport.open, resume=options.resume,
+                                           buffer_size=DEFAULT_BUFFER_SIZE, checksum_algorithm=DEFAULT_ALGORITHM)
+            pool = create_download_pool(options.engine, options.threads, options.threads)
+            started = timeit.default_timer()
+            results = pool.run((downloader, vodcast) for vodcast in manager.vodcasts)
+            elapsed = timeit.default_timer() - started
+            if not all(result.succeeded for result in results):
+                raise Exception('failed downloads: %s' % [result for result in results if not result.succeeded])
+            size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+        finally:
+            transport.close()
+            shutil.rmtree(directory)
+        result = {'seconds' : elapsed, 'count' : len(results)}
+        if throughput:
+            result['bytes'] = size
+        return result
+    return run
+
+def progress_hook_case(items, options):
+    per_call, retained = measure_progress_hook(DownloadProgressHook, items)
+    return {'seconds' : per_call * items, 'count' : items}
+
+def _run_case(case, options, queue):
+    logging.basicConfig(level=logging.ERROR)
+    try:
+        result = case.function(case.items, options)
+        # kilobytes on Linux
+        result['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        queue.put(result)
+    except Exception as e:
+        queue.put({'error' : str(e)})
+
+def run_isolated(case, options):
+    """
+    run case in a forked process of its own, so its peak RSS is not inflated by earlier cases
+    """
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_run_case, args=(case, options, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    if 'error' in result:
+        raise Exception('%s failed: %s' % (case.name, result['error']))
+    return result
+
+def measure(case, options):
+    best = None
+    for run in range(options.runs):
+        result = run_isolated(case, options)
+        if best is None or result['seconds'] < best['seconds']:
+            best = result
+    best['name'] = case.name
+    best['items'] = case.items
+    best['per_item_us'] = best['seconds'] / max(1, best['count']) * 1e6
+    if 'bytes' in best:
+        best['mb_per_s'] = best['bytes'] / best['seconds'] / 1024 / 1024
+    return best
+
+def create_cases(options):
+    cases = []
+    for items in options.items:
+        cases.append(Case('parse/feedparser/%d' % items, items, parse_case))
+        cases.append(Case('filter/should_be_downloaded/%d' % items, items, filter_case))
+        cases.append(Case('parse+filter/stream/%d' % items, items, stream_case))
+    cases.append(Case('parse-many/in-process/%dx%d' % (options.parse_feeds, options.parse_items), options.parse_items, parse_many_case(None)))
+    for processes in sorted(set([1, options.processes])):
+        cases.append(Case('parse-many/pool-%d/%dx%d' % (processes, options.parse_feeds, options.parse_items), options.parse_items, parse_many_case(processes)))
+    cases.append(Case('download/%s/%dk' % (options.engine, options.size), options.downloads, download_case('/large/%d.mp4')))
+    cases.append(Case('download-overhead/%s/1b' % options.engine, options.downloads * 10, download_case('/tiny/%d.mp4', throughput=False)))
+    cases.append(Case('progress_hook/report_hook', PROGRESS_HOOK_CALLS, progress_hook_case))
+    return cases
+
+def start_server(options):
+    server = RangeHTTPServer().start()
+    large = Resource('x' * options.size * 1024, latency=options.latency / 1000.0, rate=options.rate)
+    tiny = Resource('x', latency=options.latency / 1000.0)
+    for number in range(options.downloads):
+        server.resources['/large/%d.mp4' % number] = large
+    for number in range(options.downloads * 10):
+        server.resources['/tiny/%d.mp4' % number] = tiny
+    options.server_url = server.url('')
+    return server
+
+def current_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_results(results, baseline=None):
+    previous = dict((result['name'], result) for result in (baseline or {}).get('results', []))
+    for result in results:
+        line = '%-36s %10.4fs %10.1f us/item %9d kb rss' % (result['name'], result['seconds'], result['per_item_us'], result['peak_rss_kb'])
+        if 'mb_per_s' in result:
+            line += ' %8.1f MB/s' % result['mb_per_s']
+        if 'retained_kb' in result:
+            line += ' %8d kb retained' % result['retained_kb']
+        if result['name'] in previous:
+            line += ' %+7.1f%% time' % ((result['seconds'] / previous[result['name']]['seconds'] - 1) * 100)
+        print(line)
+
+def main(args):
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--items', default='10,1000,10000', help='feed sizes to benchmark, comma separated [%default]')
+    parser.add_option('--parse-feeds', type='int', default=32, help='feeds parsed concurrently [%default]')
+    parser.add_option('--parse-items', type='int', default=200, help='entries per concurrently parsed feed [%default]')
+    parser.add_option('--processes', type='int', default=multiprocessing.cpu_count(), help='parser processes to compare with one [%default]')
+    parser.add_option('--downloads', type='int', default=10, help='enclosures to download [%default]')
+    parser.add_option('--size', type='int', default=4096, help='size of an enclosure in kb [%default]')
+    parser.add_option('--latency', type='int', default=0, help='milliseconds until the server answers [%default]')
+    parser.add_option('--rate', type='int', default=None, help='bytes per second the server sends per connection')
+    parser.add_option('--engine', default='threads', choices=['threads', 'events'], help='download engine [%default]')
+    parser.add_option('--threads', type='int', default=4, help='parallel downloads [%default]')
+    parser.add_option('--resume', action='store_true', default=False, help='download through the resumable .part path')
+    parser.add_option('--runs', type='int', default=3, help='best of RUNS [%default]')
+    parser.add_option('--directory', default=None, help='download into DIRECTORY instead of a temporary directory')
+    parser.add_option('--output', default=None, help='write the results as JSON to FILE', metavar='FILE')
+    parser.add_option('--compare', default=None, help='compare with the JSON results in FILE', metavar='FILE')
+    options, remaining = parser.parse_args(args[1:])
+    options.items = [int(items) for items in options.items.split(',')]
+    baseline = None
+    if options.compare:
+        with open(options.compare, 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+
+    server = start_server(options)
+    try:
+        print('commit %s, best of %d runs%s' % (current_commit(), options.runs, ', compared with %s' % baseline.get('commit') if baseline else ''))
+        results = [measure(case, options) for case in create_cases(options)]
+    finally:
+        server.stop()
+    print_results(results, baseline)
+    if options.output:
+        parameters = dict((name, getattr(options, name)) for name in ('items', 'parse_feeds', 'parse_items', 'processes', 'downloads', 'size', 'latency', 'rate', 'engine', 'threads', 'resume', 'runs'))
+        with open(options.output, 'w') as output:
+            json.dump({'commit' : current_commit(), 'python' : platform.python_version(), 'platform' : platform.platform(),
+                       'timestamp' : time.time(), 'parameters' : parameters, 'results' : results}, output, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,53 @@
+"""
+micro benchmark of the per block cost of DownloadProgressHook.report_hook.
+
+compares the current hook with the behaviour before sampling was throttled: a debug message formatted and
+Progress.update (keeping the full history and prediction log) called for every block.
+
+usage: python benchmarks/progress_hook_benchmark.py [BLOCKS]
+"""
+import logging
+import os
+import sys
+import time
+import timeit
+sys.path.insert(0,os.path.abspath(__file__+"/../.."))
+from rss.rss_feed_downloader import DownloadProgressHook
+from rss.progress import Progress
+
+BLOCK_SIZE = 8 * 1024
+
+class UnthrottledDownloadProgressHook(DownloadProgressHook):
+    """
+    hook as it was before: formats the debug message and updates the unbounded eta calculator for every block
+    """
+    def _eat(self, count):
+        self.log.debug('eating %d bytes [%d/%d]' % (count, self.actual, self.total))
+        self.actual += count
+        self.eta_calculator.update(self.actual)
+
+    def _start_reporting(self, total):
+        self.total = total
+        self.eta_calculator = Progress(self.total, unit = 'kb', history_size=None, keep_log=True)
+        self.last_report = self.last_sample = time.time()
+
+def measure(hook_class, blocks):
+    hook = hook_class('benchmark')
+    hook.report_hook(0, BLOCK_SIZE, blocks * BLOCK_SIZE)
+    report_hook = hook.report_hook
+    started = timeit.default_timer()
+    for block_number in xrange(1, blocks + 1):
+        report_hook(block_number, BLOCK_SIZE, blocks * BLOCK_SIZE)
+    elapsed = timeit.default_timer() - started
+    return elapsed / blocks, len(hook.eta_calculator.history) + len(hook.eta_calculator.log)
+
+def main(args):
+    blocks = int(args[1]) if len(args) > 1 else 200000
+    logging.basicConfig(level=logging.WARN)
+    print('%d blocks of %d bytes (%d MB)' % (blocks, BLOCK_SIZE, blocks * BLOCK_SIZE / 1024 / 1024))
+    for name, hook_class in (('unthrottled', UnthrottledDownloadProgressHook), ('throttled', DownloadProgressHook)):
+        per_block, retained = measure(hook_class, blocks)
+        print('%-12s %8.3f us/block  %8d retained history/log entries' % (name, per_block * 1e6, retained))
+
+if __name__ == '__main__':
+    main(sys.argv)
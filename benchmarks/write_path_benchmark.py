@@ -0,0 +1,90 @@
+"""
+throughput of the download write paths against a local HTTP server.
+
+compares urlretrieve (the default url_retriever of a VodcastDownloader, 8k blocks) with HttpTransport.retrieve
+using small blocks without preallocation (the write path before) and large blocks with preallocation, as well as
+the .part file path of resuming downloads.
+
+usage: python benchmarks/write_path_benchmark.py [MEGABYTES [DIRECTORY]]
+
+pass the download directory (e.g. on the NAS) as DIRECTORY to measure it instead of a temporary directory.
+"""
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+from urllib import urlretrieve
+sys.path.insert(0,os.path.abspath(__file__+"/../.."))
+sys.path.insert(0,os.path.abspath(__file__+"/../../tests"))
+from rss.rss_feed_downloader import VodcastDownloader, Vodcast
+from rss.transport import HttpTransport
+from range_http_server import RangeHTTPServer, Resource
+
+RUNS = 3
+
+class Item:
+    class Enclosure:
+        type = 'video/mp4'
+    def __init__(self, url):
+        self.title = 'benchmark'
+        self.updated_parsed = (2010, 10, 28, 9, 53, 49)
+        self.description = 'benchmark'
+        self.enclosures = [Item.Enclosure()]
+        self.enclosures[0].href = url
+
+def retrieve_with(retriever):
+    def download(url, directory):
+        retriever(url, os.path.join(directory, 'episode.mp4'))
+    return download
+
+def resume_download(buffer_size):
+    def download(url, directory):
+        transport = HttpTransport()
+        try:
+            VodcastDownloader(directory, url_opener=transport.open, resume=True, buffer_size=buffer_size).download(Vodcast(Item(url)))
+        finally:
+            transport.close()
+    return download
+
+def measure(download, url, directory, size):
+    best = None
+    for run in range(RUNS):
+        target_directory = tempfile.mkdtemp(dir=directory)
+        try:
+            started = timeit.default_timer()
+            download(url, target_directory)
+            elapsed = timeit.default_timer() - started
+            if os.path.getsize(os.path.join(target_directory, 'episode.mp4')) != size:
+                raise Exception('incomplete download')
+        finally:
+            shutil.rmtree(target_directory)
+        best = elapsed if best is None else min(best, elapsed)
+    return size / best / 1024 / 1024
+
+def main(args):
+    megabytes = int(args[1]) if len(args) > 1 else 64
+    directory = args[2] if len(args) > 2 else None
+    logging.basicConfig(level=logging.ERROR)
+    server = RangeHTTPServer().start()
+    server.resources['/episode.mp4'] = Resource(os.urandom(1024 * 1024) * megabytes)
+    url = server.url('/episode.mp4')
+    small_transport = HttpTransport(buffer_size=8 * 1024, preallocate=False)
+    large_transport = HttpTransport()
+    candidates = (('urlretrieve, 8k blocks', retrieve_with(urlretrieve)),
+                  ('transport, 8k blocks', retrieve_with(small_transport.retrieve)),
+                  ('transport, 1M blocks, preallocated', retrieve_with(large_transport.retrieve)),
+                  ('resume path, 64k blocks', resume_download(64 * 1024)),
+                  ('resume path, 1M blocks', resume_download(1024 * 1024)))
+    print('%d MB into [%s], best of %d runs' % (megabytes, directory or tempfile.gettempdir(), RUNS))
+    try:
+        for name, download in candidates:
+            print('%-36s %8.1f MB/s' % (name, measure(download, url, directory, megabytes * 1024 * 1024)))
+    finally:
+        small_transport.close()
+        large_transport.close()
+        server.stop()
+
+if __name__ == '__main__':
+    main(sys.argv)
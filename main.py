@@ -1,15 +1,33 @@
 import logging
-import logging.config
 from optparse import OptionParser
-from rss.rss_feed_downloader import VodcastDownloadManager, LOCAL_TIMEZONE
+from rss.rss_feed_downloader import VodcastDownloadManager, BatchDownloadManager, FeedParserPool, LOCAL_TIMEZONE
+from rss.feed_cache import IndexFeedCache
+from rss.download_index import DownloadIndex, INDEX_FILENAME
+from rss.journal import DownloadJournal, JOURNAL_FILENAME
+from rss.subscriptions import Subscription, load_subscriptions
+from rss.transport import HttpTransport
+from rss.rate_limit import RateLimiter, parse_rate
+from rss.retry import RetryPolicy
+from rss.storage import WRITE_POLICIES, WRITE_RENAME
+from rss.integrity import verify_archive
+from rss.watch import FeedWatcher
+from rss.metrics import Metrics, JsonLinesSink, PrometheusSink
+from rss.selection import NewestN, MaxTotalBytes, TitleMatches, NotDownloaded
+from rss.planning import RetentionPolicy
+from rss.postprocess import PostProcessor, CommandHook
+from rss.scheduling import Scheduler, FeedTags, SCHEDULING_POLICIES, SCHEDULE_PLANNED
 from datetime import datetime, timedelta
-from dateutil.tz import tzlocal
 import hashlib
+import os
+import re
+import shlex
 from os import path
 from urlparse import urlparse
 import sys
 
 LAST_FETCHED_FILE_TEMPLATE = '.last_feed_access_%(hostname)s_%(hash)s.timestamp'
+# parallel downloads per host with --subscriptions, unless --max-per-host is given. single feeds are not limited
+SUBSCRIPTIONS_MAX_PER_HOST = 2
 
 def _create_fetch_info_path(base, identity):
     return path.join(base, LAST_FETCHED_FILE_TEMPLATE % {
@@ -17,11 +35,39 @@ def _create_fetch_info_path(base, identity):
                                                 'hostname' : urlparse(identity).hostname
                                                 })
 
-def _determineReferenceDate(download_directory, day_offset, identity):
+def _open_index(download_directory, indexes):
+    """
+    one download index per directory, shared by all feeds downloading into it
+    """
+    index_path = path.join(path.abspath(download_directory), INDEX_FILENAME)
+    if index_path not in indexes:
+        indexes[index_path] = DownloadIndex(index_path)
+    return indexes[index_path]
+
+def _open_journal(download_directory, journals):
+    """
+    one download journal per directory, like the index
+    """
+    journal_path = path.join(path.abspath(download_directory), JOURNAL_FILENAME)
+    if journal_path not in journals:
+        journals[journal_path] = DownloadJournal(journal_path)
+    return journals[journal_path]
+
+def _readLastFetchedTimestamp(index, download_directory, identity):
+    last_fetched = index.last_fetched(identity)
+    if last_fetched is None:
+        # take over the timestamp file of earlier versions
+        fetch_info_path = _create_fetch_info_path(download_directory, identity)
+        with open(fetch_info_path, 'r') as lastFetched:
+            last_fetched = lastFetched.read()
+        index.set_last_fetched(identity, last_fetched)
+        os.unlink(fetch_info_path)
+    return datetime.strptime(last_fetched, '%c')
+
+def _determineReferenceDate(index, download_directory, day_offset, identity):
     if not day_offset:
         try:
-            with open(_create_fetch_info_path(download_directory, identity), 'r') as lastFetched:
-                reference_date = datetime.strptime(lastFetched.read(), '%c')
+            reference_date = _readLastFetchedTimestamp(index, download_directory, identity)
         except IOError, e:
             logging.getLogger('main').warn('failed to read last updated timestamp. falling back to day_offset: %s' % e)
             day_offset = 7
@@ -31,11 +77,171 @@ def _determineReferenceDate(download_directory, day_offset, identity):
             
     return LOCAL_TIMEZONE.localize(reference_date)
 
-def _saveLastFetchedTimestamp(download_directory, identity):
-    with open(_create_fetch_info_path(download_directory, identity), 'w') as lastFetched:
-        lastFetched.write(datetime.strftime(datetime.now(tzlocal()), '%c'))
+def _saveLastFetchedTimestamp(index, identity, fetched=None):
+    from dateutil.tz import tzlocal
+    fetched = datetime.fromtimestamp(fetched, tzlocal()) if fetched else datetime.now(tzlocal())
+    index.set_last_fetched(identity, datetime.strftime(fetched, '%c'))
         
+def _update_last_fetched_timestamp(vdm, index, identity, num_updated):
+    if vdm.failed or vdm.deferred:
+        # the index keeps them, later runs download them however old
+        logging.getLogger('main').info('[%d] downloads of [%s] failed and [%d] were deferred, retrying them next run'
+                                       % (len(vdm.failed), identity, len(vdm.deferred)))
+    if num_updated > 0 or vdm.failed or vdm.deferred or index.last_fetched(identity) is None:
+        # a resumed batch is as new as the feed it was planned from, episodes published since are left to the next run
+        _saveLastFetchedTimestamp(index, identity, vdm.resumed.planned if vdm.resumed else None)
+
+def _create_rate_limiter(options):
+    if not (options.max_rate or options.max_rate_per_host):
+        return None
+    return RateLimiter(options.max_rate, options.max_rate_per_host)
+
+def _create_metrics(options):
+    sinks = []
+    if options.metrics_file:
+        sinks.append(JsonLinesSink(options.metrics_file))
+    if options.prometheus_file or options.prometheus_port:
+        sinks.append(PrometheusSink(options.prometheus_file, options.prometheus_port))
+    return Metrics(sinks)
+
+def _create_scheduler(options, subscriptions=()):
+    """
+    the scheduler of the download queue, predicting completion times at the expected rate or an equal share of the
+    max rate per download
+    """
+    rate = options.expected_rate or (options.max_rate / options.threads if options.max_rate else None)
+    tags = dict((subscription.url, FeedTags(subscription.priority, subscription.deadline * 3600 if subscription.deadline is not None else None))
+                for subscription in subscriptions)
+    return Scheduler(options.schedule, options.threads, rate, tags)
+
+def _create_parser(options):
+    """
+    the process pool parsing the feeds of --subscriptions, None unless more than one process is asked for
+    """
+    if not options.subscriptions or options.watch or options.parse_processes <= 1:
+        return None
+    return FeedParserPool(options.parse_processes)
+
+def _create_post_processor(options):
+    if not options.post_process:
+        return None
+    return PostProcessor([CommandHook(command) for command in options.post_process], options.post_process_workers,
+                         options.post_process_queue, options.metrics)
+
+def _create_policies(options, index, feed=None):
+    """
+    selection policies applied after the reference date. with a budget, only vodcasts of feed not downloaded yet count
+    """
+    policies = []
+    if options.title:
+        policies.append(TitleMatches(options.title))
+    if options.exclude_title:
+        policies.append(TitleMatches(options.exclude_title, exclude=True))
+    if options.newest or options.max_total_size:
+        policies.append(NotDownloaded(index, feed))
+    if options.newest:
+        policies.append(NewestN(options.newest))
+    if options.max_total_size:
+        policies.append(MaxTotalBytes(options.max_total_size))
+    return policies
+
+def _create_manager(rss_url, index, download_directory, options, transport=None, rate_limiter=None, parser=None, journal=None,
+                    scheduler=None):
+    return VodcastDownloadManager(rss_url, download_directory, options.threads, resume=options.resume, segments=options.segments,
+                                  transport=transport, feed_cache=IndexFeedCache(index, rss_url), index=index,
+                                  streaming=options.streaming, newest_first=options.newest_first, engine=options.engine,
+                                  max_per_host=options.max_per_host, rate_limiter=rate_limiter,
+                                  retry_policy=RetryPolicy(options.retries + 1) if options.retries > 0 else None,
+                                  write_policy=options.write_policy, metrics=options.metrics,
+                                  policies=_create_policies(options, index, rss_url if urlparse(rss_url or '').scheme else None),
+                                  retention=RetentionPolicy(options.keep_last, options.max_archive_size),
+                                  reserve=options.min_free_space or 0, probe_sizes=options.probe_sizes, parser=parser,
+                                  post_processor=options.post_processor, journal=journal, scheduler=scheduler)
+
+def _download_subscriptions(options):
+    subscriptions = load_subscriptions(options.subscriptions, options.download_directory, options.day_offset)
+    indexes = {}
+    index_of = {}
+    journals = {}
+    journal_of = {}
+    for subscription in subscriptions:
+        if not path.isdir(subscription.download_directory):
+            raise Exception('[%s] of subscription [%s] is not a directory' % (subscription.download_directory, subscription.url))
+        index_of[subscription] = _open_index(subscription.download_directory, indexes)
+        journal_of[subscription] = _open_journal(subscription.download_directory, journals)
+
+    parser = options.parser
+    rate_limiter = _create_rate_limiter(options)
+    transport = HttpTransport(rate_limiter=rate_limiter)
+    try:
+        batch = BatchDownloadManager(subscriptions,
+                                     lambda subscription: _create_manager(subscription.url, index_of[subscription], subscription.download_directory, options, transport, rate_limiter, parser, journal_of[subscription]),
+                                     options.threads, options.max_per_host if options.max_per_host is not None else SUBSCRIPTIONS_MAX_PER_HOST, engine=options.engine, rate_limiter=rate_limiter,
+                                     scheduler=_create_scheduler(options, subscriptions))
+    finally:
+        # every feed is parsed, once the managers are created
+        if parser:
+            parser.close()
+    # resumed batches need no reference date
+    reference_dates = dict((subscription, _determineReferenceDate(index_of[subscription], subscription.download_directory, subscription.day_offset, subscription.url))
+                           for subscription, vdm in zip(batch.subscriptions, batch.managers) if vdm is not None and not vdm.resumed)
+    num_updated = batch.download_all_newer(reference_dates)
+    for subscription, vdm in zip(batch.subscriptions, batch.managers):
+        if vdm is not None and not vdm.not_modified:
+            _update_last_fetched_timestamp(vdm, index_of[subscription], subscription.url, num_updated[subscription])
+
+def _watch(options):
+    """
+    poll the feed or all subscriptions until interrupted, each at an interval adapting to its publish history
+    """
+    if options.subscriptions:
+        subscriptions = load_subscriptions(options.subscriptions, options.download_directory, options.day_offset)
+    else:
+        subscriptions = [Subscription(options.rss_url, options.download_directory, options.day_offset)]
+    indexes = {}
+    journals = {}
+    rate_limiter = _create_rate_limiter(options)
+    transport = HttpTransport(rate_limiter=rate_limiter)
+    scheduler = _create_scheduler(options, subscriptions)
+
+    def create_manager(subscription):
+        index = _open_index(subscription.download_directory, indexes)
+        return _create_manager(subscription.url, index, subscription.download_directory, options, transport, rate_limiter,
+                               journal=_open_journal(subscription.download_directory, journals), scheduler=scheduler)
+
+    def download(subscription, vdm):
+        index = _open_index(subscription.download_directory, indexes)
+        reference_date = None if vdm.resumed else _determineReferenceDate(index, subscription.download_directory, subscription.day_offset, subscription.url)
+        num_updated = vdm.download_all_newer(reference_date)
+        _update_last_fetched_timestamp(vdm, index, subscription.url, num_updated)
+
+    try:
+        FeedWatcher(subscriptions, create_manager, download, options.min_interval * 60, options.max_interval * 60).run()
+    except KeyboardInterrupt:
+        logging.getLogger('main').info('stopped watching')
+    finally:
+        transport.close()
+
+def _verify_downloads(options):
+    """
+    re-check the downloads in the download directory or the directories of all subscriptions. returns the number of
+    corrupt or missing downloads
+    """
+    if options.subscriptions:
+        directories = [subscription.download_directory for subscription in load_subscriptions(options.subscriptions, options.download_directory)]
+    else:
+        directories = [options.download_directory]
+    corrupt = 0
+    for directory in sorted(set(path.abspath(directory) for directory in directories)):
+        results = verify_archive(_open_index(directory, {}), options.threads)
+        for result in results:
+            if not result.ok:
+                print('%s: %s' % (result.record.target, result.problem))
+        corrupt += len([result for result in results if not result.ok])
+    return corrupt
+
 def _checked_load_logging_config(config_path):
+    import logging.config
     expanded_config_path = path.expanduser(config_path)
     if not path.exists(expanded_config_path):
         raise Exception("failed to locate a logging configuration at [%s]. please check the location" % expanded_config_path)
@@ -45,6 +251,8 @@ def main(args):
     parser = OptionParser()
     parser.add_option("-u", "--url", dest="rss_url",
                       help="download vodcasts from feed URL", metavar="URL")
+    parser.add_option("-f", "--subscriptions", dest="subscriptions",
+                      help="download vodcasts from all feeds listed in FILE (OPML or one 'URL [DIR [DAYS]]' per line)", metavar="FILE")
     parser.add_option("-d", "--download-directory", dest="download_directory",
                       help="save vodcasts in DIR", metavar="DIR")
     parser.add_option("-o", "--day-offset", dest="day_offset",
@@ -53,18 +261,144 @@ def main(args):
     parser.add_option("-t", "--threads", dest="threads",
                       help="how many THREADS to use for download",
                       metavar="THREADS", type="int", default=1)
+    parser.add_option("-e", "--engine", dest="engine",
+                      help="download with a pool of THREADS ('threads') or on a single thread multiplexing all transfers ('events')",
+                      metavar="ENGINE", type="choice", choices=['threads', 'events'], default='threads')
+    parser.add_option("-m", "--max-per-host", dest="max_per_host",
+                      help="use at most CONNECTIONS parallel downloads per host (default: 2 with --subscriptions, otherwise no limit)",
+                      metavar="CONNECTIONS", type="int", default=None)
+    parser.add_option("--max-rate", dest="max_rate",
+                      help="download at most RATE bytes per second overall (suffixes k, M, G)", metavar="RATE")
+    parser.add_option("--max-rate-per-host", dest="max_rate_per_host",
+                      help="download at most RATE bytes per second from one host (suffixes k, M, G)", metavar="RATE")
+    parser.add_option("-r", "--resume",
+                      action="store_true", dest="resume", default=False,
+                      help="keep partial downloads and resume them on the next run")
+    parser.add_option("--retries", dest="retries",
+                      help="retry failed feed fetches and downloads up to RETRIES times, waiting longer after each failure",
+                      metavar="RETRIES", type="int", default=3)
+    parser.add_option("-s", "--segments", dest="segments",
+                      help="download large vodcasts over SEGMENTS parallel connections",
+                      metavar="SEGMENTS", type="int", default=1)
+    parser.add_option("--write-policy", dest="write_policy",
+                      help="write downloads directly ('direct'), to a .part file renamed when complete ('rename') or additionally synced to disk before the rename ('fsync')",
+                      metavar="POLICY", type="choice", choices=list(WRITE_POLICIES), default=WRITE_RENAME)
+    parser.add_option("--parse-processes", dest="parse_processes",
+                      help="with --subscriptions, parse the fetched feeds in PROCESSES parallel processes",
+                      metavar="PROCESSES", type="int", default=1)
+    parser.add_option("--schedule", dest="schedule",
+                      help="download in POLICY order: as 'planned' (per feed newest first), 'newest' first overall, 'smallest' first, a 'fair' share of bytes per feed or by 'deadline' (priority and deadline tags of the subscriptions). combine with --probe-sizes, where feeds do not announce the sizes",
+                      metavar="POLICY", type="choice", choices=sorted(SCHEDULING_POLICIES), default=SCHEDULE_PLANNED)
+    parser.add_option("--expected-rate", dest="expected_rate",
+                      help="predict the completion of the scheduled downloads at RATE bytes per second each (suffixes k, M, G, default: an equal share of --max-rate or 1M)", metavar="RATE")
+    parser.add_option("--post-process", dest="post_process", action="append",
+                      help="run COMMAND on every completed download, while the others are still downloading. {file}, {title}, {url} and {guid} are replaced by those of the download. may be given several times, the commands run in that order",
+                      metavar="COMMAND")
+    parser.add_option("--post-process-workers", dest="post_process_workers",
+                      help="post-process up to WORKERS downloads in parallel",
+                      metavar="WORKERS", type="int", default=1)
+    parser.add_option("--post-process-queue", dest="post_process_queue",
+                      help="let at most COUNT completed downloads wait for post-processing, pausing the downloads beyond that (default: twice the workers)",
+                      metavar="COUNT", type="int", default=None)
+    parser.add_option("--stream",
+                      action="store_true", dest="streaming", default=False,
+                      help="parse the feed incrementally, keeping only vodcasts newer than the reference date")
+    parser.add_option("--newest-first",
+                      action="store_true", dest="newest_first", default=False,
+                      help="with --stream, stop parsing at the first vodcast not newer than the reference date")
+    parser.add_option("-n", "--newest", dest="newest",
+                      help="download only the COUNT newest vodcasts not downloaded yet",
+                      metavar="COUNT", type="int", default=None)
+    parser.add_option("--max-total-size", dest="max_total_size",
+                      help="download only the newest vodcasts not downloaded yet, adding up to at most SIZE bytes per feed (suffixes k, M, G)", metavar="SIZE")
+    parser.add_option("--title", dest="title",
+                      help="download only vodcasts whose title matches REGEX", metavar="REGEX")
+    parser.add_option("--exclude-title", dest="exclude_title",
+                      help="skip vodcasts whose title matches REGEX", metavar="REGEX")
+    parser.add_option("--min-free-space", dest="min_free_space",
+                      help="leave at least SIZE bytes free in the download directory, skipping the oldest vodcasts that do not fit (suffixes k, M, G)", metavar="SIZE")
+    parser.add_option("--probe-sizes",
+                      action="store_true", dest="probe_sizes", default=False,
+                      help="ask the server for the size of enclosures the feed does not announce, before downloading")
+    parser.add_option("--keep-last", dest="keep_last",
+                      help="before downloading, delete all but the COUNT newest downloads of a feed",
+                      metavar="COUNT", type="int", default=None)
+    parser.add_option("--max-archive-size", dest="max_archive_size",
+                      help="before downloading, delete the oldest downloads until the directory holds at most SIZE bytes including the new ones (suffixes k, M, G)", metavar="SIZE")
+    parser.add_option("-w", "--watch",
+                      action="store_true", dest="watch", default=False,
+                      help="keep running and poll the feeds, each at an interval adapting to how often it publishes")
+    parser.add_option("--min-interval", dest="min_interval",
+                      help="with --watch, poll a feed at most every MINUTES",
+                      metavar="MINUTES", type="int", default=15)
+    parser.add_option("--max-interval", dest="max_interval",
+                      help="with --watch, poll a feed at least every MINUTES",
+                      metavar="MINUTES", type="int", default=24 * 60)
+    parser.add_option("--verify",
+                      action="store_true", dest="verify", default=False,
+                      help="instead of downloading, check the downloaded vodcasts against their stored size and checksum, marking corrupt ones for download")
+    parser.add_option("--metrics-file", dest="metrics_file",
+                      help="append metrics of feed fetches and downloads as JSON lines to FILE", metavar="FILE")
+    parser.add_option("--prometheus-file", dest="prometheus_file",
+                      help="write metrics in Prometheus text format to FILE", metavar="FILE")
+    parser.add_option("--prometheus-port", dest="prometheus_port",
+                      help="serve metrics in Prometheus text format at http://localhost:PORT/metrics", metavar="PORT", type="int")
     parser.add_option("-v", "--verbose",
                       action="count", dest="verbose",
                       help="print status messages to stdout more verbose")
 
     (options, remaining_args) = parser.parse_args(args)
 
-    if not (options.rss_url and options.download_directory):
+    if options.subscriptions:
+        if not path.isfile(options.subscriptions):
+            parser.error('[%s] is not a file' % options.subscriptions)
+    elif options.verify and not options.download_directory:
+        parser.error('directory is required')
+    elif not options.verify and not (options.rss_url and options.download_directory):
         parser.error('url and directory are required')
-        
-    if not path.isdir(options.download_directory):
+
+    if options.download_directory and not path.isdir(options.download_directory):
         parser.error('[%s] is not a directory' % options.download_directory)
 
+    try:
+        options.max_rate = parse_rate(options.max_rate)
+        options.max_rate_per_host = parse_rate(options.max_rate_per_host)
+        options.expected_rate = parse_rate(options.expected_rate)
+    except ValueError, e:
+        parser.error('invalid rate: %s' % e)
+
+    try:
+        options.max_total_size = parse_rate(options.max_total_size)
+        options.min_free_space = parse_rate(options.min_free_space)
+        options.max_archive_size = parse_rate(options.max_archive_size)
+    except ValueError, e:
+        parser.error('invalid size: %s' % e)
+
+    if options.newest is not None and options.newest < 1:
+        parser.error('newest must be positive')
+
+    if options.keep_last is not None and options.keep_last < 0:
+        parser.error('keep last must not be negative')
+
+    for pattern in (options.title, options.exclude_title):
+        try:
+            re.compile(pattern or '')
+        except re.error, e:
+            parser.error('invalid title pattern [%s]: %s' % (pattern, e))
+
+    if options.post_process_workers < 1 or (options.post_process_queue is not None and options.post_process_queue < 1):
+        parser.error('post process workers and queue must be positive')
+
+    for command in options.post_process or ():
+        try:
+            if not shlex.split(command):
+                parser.error('empty post process command')
+        except ValueError, e:
+            parser.error('invalid post process command [%s]: %s' % (command, e))
+
+    if options.min_interval < 1 or options.min_interval > options.max_interval:
+        parser.error('min interval must be positive and not above the max interval')
+
     if options.verbose > 1:
         _checked_load_logging_config("~/.python/logging_debug.conf")
     elif options.verbose:
@@ -72,12 +406,41 @@ def main(args):
     else:
         logging.basicConfig(stream=sys.stdout, level=logging.WARN)
 
-    vdm = VodcastDownloadManager(options.rss_url, options.download_directory, options.threads)
+    if options.verify:
+        return 1 if _verify_downloads(options) else 0
+
+    # the parser workers are forked, before the metrics and post processing threads start
+    options.parser = _create_parser(options)
+    options.metrics = _create_metrics(options)
+    options.post_processor = _create_post_processor(options)
+    try:
+        _download(options)
+    finally:
+        if options.post_processor:
+            options.post_processor.close()
+        options.metrics.close()
+        if options.parser:
+            options.parser.close()
+
+def _download(options):
+    if options.watch:
+        _watch(options)
+        return
+
+    if options.subscriptions:
+        _download_subscriptions(options)
+        return
+
+    index = _open_index(options.download_directory, {})
+    vdm = _create_manager(options.rss_url, index, options.download_directory, options, rate_limiter=_create_rate_limiter(options),
+                          journal=_open_journal(options.download_directory, {}), scheduler=_create_scheduler(options))
+    if vdm.not_modified and not vdm.retries:
+        logging.getLogger('main').info('feed [%s] not modified since last run' % options.rss_url)
+        return
 
-    reference_date = _determineReferenceDate(options.download_directory, options.day_offset, options.rss_url)
+    reference_date = None if vdm.resumed else _determineReferenceDate(index, options.download_directory, options.day_offset, options.rss_url)
     num_updated = vdm.download_all_newer(reference_date)
-    if num_updated > 0 or not path.exists(_create_fetch_info_path(options.download_directory, options.rss_url)):
-        _saveLastFetchedTimestamp(options.download_directory, options.rss_url)
+    _update_last_fetched_timestamp(vdm, index, options.rss_url, num_updated)
 
 if __name__ == '__main__':
-    main(sys.argv)
+    sys.exit(main(sys.argv))
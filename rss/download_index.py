@@ -0,0 +1,187 @@
+import logging
+import sqlite3
+import threading
+import time
+
+INDEX_FILENAME = '.download_index.sqlite'
+
+STARTED = 'started'
+COMPLETED = 'completed'
+FAILED = 'failed'
+# removed by the retention policy, not to be downloaded again
+EVICTED = 'evicted'
+# skipped for lack of space, to be downloaded by a later run
+DEFERRED = 'deferred'
+# downloaded again by the next run, however old
+RETRIED = (FAILED, DEFERRED)
+
+# items keyed by (feed, key) since version 1, by key alone before
+SCHEMA_VERSION = 1
+ITEM_COLUMNS = 'key, feed, url, target, size, checksum, etag, state, updated'
+# keys looked up per query, below the variable limit of older sqlite versions
+KEYS_PER_QUERY = 500
+
+class IndexRecord:
+    def __init__(self, key, feed, url, target, size, checksum, etag, state, updated):
+        self.key = key
+        # items of no known feed are stored with an empty feed, the key column being part of the primary key
+        self.feed = feed or None
+        self.url = url
+        self.target = target
+        self.size = size
+        self.checksum = checksum
+        self.etag = etag
+        self.state = state
+        self.updated = updated
+
+    @property
+    def completed(self):
+        return self.state == COMPLETED
+
+    @property
+    def evicted(self):
+        return self.state == EVICTED
+
+    def __str__(self):
+        return '%s(key=%s, target=%s, size=%s, state=%s)' % (self.__class__, self.key, self.target, self.size, self.state)
+    def __repr__(self):
+        return str(self)
+
+class DownloadIndex:
+    """
+    sqlite index of downloaded items keyed by feed and guid (or enclosure url), holding target, size, checksum, ETag
+    and the state of the download. feeds may use the same guids. it also keeps the per feed state (last fetch
+    timestamp and feed cache).
+
+    the index is shared between download threads, every access is serialized.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.log = logging.getLogger('DownloadIndex')
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._migrate()
+            self._connection.executescript('''
+                CREATE TABLE IF NOT EXISTS items (
+                    key TEXT NOT NULL, feed TEXT NOT NULL, url TEXT, target TEXT, size INTEGER, checksum TEXT, etag TEXT,
+                    state TEXT NOT NULL, updated REAL NOT NULL, PRIMARY KEY (feed, key));
+                CREATE INDEX IF NOT EXISTS items_target ON items (target);
+                CREATE TABLE IF NOT EXISTS feeds (
+                    url TEXT PRIMARY KEY, last_fetched TEXT, feed_cache TEXT);
+                PRAGMA user_version = %d;
+                ''' % SCHEMA_VERSION)
+            self._connection.commit()
+
+    def _migrate(self):
+        """
+        rebuild the items table of an index keyed by key alone
+        """
+        version = self._connection.execute('PRAGMA user_version').fetchone()[0]
+        exists = self._connection.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'items'").fetchone()
+        if not exists or version >= SCHEMA_VERSION:
+            return
+        self.log.info('migrating download index [%s] to version %d' % (self.path, SCHEMA_VERSION))
+        self._connection.executescript('''
+            DROP INDEX IF EXISTS items_target;
+            ALTER TABLE items RENAME TO items_unversioned;
+            CREATE TABLE items (
+                key TEXT NOT NULL, feed TEXT NOT NULL, url TEXT, target TEXT, size INTEGER, checksum TEXT, etag TEXT,
+                state TEXT NOT NULL, updated REAL NOT NULL, PRIMARY KEY (feed, key));
+            INSERT INTO items (%(columns)s) SELECT key, COALESCE(feed, ''), url, target, size, checksum, etag, state, updated FROM items_unversioned;
+            DROP TABLE items_unversioned;
+            ''' % {'columns' : ITEM_COLUMNS})
+
+    def get(self, key, feed=None):
+        row = self._query_one('SELECT %s FROM items WHERE feed = ? AND key = ?' % ITEM_COLUMNS, (feed or '', key))
+        return IndexRecord(*row) if row else None
+
+    def records(self, state=COMPLETED):
+        with self._lock:
+            rows = self._connection.execute('SELECT %s FROM items WHERE state = ? ORDER BY target' % ITEM_COLUMNS, (state,)).fetchall()
+        return [IndexRecord(*row) for row in rows]
+
+    def keys(self, feed, states, keys=None):
+        """
+        keys of the items of feed in one of states. given keys, only those are looked up (through the primary key),
+        however many items the archive holds
+        """
+        query = 'SELECT key FROM items WHERE feed = ? AND state IN (%s)' % ', '.join('?' * len(states))
+        parameters = (feed or '',) + tuple(states)
+        if keys is None:
+            with self._lock:
+                return set(row[0] for row in self._connection.execute(query, parameters).fetchall())
+        keys = list(set(keys))
+        found = set()
+        with self._lock:
+            for first in range(0, len(keys), KEYS_PER_QUERY):
+                chunk = tuple(keys[first:first + KEYS_PER_QUERY])
+                rows = self._connection.execute(query + ' AND key IN (%s)' % ', '.join('?' * len(chunk)), parameters + chunk).fetchall()
+                found.update(row[0] for row in rows)
+        return found
+
+    def owner_of(self, target):
+        """
+        (feed, key) of the item stored in target, None if no item uses target
+        """
+        row = self._query_one('SELECT feed, key FROM items WHERE target = ?', (target,))
+        return (row[0] or None, row[1]) if row else None
+
+    def mark_started(self, key, feed, url, target):
+        self._execute('INSERT OR REPLACE INTO items (key, feed, url, target, state, updated) VALUES (?, ?, ?, ?, ?, ?)',
+                      (key, feed or '', url, target, STARTED, time.time()))
+
+    def mark_completed(self, key, size, checksum=None, etag=None, feed=None, url=None, target=None):
+        record = self.get(key, feed)
+        if record is None:
+            self._execute('INSERT INTO items (%s) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)' % ITEM_COLUMNS,
+                          (key, feed or '', url, target, size, checksum, etag, COMPLETED, time.time()))
+        else:
+            self._execute('UPDATE items SET size = ?, checksum = ?, etag = ?, state = ?, updated = ? WHERE feed = ? AND key = ?',
+                          (size, checksum, etag, COMPLETED, time.time(), feed or '', key))
+
+    def mark_failed(self, key, feed=None):
+        self._set_state(key, feed, FAILED)
+
+    def mark_deferred(self, key, feed, url):
+        self._execute('INSERT OR REPLACE INTO items (key, feed, url, state, updated) VALUES (?, ?, ?, ?, ?)',
+                      (key, feed or '', url, DEFERRED, time.time()))
+
+    def mark_evicted(self, key, feed=None):
+        self._set_state(key, feed, EVICTED)
+
+    def _set_state(self, key, feed, state):
+        self._execute('UPDATE items SET state = ?, updated = ? WHERE feed = ? AND key = ?', (state, time.time(), feed or '', key))
+
+    def last_fetched(self, feed):
+        row = self._query_one('SELECT last_fetched FROM feeds WHERE url = ?', (feed,))
+        return row[0] if row else None
+
+    def set_last_fetched(self, feed, last_fetched):
+        self._upsert_feed(feed, 'last_fetched', last_fetched)
+
+    def feed_cache(self, feed):
+        row = self._query_one('SELECT feed_cache FROM feeds WHERE url = ?', (feed,))
+        return row[0] if row else None
+
+    def set_feed_cache(self, feed, feed_cache):
+        self._upsert_feed(feed, 'feed_cache', feed_cache)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def _upsert_feed(self, feed, column, value):
+        with self._lock:
+            self._connection.execute('INSERT OR IGNORE INTO feeds (url) VALUES (?)', (feed,))
+            self._connection.execute('UPDATE feeds SET %s = ? WHERE url = ?' % column, (value, feed))
+            self._connection.commit()
+
+    def _execute(self, statement, parameters):
+        with self._lock:
+            self._connection.execute(statement, parameters)
+            self._connection.commit()
+
+    def _query_one(self, statement, parameters):
+        with self._lock:
+            return self._connection.execute(statement, parameters).fetchone()
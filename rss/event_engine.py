@@ -0,0 +1,586 @@
+"""
+single threaded download engine. it multiplexes many HTTP transfers (vodcast downloads and plain fetches) over
+non blocking sockets with asyncore, instead of parking one thread per transfer like DownloadPool.
+"""
+import asyncore
+import httplib
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+from StringIO import StringIO
+from urllib import addinfourl
+from urllib2 import HTTPError
+from urlparse import urlparse, urljoin
+from rate_limit import THROTTLING_CODES, parse_retry_after
+from retry import IncompleteTransferError
+from integrity import file_checksum
+from storage import BlockWriter
+from rss_feed_downloader import DownloadResult, DownloadProgressHook, UserInterrupted, PART_SUFFIX, VALIDATORS_SUFFIX, BLOCK_SIZE, _validators_of
+
+MAX_HEADER_SIZE = 64 * 1024
+REDIRECT_CODES = (301, 302, 303, 307)
+
+class HttpTransfer(asyncore.dispatcher):
+    """
+    one HTTP/1.0 GET over a non blocking socket. the server closes the connection after the response, so the body
+    needs no chunked decoding. the handler is told about the response head (headers_received, returning False stops
+    the transfer), every body block (data_received) and, exactly once, the end of the transfer (finished).
+
+    like urllib2 responses, a transfer answers getcode() and info() once the head was received.
+
+    with a RateLimiter, the transfer stops reading until the limiter allows more bytes (see readable).
+    """
+    def __init__(self, url, headers, handler, socket_map, buffer_size=BLOCK_SIZE, rate_limiter=None):
+        asyncore.dispatcher.__init__(self, map=socket_map)
+        self.url = url
+        self.handler = handler
+        self.buffer_size = buffer_size
+        self.rate_limiter = rate_limiter
+        self.paused_until = 0
+        self.status = None
+        self.reason = None
+        self.message = None
+        self.length = None
+        self.received = 0
+        self.done = False
+        self.last_activity = time.time()
+        self._incoming = ''
+        parsed = urlparse(url)
+        self.host = parsed.hostname
+        path = parsed.path or '/'
+        if parsed.query:
+            path += '?' + parsed.query
+        lines = ['GET %s HTTP/1.0' % path, 'Host: %s' % parsed.netloc, 'Connection: close']
+        lines.extend('%s: %s' % header for header in (headers or {}).items())
+        self._outgoing = '\r\n'.join(lines) + '\r\n\r\n'
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            self.connect((parsed.hostname, parsed.port or 80))
+        except:
+            self.close()
+            raise
+
+    def getcode(self):
+        return self.status
+
+    def geturl(self):
+        return self.url
+
+    def info(self):
+        return self.message
+
+    def readable(self):
+        return time.time() >= self.paused_until
+
+    def writable(self):
+        return not self.connected or bool(self._outgoing)
+
+    def handle_connect(self):
+        pass
+
+    def handle_write(self):
+        sent = self.send(self._outgoing)
+        self._outgoing = self._outgoing[sent:]
+        self.last_activity = time.time()
+
+    def handle_read(self):
+        data = self.recv(self.buffer_size)
+        if not data or self.done:
+            return
+        self.last_activity = time.time()
+        if self.rate_limiter:
+            self.paused_until = self.last_activity + self.rate_limiter.delay(self.host, len(data))
+            self.last_activity = max(self.last_activity, self.paused_until)
+        if self.message is None:
+            self._incoming += data
+            end = self._incoming.find('\r\n\r\n')
+            if end < 0:
+                if len(self._incoming) > MAX_HEADER_SIZE:
+                    raise IOError('response head of [%s] exceeds %d bytes' % (self.url, MAX_HEADER_SIZE))
+                return
+            data = self._incoming[end + 4:]
+            self._parse_head(self._incoming[:end + 2])
+            self._incoming = ''
+            if self.handler.headers_received(self) is False or self.status in (204, 304) or self.length == 0:
+                self.finish()
+                return
+        if data:
+            self.received += len(data)
+            self.handler.data_received(self, data)
+        if self.length is not None and self.received >= self.length:
+            self.finish()
+
+    def handle_close(self):
+        if self.message is None:
+            self.finish(IOError('connection to [%s] closed before a response was received' % self.url))
+        elif self.length is not None and self.received < self.length:
+            self.finish(IncompleteTransferError('incomplete download of [%s]: got %d of %d bytes' % (self.url, self.received, self.length)))
+        else:
+            self.finish()
+
+    def handle_error(self):
+        self.finish(sys.exc_info()[1])
+
+    def finish(self, error=None):
+        if self.done:
+            return
+        self.done = True
+        self.close()
+        self.handler.finished(self, error)
+
+    def cancel(self):
+        """
+        close the connection without telling the handler
+        """
+        self.done = True
+        self.close()
+
+    def _parse_head(self, head):
+        status_line, _, header_block = head.partition('\r\n')
+        parts = status_line.split(None, 2)
+        if len(parts) < 2 or not parts[0].startswith('HTTP/') or not parts[1].isdigit():
+            raise IOError('malformed status line from [%s]: %r' % (self.url, status_line))
+        self.status = int(parts[1])
+        self.reason = parts[2] if len(parts) > 2 else ''
+        self.message = httplib.HTTPMessage(StringIO(header_block))
+        if self.message.getheader('Content-Length', '').isdigit():
+            self.length = int(self.message.getheader('Content-Length'))
+        retry_after = parse_retry_after(self.message.getheader('Retry-After'))
+        if self.rate_limiter and self.status in THROTTLING_CODES and retry_after:
+            self.rate_limiter.defer(self.host, retry_after)
+
+
+class _Job:
+    """
+    base of the units of work the engine runs. a job is started once its host has a free slot and tells the
+    engine with done() when it is over.
+    """
+    def __init__(self, engine, url):
+        self.engine = engine
+        self.url = url
+        self.host = urlparse(url).hostname
+        self.transfer = None
+        self.redirects = 0
+        self.not_before = 0
+
+    def open(self, url, headers=None):
+        self.transfer = HttpTransfer(url, headers, self, self.engine.socket_map, self.engine.buffer_size, self.engine.rate_limiter)
+
+    def follow(self, transfer):
+        """
+        start the request again at the location transfer was redirected to. returns False, if transfer was no redirect
+        """
+        location = transfer.info().getheader('Location')
+        if transfer.getcode() not in REDIRECT_CODES or not location:
+            return False
+        self.redirects += 1
+        if self.redirects > self.engine.max_redirects:
+            raise HTTPError(transfer.url, transfer.getcode(), 'too many redirects', transfer.info(), None)
+        self.url = urljoin(transfer.url, location)
+        self.engine.move(self, urlparse(self.url).hostname)
+        return True
+
+    @property
+    def plain_http(self):
+        """
+        whether the engine can fetch url itself. HttpTransfer only speaks plain http
+        """
+        return urlparse(self.url).scheme == 'http'
+
+    def timed_out(self, now):
+        return self.transfer is not None and not self.transfer.done and now - self.transfer.last_activity > self.engine.timeout
+
+    def poll(self, now):
+        if self.timed_out(now):
+            self.transfer.finish(socket.timeout('no data from [%s] for %d seconds' % (self.transfer.url, self.engine.timeout)))
+
+    def cancel(self):
+        if self.transfer is not None:
+            self.transfer.cancel()
+
+    def headers_received(self, transfer):
+        pass
+
+    def data_received(self, transfer, data):
+        pass
+
+
+class _FetchJob(_Job):
+    def __init__(self, engine, url, callback, headers):
+        _Job.__init__(self, engine, url)
+        self.callback = callback
+        self.headers = headers
+        self.body = []
+
+    def start(self):
+        self.open(self.url, self.headers)
+
+    def headers_received(self, transfer):
+        if transfer.getcode() in REDIRECT_CODES:
+            return False
+
+    def data_received(self, transfer, data):
+        self.body.append(data)
+
+    def finished(self, transfer, error):
+        try:
+            if error is None and self.follow(transfer):
+                if not self.plain_http:
+                    raise IOError('[%s] redirected to [%s], which the events engine cannot fetch' % (transfer.url, self.url))
+                self.body = []
+                self.open(self.url, self.headers)
+                return
+            if error is None and transfer.getcode() >= 400:
+                error = HTTPError(transfer.url, transfer.getcode(), transfer.reason, transfer.info(), None)
+        except Exception as e:
+            error = e
+        self.engine.done(self)
+        if error is not None:
+            self.callback(None, error)
+        else:
+            self.callback(addinfourl(StringIO(''.join(self.body)), transfer.info(), transfer.url, transfer.getcode()), None)
+
+
+class _DownloadJob(_Job):
+    """
+    download the enclosure of a vodcast into a .part file, renamed to the target once complete. with a resuming
+    downloader, a .part file with validators left by an earlier run is continued with a Range request.
+
+    with the retry policy of the downloader, failed attempts are queued again and continue their .part file. with its
+    checksum algorithm, the blocks are hashed as they arrive and verified once the transfer is finished.
+    """
+    def __init__(self, engine, downloader, vodcast, callback):
+        _Job.__init__(self, engine, vodcast.url)
+        self.downloader = downloader
+        self.vodcast = vodcast
+        self.callback = callback
+        self.log = logging.getLogger('EventLoopDownloadEngine')
+        self.target_filename = None
+        self.part = None
+        self.offset = 0
+        self.validators = None
+        self.checksum = None
+        self.reporter = None
+        self.restart = False
+        self.complete = False
+        self.attempt = 1
+        self.started = None
+        self.trace = None
+
+    @property
+    def part_filename(self):
+        return self.target_filename + PART_SUFFIX
+
+    def start(self):
+        self.started = time.time()
+        self.offset = 0
+        self.validators = None
+        self.checksum = None
+        if self.attempt == 1:
+            self.trace = self.downloader.start_trace(self.vodcast)
+            self.target_filename = self.downloader.prepare(self.vodcast)
+            if self.target_filename is None:
+                self._succeed()
+                return
+            if os.path.exists(self.target_filename):
+                self.log.warn('skipping already existing file [%s]' % self.target_filename)
+                self.downloader.completed(self.vodcast)
+                self._succeed()
+                return
+        self.trace.attempt()
+        if self.downloader.resume or self.attempt > 1:
+            self.validators = self.downloader._load_validators(self.target_filename)
+            if self.validators and os.path.exists(self.part_filename):
+                self.offset = os.path.getsize(self.part_filename)
+        self._request()
+
+    def _request(self):
+        headers = {}
+        if self.offset:
+            headers['Range'] = 'bytes=%d-' % self.offset
+            if_range = self.validators.get('etag') or self.validators.get('last_modified')
+            if if_range:
+                headers['If-Range'] = if_range
+        self.log.debug('downloading [%s] to [%s] at byte %d.' % (self.url, self.target_filename, self.offset))
+        self.open(self.url, headers)
+
+    def headers_received(self, transfer):
+        status = transfer.getcode()
+        if status in REDIRECT_CODES:
+            return False
+        if status == 416 and self.offset:
+            self.complete = self.offset == self.validators.get('length')
+            self.restart = not self.complete
+            return False
+        if status >= 400:
+            raise HTTPError(transfer.url, status, transfer.reason, transfer.info(), None)
+        self.trace.responded()
+        current = _validators_of(transfer)
+        if self.offset and not self.downloader._can_continue(transfer, self.offset, self.validators, current):
+            self.log.warn('cannot resume [%s] at byte %d (server ignored range or validators changed). restarting' % (self.url, self.offset))
+            self.offset = 0
+            if status == 206:
+                self.restart = True
+                return False
+        if self.offset:
+            self.log.info('resuming [%s] at byte %d' % (self.url, self.offset))
+        else:
+            self.validators = current
+            if self.downloader.resume or self.downloader.retry_policy:
+                self.downloader._save_validators(self.target_filename, current)
+        self.part = BlockWriter(self.part_filename, self.offset, self.validators.get('length'), self.downloader.preallocate)
+        self.checksum = self.downloader.create_checksum(transfer, self.part_filename, self.offset)
+        self.reporter = DownloadProgressHook(self.target_filename)
+        self.reporter.report_hook(0, BLOCK_SIZE, self.validators.get('length') or -1)
+        self.reporter.actual = self.offset
+
+    def data_received(self, transfer, data):
+        self.part.write(data)
+        self.trace.transferred(len(data))
+        if self.checksum:
+            self.checksum.update(data)
+        self.reporter.report_hook(1, len(data), self.reporter.total)
+
+    def finished(self, transfer, error):
+        self._close_part()
+        try:
+            if error is None and self.follow(transfer):
+                if not self.plain_http:
+                    self.log.info('[%s] redirected to [%s], downloading on a helper thread' % (transfer.url, self.url))
+                    self.engine.replace(self, _ThreadedDownloadJob(self.engine, self.downloader, self.vodcast, self.callback))
+                    return
+                self._request()
+                return
+            if error is None and self.restart:
+                self.restart = False
+                self.offset = 0
+                self._request()
+                return
+            if error is None and not self.complete:
+                self.downloader.verify(self.url, self.checksum, self.validators.get('length'), self.target_filename)
+        except Exception as e:
+            error = e
+        if error is not None:
+            self._fail(error)
+            return
+        checksum = self.checksum.checksum if self.checksum else None
+        if self.complete:
+            self.log.info('[%s] already complete, finishing download' % self.part_filename)
+            if self.downloader.checksum_algorithm:
+                checksum = file_checksum(self.part_filename, self.downloader.checksum_algorithm)
+        self.downloader.commit(self.part_filename, self.target_filename)
+        if os.path.exists(self.target_filename + VALIDATORS_SUFFIX):
+            os.unlink(self.target_filename + VALIDATORS_SUFFIX)
+        self.downloader.completed(self.vodcast, self.validators.get('etag'), checksum, self.trace)
+        self._succeed()
+
+    def cancel(self):
+        _Job.cancel(self)
+        self._close_part()
+        if self.target_filename is None:
+            return
+        if self.downloader.resume:
+            if os.path.exists(self.part_filename):
+                self.log.warn('keeping [%s] after user interrupt' % self.part_filename)
+        else:
+            self.downloader.discard_partial(self.target_filename)
+        self.downloader.failed(self.vodcast, self.trace)
+
+    def _close_part(self):
+        if self.part is not None:
+            self.part.close()
+            self.part = None
+
+    def _succeed(self):
+        self.engine.done(self)
+        self.callback(DownloadResult(self.vodcast, self.vodcast.target_filename))
+
+    def _fail(self, error):
+        policy = self.downloader.retry_policy
+        delay = policy.retry_delay(self.attempt, error) if policy and self.target_filename else None
+        if delay is not None:
+            self.log.warn('attempt %d/%d to download [%s] failed after %.2fs, retrying in %.1fs: %s' % (self.attempt, policy.attempts, self.vodcast.url, time.time() - self.started, delay, error))
+            self.attempt += 1
+            self.url = self.vodcast.url
+            self.redirects = 0
+            self.engine.retry(self, delay)
+            return
+        if self.target_filename is not None and not self.downloader.resume:
+            self.downloader.discard_partial(self.target_filename)
+        self.downloader.failed(self.vodcast, self.trace)
+        self.engine.done(self)
+        self.log.error('failed to download %s: %s' % (self.vodcast, error))
+        self.callback(DownloadResult(self.vodcast, error=error))
+
+
+class _ThreadedDownloadJob(_Job):
+    """
+    hand vodcasts the engine cannot fetch itself (https, local files) to downloader.download on a helper thread
+    """
+    def __init__(self, engine, downloader, vodcast, callback):
+        _Job.__init__(self, engine, vodcast.url)
+        self.downloader = downloader
+        self.vodcast = vodcast
+        self.callback = callback
+        self.result = None
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._download, name='download-%s' % self.vodcast.local_filename)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _download(self):
+        try:
+            self.result = DownloadResult(self.vodcast, self.downloader.download(self.vodcast))
+        except Exception as e:
+            logging.getLogger('EventLoopDownloadEngine').error('failed to download %s: %s' % (self.vodcast, e))
+            self.result = DownloadResult(self.vodcast, error=e)
+
+    def poll(self, now):
+        if not self.thread.is_alive():
+            self.engine.done(self)
+            self.callback(self.result)
+
+    def finished(self, transfer, error):
+        self.engine.done(self)
+        self.callback(DownloadResult(self.vodcast, error=error))
+
+
+class EventLoopDownloadEngine:
+    """
+    single threaded alternative to DownloadPool, keeping up to max_transfers downloads and fetches in flight at
+    once, at most max_per_host of them against the same host.
+
+    download() and fetch() only queue their work, run_until_complete() runs the event loop until all of it is done,
+    calling back with the results on the calling thread. run() is the synchronous drop-in for DownloadPool.run.
+
+    Ctrl-C cancels every transfer. partial downloads of resuming downloaders are kept with their validators, so the
+    next run continues them.
+
+    a RateLimiter shapes the bandwidth of all transfers. jobs for hosts that asked to retry later are held back
+    until then.
+    """
+    def __init__(self, max_transfers=100, max_per_host=None, buffer_size=256 * 1024, timeout=30, max_redirects=5, rate_limiter=None):
+        self.max_transfers = max(1, max_transfers or 1)
+        self.rate_limiter = rate_limiter
+        self.max_per_host = max_per_host
+        self.buffer_size = buffer_size
+        self.timeout = timeout
+        self.max_redirects = max_redirects
+        self.log = logging.getLogger('EventLoopDownloadEngine')
+        self.socket_map = {}
+        self.queued = []
+        self.running = []
+        self._active_per_host = {}
+
+    def download(self, downloader, vodcast, callback):
+        """
+        queue the download of vodcast. callback is called with its DownloadResult
+        """
+        downloader.queued(vodcast)
+        if urlparse(vodcast.url).scheme == 'http':
+            self.queued.append(_DownloadJob(self, downloader, vodcast, callback))
+        else:
+            self.queued.append(_ThreadedDownloadJob(self, downloader, vodcast, callback))
+
+    def fetch(self, url, callback, headers=None):
+        """
+        queue a GET of the http url. callback is called with (response, error), response being a urllib2 like
+        response holding the whole body
+        """
+        self.queued.append(_FetchJob(self, url, callback, headers))
+
+    def run(self, jobs):
+        jobs = list(jobs)
+        results = [None] * len(jobs)
+        def store(index, result):
+            results[index] = result
+        for index, (downloader, vodcast) in enumerate(jobs):
+            self.log.info('[%03d] downloading %s...' % (index, vodcast))
+            self.download(downloader, vodcast, lambda result, index=index: store(index, result))
+        self.run_until_complete()
+        return results
+
+    def run_until_complete(self):
+        try:
+            while self.queued or self.running:
+                self._start_queued()
+                if self.socket_map:
+                    asyncore.loop(timeout=self._poll_timeout(), map=self.socket_map, count=1)
+                else:
+                    time.sleep(0.05)
+                now = time.time()
+                for job in list(self.running):
+                    job.poll(now)
+        except KeyboardInterrupt:
+            self.cancel()
+            raise UserInterrupted('User interrupted')
+
+    def cancel(self):
+        running, self.running = self.running, []
+        queued, self.queued = self.queued, []
+        self.log.warn('cancelling %d transfers and %d queued jobs' % (len(running), len(queued)))
+        self._active_per_host = {}
+        for job in running + queued:
+            job.cancel()
+        self.socket_map.clear()
+
+    def retry(self, job, delay):
+        """
+        queue job again to be started in delay seconds
+        """
+        self.done(job)
+        job.not_before = time.time() + delay
+        self.queued.insert(0, job)
+
+    def replace(self, job, replacement):
+        """
+        end job and start replacement, a job for the same vodcast, in its place
+        """
+        self.done(job)
+        self.queued.insert(0, replacement)
+
+    def move(self, job, host):
+        """
+        charge the slot of job to host, the one it was redirected to
+        """
+        if job in self.running:
+            self._active_per_host[job.host] -= 1
+            self._active_per_host[host] = self._active_per_host.get(host, 0) + 1
+        job.host = host
+
+    def done(self, job):
+        if job in self.running:
+            self.running.remove(job)
+            self._active_per_host[job.host] -= 1
+
+    def _poll_timeout(self):
+        """
+        wake up in time for the earliest transfer paused by the rate limiter
+        """
+        now = time.time()
+        paused = [transfer.paused_until - now for transfer in self.socket_map.values() if transfer.paused_until > now]
+        return max(0.001, min([0.2] + paused))
+
+    def _start_queued(self):
+        now = time.time()
+        for job in list(self.queued):
+            if len(self.running) >= self.max_transfers:
+                return
+            if job.not_before > now:
+                continue
+            if self.max_per_host and self._active_per_host.get(job.host, 0) >= self.max_per_host:
+                continue
+            if self.rate_limiter and self.rate_limiter.wait_time(job.host) > 0:
+                continue
+            self.queued.remove(job)
+            self.running.append(job)
+            self._active_per_host[job.host] = self._active_per_host.get(job.host, 0) + 1
+            try:
+                job.start()
+            except Exception as e:
+                job.finished(job.transfer, e)
@@ -0,0 +1,56 @@
+import json
+import logging
+import os
+
+class FeedCache:
+    """
+    per feed cache of the ETag and Last-Modified validators of the last fetch together with the parsed entries
+    (as Vodcast records), stored as json file.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.log = logging.getLogger('FeedCache')
+        self.etag = None
+        self.modified = None
+        self.entries = []
+
+    def load(self):
+        try:
+            cache = json.loads(self._read())
+        except (IOError, TypeError, ValueError) as e:
+            self.log.debug('no usable feed cache at [%s]: %s' % (self.path, e))
+            return False
+        self.etag = cache.get('etag')
+        self.modified = cache.get('modified')
+        self.entries = cache.get('entries', [])
+        return True
+
+    def save(self, etag, modified, entries):
+        self.etag = etag
+        self.modified = modified
+        self.entries = entries
+        self._write(json.dumps({'etag' : etag, 'modified' : modified, 'entries' : entries}))
+
+    def _read(self):
+        with open(self.path, 'r') as cache_file:
+            return cache_file.read()
+
+    def _write(self, content):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as cache_file:
+            cache_file.write(content)
+        os.rename(temp_path, self.path)
+
+class IndexFeedCache(FeedCache):
+    """
+    feed cache kept in the feeds table of a DownloadIndex instead of a file of its own
+    """
+    def __init__(self, index, feed):
+        FeedCache.__init__(self, feed)
+        self.index = index
+
+    def _read(self):
+        return self.index.feed_cache(self.path)
+
+    def _write(self, content):
+        self.index.set_feed_cache(self.path, content)
@@ -0,0 +1,92 @@
+import logging
+from calendar import timegm
+from xml.etree import cElementTree
+
+class StreamedEnclosure:
+    def __init__(self, href, type, length=None):
+        self.href = href
+        self.type = type
+        self.length = length
+
+class StreamedItem:
+    """
+    the parts of a feed entry a Vodcast is created from, looking like a feedparser entry
+    """
+    def __init__(self):
+        self.title = None
+        self.id = None
+        self.description = None
+        self.updated_parsed = None
+        self.enclosures = []
+
+def iter_feed_items(source):
+    """
+    lazily parse the RSS items (or Atom entries) of source, a file name or file like object. every item is released
+    right after it was yielded, so memory does not grow with the size of the feed.
+    """
+    parents = []
+    for event, element in cElementTree.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            parents.append(element)
+            continue
+        parents.pop()
+        if _local_name(element.tag) not in ('item', 'entry'):
+            continue
+        yield _parse_item(element)
+        element.clear()
+        if parents:
+            parents[-1].remove(element)
+
+def iter_vodcasts(source, reference_date, create_vodcast, newest_first=False, retry=()):
+    """
+    yield the vodcasts (built by create_vodcast from an item) of source updated after reference_date while parsing,
+    and those whose guid is one of retry however old.
+
+    with newest_first, the feed is trusted to be sorted by date, newest first, and parsing stops at the first
+    entry not newer than reference_date, unless there are vodcasts to retry.
+    """
+    log = logging.getLogger('FeedStream')
+    cutoff = timegm(reference_date.utctimetuple())
+    skipped = 0
+    for item in iter_feed_items(source):
+        if item.updated_parsed is None or not item.enclosures:
+            log.warn('skipping entry [%s] without date or enclosure' % item.title)
+            continue
+        if timegm(item.updated_parsed) <= cutoff:
+            if retry:
+                vodcast = create_vodcast(item)
+                if vodcast.guid in retry:
+                    yield vodcast
+                    continue
+            elif newest_first:
+                log.debug('stopping at [%s], the first entry not newer than [%s]' % (item.title, reference_date))
+                return
+            skipped += 1
+            continue
+        yield create_vodcast(item)
+    log.debug('skipped %d entries not newer than [%s]' % (skipped, reference_date))
+
+def _parse_item(element):
+    item = StreamedItem()
+    date = None
+    for child in element:
+        name = _local_name(child.tag)
+        if name == 'title':
+            item.title = child.text
+        elif name in ('guid', 'id'):
+            item.id = child.text
+        elif name in ('description', 'summary') and item.description is None:
+            item.description = child.text
+        elif name in ('pubDate', 'updated', 'published', 'date') and date is None:
+            date = child.text
+        elif name == 'enclosure':
+            item.enclosures.append(StreamedEnclosure(child.get('url'), child.get('type'), child.get('length')))
+        elif name == 'link' and child.get('rel') == 'enclosure':
+            item.enclosures.append(StreamedEnclosure(child.get('href'), child.get('type'), child.get('length')))
+    if date:
+        import feedparser
+        item.updated_parsed = feedparser._parse_date(date.strip())
+    return item
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
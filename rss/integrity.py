@@ -0,0 +1,157 @@
+"""
+integrity of downloads: checksums computed while the bytes stream in, verification against the length and the
+digests announced by the server (Content-MD5, Digest), and a parallel re-check of the downloaded archive.
+"""
+import base64
+import binascii
+import hashlib
+import logging
+import mmap
+import os
+
+DEFAULT_ALGORITHM = 'sha256'
+# hash files in slices of this size, hashlib releases the GIL for each of them
+HASH_SLICE_SIZE = 4 * 1024 * 1024
+
+# RFC 3230 digest algorithms and their hashlib names
+DIGEST_ALGORITHMS = {'md5' : 'md5', 'sha' : 'sha1', 'sha-256' : 'sha256', 'sha-512' : 'sha512'}
+
+class IntegrityError(IOError):
+    pass
+
+class StreamingChecksum:
+    """
+    hash a download block by block while it is written. besides algorithm, whose result is the checksum stored as
+    'algorithm:hexdigest', the algorithms of the expected digests ({hashlib name : digest}) are computed to verify
+    them.
+    """
+    def __init__(self, algorithm=DEFAULT_ALGORITHM, expected=None):
+        self.algorithm = algorithm
+        self.expected = expected or {}
+        self.length = 0
+        self._hashes = dict((name, hashlib.new(name)) for name in set([algorithm]) | set(self.expected))
+
+    def update(self, block):
+        for checksum in self._hashes.values():
+            checksum.update(block)
+        self.length += len(block)
+
+    def update_from_file(self, filename, length=None):
+        """
+        hash the first length bytes (all if None) of filename, e.g. the part of a download transferred earlier
+        """
+        for block in _file_slices(filename, length):
+            self.update(block)
+
+    @property
+    def checksum(self):
+        return '%s:%s' % (self.algorithm, self._hashes[self.algorithm].hexdigest())
+
+    def verify(self, url, expected_length=None):
+        if expected_length is not None and self.length != expected_length:
+            raise IntegrityError('length mismatch of [%s]: got %d of %d bytes' % (url, self.length, expected_length))
+        for name, digest in self.expected.items():
+            if self._hashes[name].digest() != digest:
+                raise IntegrityError('%s digest mismatch of [%s]: expected %s, got %s' % (name, url, binascii.hexlify(digest), self._hashes[name].hexdigest()))
+
+class ChecksumWriter:
+    """
+    writer passing every block to target and to a StreamingChecksum
+    """
+    def __init__(self, target, checksum):
+        self.target = target
+        self.checksum = checksum
+
+    def write(self, block):
+        self.target.write(block)
+        self.checksum.update(block)
+
+def expected_digests(headers, partial=False):
+    """
+    {hashlib name : digest} announced by the Content-MD5 and Digest headers. the Content-MD5 of a partial (206)
+    response only covers the range, so it is left out then.
+    """
+    digests = {}
+    content_md5 = headers.getheader('Content-MD5') if not partial else None
+    if content_md5:
+        digests['md5'] = _decode(content_md5)
+    for instance_digest in (headers.getheader('Digest') or '').split(','):
+        algorithm, _, value = instance_digest.strip().partition('=')
+        name = DIGEST_ALGORITHMS.get(algorithm.lower())
+        if name and value:
+            digests[name] = _decode(value)
+    return dict((name, digest) for name, digest in digests.items() if digest)
+
+def file_checksum(filename, algorithm=DEFAULT_ALGORITHM):
+    checksum = StreamingChecksum(algorithm)
+    checksum.update_from_file(filename)
+    return checksum.checksum
+
+class VerifyResult:
+    def __init__(self, record, problem=None):
+        self.record = record
+        self.problem = problem
+
+    @property
+    def ok(self):
+        return self.problem is None
+
+    def __str__(self):
+        return '%s(%s: %s)' % (self.__class__, self.record.target, self.problem or 'ok')
+    def __repr__(self):
+        return str(self)
+
+def verify_archive(index, threads=None):
+    """
+    re-check the completed downloads of index against their stored size and checksum, hashing threads files at
+    a time (one per cpu by default) through mmap. no network is involved. corrupted or missing files are marked as
+    failed in the index, so the next run downloads them again. returns a VerifyResult per download.
+    """
+    log = logging.getLogger('verify')
+    records = index.records()
+    import multiprocessing
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(max(1, min(threads or multiprocessing.cpu_count(), len(records) or 1)))
+    try:
+        results = pool.map(_verify_record, records)
+    finally:
+        pool.close()
+    for result in results:
+        if result.ok:
+            log.debug('verified [%s]' % result.record.target)
+        else:
+            log.warn('[%s] is corrupt: %s' % (result.record.target, result.problem))
+            index.mark_failed(result.record.key, result.record.feed)
+    log.info('verified %d downloads, %d corrupt' % (len(results), len([result for result in results if not result.ok])))
+    return results
+
+def _verify_record(record):
+    if not record.target or not os.path.exists(record.target):
+        return VerifyResult(record, 'missing')
+    size = os.path.getsize(record.target)
+    if record.size is not None and size != record.size:
+        return VerifyResult(record, 'size %d differs from the %d bytes downloaded' % (size, record.size))
+    if record.checksum:
+        algorithm = record.checksum.split(':', 1)[0]
+        checksum = file_checksum(record.target, algorithm)
+        if checksum != record.checksum:
+            return VerifyResult(record, 'checksum %s differs from %s' % (checksum, record.checksum))
+    return VerifyResult(record)
+
+def _file_slices(filename, length=None):
+    with open(filename, 'rb') as source:
+        size = os.fstat(source.fileno()).st_size if length is None else length
+        if not size:
+            return
+        mapped = mmap.mmap(source.fileno(), size, access=mmap.ACCESS_READ)
+        try:
+            for offset in xrange(0, size, HASH_SLICE_SIZE):
+                yield buffer(mapped, offset, min(HASH_SLICE_SIZE, size - offset))
+        finally:
+            mapped.close()
+
+def _decode(value):
+    try:
+        return base64.b64decode(value.strip())
+    except (TypeError, binascii.Error):
+        return None
@@ -0,0 +1,168 @@
+"""
+crash-safe journal of the download batches of a directory, so an interrupted run resumes its remaining downloads
+without fetching the feed or selecting again.
+
+the journal is an append-only file of JSON lines: the plan of a feed (its vodcasts as records) in one line, then a
+line per download started, completed or failed and a last one when the batch is finished. plans and finished
+batches are synced to disk right away, downloads in batches of SYNC_EVERY lines or SYNC_INTERVAL seconds. losing
+those on a crash is harmless: the download index decides what is downloaded already, the journal only what is left
+to do. a torn last line is ignored on replay.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from storage import commit
+
+JOURNAL_FILENAME = '.download_journal'
+
+PLANNED = 'planned'
+STARTED = 'started'
+COMPLETED = 'completed'
+FAILED = 'failed'
+FINISHED = 'finished'
+
+# download lines written between two syncs at most, and seconds between two syncs at most
+SYNC_EVERY = 32
+SYNC_INTERVAL = 1.0
+
+class JournalBatch:
+    """
+    the download batch of feed planned at epoch seconds planned: the records of its vodcasts and the guids of those
+    completed so far
+    """
+    def __init__(self, feed, planned, records):
+        self.feed = feed
+        self.planned = planned
+        self.records = records
+        self.completed = set()
+
+    @property
+    def remaining(self):
+        return [record for record in self.records if record['guid'] not in self.completed]
+
+    def __str__(self):
+        return '%s(feed=%s, planned=%s, remaining=%d)' % (self.__class__, self.feed, self.planned, len(self.remaining))
+    def __repr__(self):
+        return str(self)
+
+class DownloadJournal:
+    """
+    journal of the batches of all feeds downloading into one directory, shared by their download threads. opening it
+    replays what is on disk and compacts the file down to the batches left unfinished
+    """
+    def __init__(self, path, sync_every=SYNC_EVERY, sync_interval=SYNC_INTERVAL):
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.log = logging.getLogger('DownloadJournal')
+        self._lock = threading.Lock()
+        self._batches = self._replay()
+        self._compact()
+        self._file = open(path, 'a')
+        self._unsynced = 0
+        self._synced = time.time()
+
+    def pending(self, feed):
+        """
+        the JournalBatch of feed an interrupted run left unfinished, None if there is none or nothing is left of it
+        """
+        with self._lock:
+            batch = self._batches.get(feed)
+        return batch if batch and batch.remaining else None
+
+    def planned(self, feed, vodcasts):
+        """
+        journal the vodcasts about to be downloaded from feed, replacing an earlier batch of it
+        """
+        batch = JournalBatch(feed, time.time(), [vodcast.to_record() for vodcast in vodcasts])
+        with self._lock:
+            self._batches[feed] = batch
+            self._append({'event' : PLANNED, 'feed' : feed, 'planned' : batch.planned, 'vodcasts' : batch.records}, sync=True)
+
+    def started(self, feed, guid):
+        with self._lock:
+            self._append({'event' : STARTED, 'feed' : feed, 'guid' : guid})
+
+    def completed(self, feed, guid):
+        with self._lock:
+            if feed in self._batches:
+                self._batches[feed].completed.add(guid)
+            self._append({'event' : COMPLETED, 'feed' : feed, 'guid' : guid})
+
+    def failed(self, feed, guid):
+        with self._lock:
+            self._append({'event' : FAILED, 'feed' : feed, 'guid' : guid})
+
+    def finished(self, feed):
+        """
+        the batch of feed is done, downloads that failed are left to the next regular run
+        """
+        with self._lock:
+            if self._batches.pop(feed, None) is not None:
+                self._append({'event' : FINISHED, 'feed' : feed}, sync=True)
+
+    def sync(self):
+        with self._lock:
+            self._sync()
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._sync()
+                self._file.close()
+
+    def _append(self, entry, sync=False):
+        self._file.write(json.dumps(entry) + '\n')
+        self._unsynced += 1
+        if sync or self._unsynced >= self.sync_every or time.time() - self._synced >= self.sync_interval:
+            self._sync()
+        else:
+            self._file.flush()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._synced = time.time()
+
+    def _replay(self):
+        batches = {}
+        try:
+            journal_file = open(self.path, 'r')
+        except IOError:
+            return batches
+        with journal_file:
+            for number, line in enumerate(journal_file):
+                try:
+                    entry = json.loads(line)
+                    event, feed = entry['event'], entry['feed']
+                except (ValueError, KeyError, TypeError) as e:
+                    self.log.warn('ignoring line %d of journal [%s]: %s' % (number + 1, self.path, e))
+                    continue
+                if event == PLANNED:
+                    batches[feed] = JournalBatch(feed, entry.get('planned'), entry.get('vodcasts', []))
+                elif event == COMPLETED and feed in batches:
+                    batches[feed].completed.add(entry.get('guid'))
+                elif event == FINISHED:
+                    batches.pop(feed, None)
+        for batch in batches.values():
+            self.log.info('unfinished batch in journal [%s]: %s' % (self.path, batch))
+        return batches
+
+    def _compact(self):
+        """
+        rewrite the journal to the plans of the unfinished batches, less their completed vodcasts
+        """
+        if not self._batches and not (os.path.exists(self.path) and os.path.getsize(self.path)):
+            # nothing to keep and nothing to drop
+            return
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as journal_file:
+            for feed, batch in sorted(self._batches.items()):
+                batch.records = batch.remaining
+                batch.completed = set()
+                if batch.records:
+                    journal_file.write(json.dumps({'event' : PLANNED, 'feed' : feed, 'planned' : batch.planned, 'vodcasts' : batch.records}) + '\n')
+        commit(temp_path, self.path, sync=True)
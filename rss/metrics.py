@@ -0,0 +1,211 @@
+"""
+structured metrics of the download stages: feed fetch latency and parse time per feed, and per download the time in
+queue, time to first byte, duration, bytes transferred, throughput and retries.
+
+every measurement is an event (a dict with 'event', 'timestamp' and its fields) handed to pluggable sinks: a JSON
+lines file, Prometheus text format (file or HTTP endpoint) or an in-process callback. without sinks, nothing is
+recorded.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from urlparse import urlparse
+
+FEED_FETCH = 'feed_fetch'
+FEED_PARSE = 'feed_parse'
+DOWNLOAD = 'download'
+
+# fields turned into Prometheus labels, everything else numeric becomes a sample
+LABELS = ('feed', 'host', 'outcome', 'status', 'stage')
+
+class Metrics:
+    """
+    hand events to sinks. a failing sink is logged and does not affect the downloads
+    """
+    def __init__(self, sinks=()):
+        self.sinks = list(sinks)
+        self.log = logging.getLogger('Metrics')
+
+    @property
+    def enabled(self):
+        return bool(self.sinks)
+
+    def emit(self, event, **fields):
+        if not self.sinks:
+            return
+        fields['event'] = event
+        fields['timestamp'] = time.time()
+        for sink in self.sinks:
+            try:
+                sink.emit(fields)
+            except Exception as e:
+                self.log.warn('metrics sink %s failed: %s' % (sink.__class__.__name__, e))
+
+    def download_finished(self, trace, vodcast, feed, outcome):
+        """
+        emit the download event of vodcast from its trace
+        """
+        if not self.sinks:
+            return
+        now = time.time()
+        transfer_seconds = now - trace.first_byte if trace.first_byte else None
+        self.emit(DOWNLOAD, feed=feed, url=vodcast.url, host=urlparse(vodcast.url).hostname, outcome=outcome,
+                  queue_seconds=trace.started - trace.queued if trace.queued else None,
+                  ttfb_seconds=trace.first_byte - trace.started if trace.first_byte else None,
+                  seconds=now - trace.started, bytes=trace.bytes, retries=max(0, trace.attempts - 1),
+                  throughput_bps=trace.bytes / transfer_seconds if transfer_seconds else None)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+NO_METRICS = Metrics()
+
+class DownloadTrace:
+    """
+    timestamps and counters of one download, from being queued to being finished
+    """
+    def __init__(self, queued=None):
+        self.queued = queued
+        self.started = time.time()
+        self.first_byte = None
+        self.bytes = 0
+        self.attempts = 0
+
+    def attempt(self):
+        self.attempts += 1
+
+    def responded(self):
+        if self.first_byte is None:
+            self.first_byte = time.time()
+
+    def transferred(self, count):
+        self.bytes += count
+
+class CallbackSink:
+    def __init__(self, callback):
+        self.callback = callback
+
+    def emit(self, event):
+        self.callback(event)
+
+    def close(self):
+        pass
+
+class JsonLinesSink:
+    """
+    append every event as one JSON object per line to path
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'a')
+
+    def emit(self, event):
+        line = json.dumps(event, sort_keys=True)
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+class PrometheusSink:
+    """
+    aggregate the events into Prometheus metrics: a counter vodcast_<event>_total per label set, and for every
+    numeric field a summary (_sum, _count) or, for bytes and retries, a counter. the text format is rewritten to path
+    after every event (for the node exporter's textfile collector) and served at http://HOST:port/metrics, if given.
+    """
+    def __init__(self, path=None, port=None, host=''):
+        self.path = path
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._counters = {}
+        self._summaries = {}
+        self._server = None
+        if port is not None:
+            self._server = _create_http_server((host, port), self)
+            thread = threading.Thread(target=self._server.serve_forever, name='metrics-http')
+            thread.daemon = True
+            thread.start()
+
+    def emit(self, event):
+        name = 'vodcast_%s' % event['event']
+        labels = tuple((label, str(event[label])) for label in LABELS if event.get(label) is not None)
+        with self._lock:
+            self._add(self._counters, name + '_total', labels, 1)
+            for field, value in event.items():
+                if field in LABELS or field in ('event', 'timestamp') or not isinstance(value, (int, long, float)) or isinstance(value, bool):
+                    continue
+                if field in ('bytes', 'retries'):
+                    self._add(self._counters, '%s_%s_total' % (name, field), labels, value)
+                else:
+                    summary = self._summaries.setdefault('%s_%s' % (name, field), {}).setdefault(labels, [0, 0])
+                    summary[0] += value
+                    summary[1] += 1
+        if self.path:
+            self._write()
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name in sorted(self._counters):
+                lines.append('# TYPE %s counter' % name)
+                for labels, value in sorted(self._counters[name].items()):
+                    lines.append('%s%s %s' % (name, _format_labels(labels), _format_value(value)))
+            for name in sorted(self._summaries):
+                lines.append('# TYPE %s summary' % name)
+                for labels, (total, count) in sorted(self._summaries[name].items()):
+                    lines.append('%s_sum%s %s' % (name, _format_labels(labels), _format_value(total)))
+                    lines.append('%s_count%s %d' % (name, _format_labels(labels), count))
+        return '\n'.join(lines) + '\n'
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def _add(self, metrics, name, labels, value):
+        values = metrics.setdefault(name, {})
+        values[labels] = values.get(labels, 0) + value
+
+    def _write(self):
+        temp_path = self.path + '.tmp'
+        with self._write_lock:
+            with open(temp_path, 'w') as metrics_file:
+                metrics_file.write(self.render())
+            os.rename(temp_path, self.path)
+
+def _create_http_server(address, sink):
+    """
+    HTTP server answering GET /metrics with the rendered sink. BaseHTTPServer is only imported, if metrics are served
+    """
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path != '/metrics':
+                self.send_error(404)
+                return
+            body = sink.render()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return HTTPServer(address, MetricsHandler)
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (label, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for label, value in labels)
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
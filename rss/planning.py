@@ -0,0 +1,187 @@
+"""
+disk space aware planning of a download batch and retention of the archive.
+
+before a batch starts, the bytes it needs are estimated from the enclosure lengths of the feed (or HEAD requests,
+where the feed does not announce them) and checked against the free space of the download directory, so a
+download is not started only to fail halfway with ENOSPC. a retention policy evicts old episodes first, making room
+for the new ones.
+"""
+import logging
+import os
+from urllib2 import urlopen, Request
+from download_index import COMPLETED, EVICTED
+from selection import MaxTotalBytes, Selection
+
+# parallel HEAD requests estimating unknown enclosure lengths
+PROBE_THREADS = 8
+
+class HeadRequest(Request):
+    def get_method(self):
+        return 'HEAD'
+
+def free_space(directory):
+    """
+    bytes available to unprivileged users in the file system of directory
+    """
+    stat = os.statvfs(directory)
+    return stat.f_bavail * stat.f_frsize
+
+class RetentionPolicy:
+    """
+    which downloads of a directory to evict: all but the keep_last newest per feed and the oldest beyond max_bytes
+    in the directory. newest and oldest go by modification time of the files. the incoming batch counts as the
+    newest, so room is made before it arrives
+    """
+    def __init__(self, keep_last=None, max_bytes=None):
+        self.keep_last = keep_last
+        self.max_bytes = max_bytes
+        self.log = logging.getLogger('RetentionPolicy')
+
+    @property
+    def enabled(self):
+        return self.keep_last is not None or self.max_bytes is not None
+
+    def select(self, downloads, feed=None, incoming=0, incoming_bytes=0):
+        """
+        the (record, mtime, size) of downloads to evict, oldest first. incoming vodcasts of feed adding up to
+        incoming_bytes are about to be downloaded
+        """
+        downloads = sorted(downloads, key=lambda download: download[1])
+        # feeds may use the same guids
+        identity = lambda record: (record.feed, record.key)
+        evicted = set()
+        if self.keep_last is not None:
+            own = [identity(record) for record, mtime, size in downloads if record.feed == feed]
+            evicted.update(own[:max(0, len(own) - max(0, self.keep_last - incoming))])
+        if self.max_bytes is not None:
+            total = sum(size for record, mtime, size in downloads if identity(record) not in evicted) + incoming_bytes
+            for record, mtime, size in downloads:
+                if total <= self.max_bytes:
+                    break
+                if identity(record) not in evicted:
+                    evicted.add(identity(record))
+                    total -= size
+        return [download for download in downloads if identity(download[0]) in evicted]
+
+    def evict(self, index, feed=None, incoming=0, incoming_bytes=0):
+        """
+        remove the downloads selected for eviction and mark them evicted in index, so they are not downloaded again.
+        returns the bytes freed
+        """
+        downloads = []
+        for record in index.records(COMPLETED):
+            try:
+                stat = os.stat(record.target)
+            except (OSError, TypeError):
+                continue
+            downloads.append((record, stat.st_mtime, stat.st_size))
+        freed = 0
+        for record, mtime, size in self.select(downloads, feed, incoming, incoming_bytes):
+            self.log.info('evicting [%s] (%d bytes) of [%s]' % (record.target, size, record.feed))
+            try:
+                os.unlink(record.target)
+            except OSError as e:
+                self.log.warn('failed to evict [%s]: %s' % (record.target, e))
+                continue
+            index.mark_evicted(record.key, record.feed)
+            freed += size
+        return freed
+
+class DownloadPlanner:
+    """
+    plan the downloads of a batch into directory: estimate the bytes of every vodcast, apply the retention policy
+    and keep the newest vodcasts fitting into the free space, less reserve bytes. vodcasts of unknown length are
+    probed with HEAD requests through url_opener, if probe, and otherwise assumed to fit. the vodcasts the last plan
+    skipped for lack of space are deferred
+    """
+    def __init__(self, directory, index=None, url_opener=urlopen, retention=None, reserve=0, probe=False,
+                 free_space=free_space):
+        self.directory = directory
+        self.index = index
+        self.url_opener = url_opener
+        self.retention = retention
+        self.reserve = reserve
+        self.probe = probe
+        self.free_space = free_space
+        self.deferred = []
+        self.log = logging.getLogger('DownloadPlanner')
+
+    def plan(self, vodcasts, feed=None, reserved=0):
+        """
+        the vodcasts to download, newest first, followed by those downloaded already. reserved bytes of the
+        directory are planned by other batches
+        """
+        self.deferred = []
+        if not vodcasts:
+            return []
+        pending, downloaded = self._split(vodcasts, feed)
+        if self.probe:
+            self._probe_lengths([vodcast for vodcast in pending if vodcast.length is None])
+        needed = sum(vodcast.length or 0 for vodcast in pending)
+        if self.index and self.retention and self.retention.enabled:
+            self.retention.evict(self.index, feed, len(pending), needed)
+        available = self._available(reserved)
+        if available is not None and needed > available:
+            planned = Selection([MaxTotalBytes(max(0, available))]).select(pending)
+            planned_ids = set(id(vodcast) for vodcast in planned)
+            skipped = [vodcast for vodcast in pending if id(vodcast) not in planned_ids]
+            self.log.warn('%d bytes free in [%s], skipping %d of %d vodcasts needing %d bytes: %s'
+                          % (available, self.directory, len(skipped), len(pending), needed, skipped))
+            self.deferred = skipped
+            pending = planned
+        return sorted(pending, key=lambda vodcast: -vodcast.timestamp) + downloaded
+
+    def planned_bytes(self, vodcasts, feed=None):
+        """
+        bytes of the vodcasts of feed still to be downloaded
+        """
+        return sum(vodcast.length or 0 for vodcast in self._split(vodcasts, feed)[0])
+
+    def _available(self, reserved):
+        """
+        bytes to plan with in the directory, None if unknown
+        """
+        if not self.directory:
+            return None
+        try:
+            return self.free_space(self.directory) - self.reserve - reserved
+        except OSError as e:
+            self.log.warn('cannot determine free space of [%s], not limiting downloads: %s' % (self.directory, e))
+            return None
+
+    def _split(self, vodcasts, feed):
+        """
+        (pending, downloaded) vodcasts of feed, the latter completed or evicted according to the index
+        """
+        if not self.index:
+            return list(vodcasts), []
+        downloaded = self.index.keys(feed, (COMPLETED, EVICTED), [vodcast.guid for vodcast in vodcasts])
+        return ([vodcast for vodcast in vodcasts if vodcast.guid not in downloaded],
+                [vodcast for vodcast in vodcasts if vodcast.guid in downloaded])
+
+    def _probe_lengths(self, vodcasts):
+        if not vodcasts:
+            return
+        self.log.info('probing the length of %d enclosures' % len(vodcasts))
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(min(PROBE_THREADS, len(vodcasts)))
+        try:
+            lengths = pool.map(self._probe_length, vodcasts)
+        finally:
+            pool.close()
+        for vodcast, length in zip(vodcasts, lengths):
+            vodcast.length = length
+
+    def _probe_length(self, vodcast):
+        try:
+            response = self.url_opener(HeadRequest(vodcast.url))
+        except Exception as e:
+            self.log.warn('failed to probe the length of [%s]: %s' % (vodcast.url, e))
+            return None
+        try:
+            length = response.info().getheader('Content-Length')
+            return int(length) if length else None
+        except ValueError:
+            return None
+        finally:
+            response.close()
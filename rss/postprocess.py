@@ -0,0 +1,166 @@
+"""
+post-processing of completed downloads: checksumming, tagging, remuxing or thumbnailing an episode, while the rest of
+the batch is still downloading.
+
+every completed download is queued to a pool of worker threads, which run the hooks (stages) on it one after the
+other. the queue is bounded: when the workers fall behind, handing over a download blocks the downloader, so
+downloads do not pile up unprocessed. hooks running external commands (see CommandHook) run in processes of their
+own and so in parallel to the downloads and to each other.
+"""
+import logging
+import shlex
+import threading
+import time
+from Queue import Queue
+from metrics import NO_METRICS
+
+POST_PROCESS = 'post_process'
+
+class CommandHook:
+    """
+    run an external command on a completed download. the command is split like a shell command line, after which
+    {file}, {title}, {url} and {guid} in its arguments are replaced by those of the download. a non-zero exit status
+    fails the stage
+    """
+    def __init__(self, command, name=None):
+        self.command = command
+        self.arguments = shlex.split(command)
+        self.name = name or self.arguments[0]
+        self.log = logging.getLogger('CommandHook')
+
+    def __call__(self, vodcast, filename):
+        # subprocess pulls in pickle and friends, only needed once something is post-processed
+        import subprocess
+        fields = {'file' : filename, 'title' : vodcast.title or '', 'url' : vodcast.url or '', 'guid' : vodcast.guid or ''}
+        arguments = [self._substitute(argument, fields) for argument in self.arguments]
+        self.log.debug('running %s' % arguments)
+        process = subprocess.Popen(arguments, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = process.communicate()[0]
+        if process.returncode:
+            raise Exception('[%s] exited with status %d: %s' % (self.command, process.returncode, output.strip()))
+
+    def _substitute(self, argument, fields):
+        for field, value in fields.items():
+            if isinstance(value, unicode):
+                value = value.encode('utf-8')
+            argument = argument.replace('{%s}' % field, value)
+        return argument
+
+    def __str__(self):
+        return self.command
+
+class PostProcessResult:
+    """
+    outcome of post-processing one download: the seconds every stage took that ran, and the error of the failing one
+    """
+    def __init__(self, vodcast, filename):
+        self.vodcast = vodcast
+        self.filename = filename
+        self.stages = []
+        self.error = None
+        self.failed_stage = None
+
+    @property
+    def succeeded(self):
+        return self.error is None
+
+    def __str__(self):
+        if self.succeeded:
+            return '%s(%s: %s)' % (self.__class__, self.filename, self.stages)
+        return '%s(%s failed in %s: %s)' % (self.__class__, self.filename, self.failed_stage, self.error)
+    def __repr__(self):
+        return str(self)
+
+class PostProcessor:
+    """
+    run hooks, callables hook(vodcast, filename), on every submitted download in worker threads. the stages of a
+    download run in the order of hooks, a failing stage skips the remaining ones. at most queue_size downloads wait
+    for a worker (by default two per worker), submit blocks beyond that.
+
+    results collects a PostProcessResult per download, timings the number of runs and total seconds per stage.
+    """
+    def __init__(self, hooks, workers=1, queue_size=None, metrics=None):
+        self.hooks = list(hooks)
+        self.workers = max(1, workers or 1)
+        self.metrics = metrics or NO_METRICS
+        self.results = []
+        self.timings = dict((self._stage_name(hook), [0, 0.0]) for hook in self.hooks)
+        self.log = logging.getLogger('PostProcessor')
+        self._lock = threading.Lock()
+        self._queue = Queue(queue_size or 2 * self.workers)
+        self._threads = []
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._work, name='post-process-%d' % number)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, vodcast, filename, feed=None, done=None):
+        """
+        queue the completed download of vodcast to filename, blocking while the queue is full. done(result) is
+        called with the PostProcessResult, once the stages ran
+        """
+        self._queue.put((vodcast, filename, feed, done, time.time()))
+
+    def join(self):
+        """
+        wait until everything submitted so far is post-processed
+        """
+        self._queue.join()
+
+    def close(self):
+        """
+        post-process what is queued and stop the workers
+        """
+        for thread in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        for stage, (count, seconds) in sorted(self.timings.items()):
+            if count:
+                self.log.info('stage [%s] ran %d times, %.3fs on average' % (stage, count, seconds / count))
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                self._process(*job)
+            finally:
+                self._queue.task_done()
+
+    def _process(self, vodcast, filename, feed, done, submitted):
+        result = PostProcessResult(vodcast, filename)
+        queue_seconds = time.time() - submitted
+        for hook in self.hooks:
+            stage = self._stage_name(hook)
+            started = time.time()
+            try:
+                hook(vodcast, filename)
+            except Exception as e:
+                result.error = e
+                result.failed_stage = stage
+                self.log.error('post-processing [%s] failed in stage [%s]: %s' % (filename, stage, e))
+            seconds = time.time() - started
+            result.stages.append((stage, seconds))
+            with self._lock:
+                self.timings[stage][0] += 1
+                self.timings[stage][1] += seconds
+            self.metrics.emit(POST_PROCESS, feed=feed, stage=stage, outcome='failed' if result.error else 'completed',
+                              queue_seconds=queue_seconds, seconds=seconds)
+            if result.error:
+                break
+        with self._lock:
+            self.results.append(result)
+        self.log.debug('post-processed [%s]: %s' % (filename, result))
+        if done:
+            try:
+                done(result)
+            except Exception as e:
+                self.log.error('failed to finish post-processing [%s]: %s' % (filename, e))
+
+    @staticmethod
+    def _stage_name(hook):
+        return getattr(hook, 'name', None) or getattr(hook, '__name__', None) or hook.__class__.__name__
@@ -43,6 +43,7 @@ __version__ = "1.0.0"
 
 import time
 import math
+from collections import deque
 
 def _time():
     """Return time in seconds. I made a separate function so I can easily
@@ -52,13 +53,18 @@ def _time():
 
 class Progress:
     """Contains all state for a progress tracker."""
-    def __init__(self, total_work, unit=None, computer_prefix=None):
+    def __init__(self, total_work, unit=None, computer_prefix=None,
+                 history_size=600, keep_log=False):
         """Create a new progress tracker.
         'total_work' is the units of work that will be done.
         'unit' is the unit to be displayed to the user.
         'computer_prefix' should be set to True if this unit requires prefix
         increments of 1024 instead of the traditional 1000. If it is not set,
         then the class tries to guess based on 'unit'.
+        'history_size' bounds the history (one entry per second) kept for the
+        predictions, None keeps all of it.
+        'keep_log' records the predictions of every update for
+        _grade_performance(). This evaluates all predicters on each update.
         """
         self.total_work = total_work
         self.unit = unit
@@ -66,7 +72,8 @@ class Progress:
             self.computer_prefix = unit.lower() in ["b", "bit", "byte"]
         else:
             self.computer_prefix = computer_prefix
-        self.history = []
+        self.history = deque(maxlen=history_size)
+        self.keep_log = keep_log
         self.log = []
         self.predicters = [self.predicted_rate, self._predicted_rate_period,
             self._predicted_rate_avg, self._predicted_rate_pessimist]
@@ -99,7 +106,8 @@ class Progress:
     
         # Keep track of sum of squared(time) per unit of work.
         # This has to happen "atomically" with adding the elements to history.
-        if not replace and len(self.history) > 1:
+        if not replace and len(self.history) > 1 and \
+                self.history[-1][0] != self.history[-2][0]:
             # Base computation on the last 2 history entries instead of
             # (work, t) because the new entry will likely be replaced later.
             delta_t = float(self.history[-1][1] - self.history[-2][1])
@@ -114,6 +122,8 @@ class Progress:
         else:
             self.history.append(history_entry)
 
+        if not self.keep_log:
+            return
         log_entry = (work, t, map(apply, self.predicters))
         if replace:
             self.log[-1] = log_entry
@@ -144,8 +154,8 @@ class Progress:
         work_done = self.history[-1][0]
         remaining_work = self.total_work - work_done
         # Drop all old history entries.
-        while work_done - self.history[1][0] > remaining_work:
-            self.history.pop(0)
+        while len(self.history) > 2 and work_done - self.history[1][0] > remaining_work:
+            self.history.popleft()
         return float(self.history[-1][0] - self.history[0][0]) / \
             (self.history[-1][1] - self.history[0][1])
 
@@ -166,10 +176,10 @@ class Progress:
             pessimism by the percentage of work complete. This function is very
         unlikely to overestimate the work rate when the work is almost done.
         """
-        if len(self.history) < 3:
+        if len(self.history) < 3 or not self.pes_samples:
             return self._predicted_rate_avg()
         avg = self.pes_total / self.pes_samples
-        stddev = math.sqrt(self.pes_squares / self.pes_samples - avg * avg)
+        stddev = math.sqrt(max(0, self.pes_squares / self.pes_samples - avg * avg))
         return 1.0 / (avg + stddev * self.percentage() / 100)
 
     def predicted_rate(self):
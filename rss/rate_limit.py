@@ -0,0 +1,136 @@
+"""
+bandwidth shaping shared by all transfers of a run: token buckets for a global and a per host byte rate, and per
+host pauses requested by servers with Retry-After.
+"""
+import logging
+import threading
+import time
+
+THROTTLING_CODES = (429, 503)
+
+class TokenBucket:
+    """
+    bucket refilled with rate tokens (bytes) per second, holding at most capacity tokens. the capacity bounds the
+    burst after an idle period and defaults to a quarter second worth of rate.
+    """
+    def __init__(self, rate, capacity=None, clock=time.time):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate / 4.0)
+        self.tokens = self.capacity
+        self.clock = clock
+        self.updated = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount):
+        """
+        take amount tokens, going into debt if there are not enough. returns the seconds until the debt is paid off,
+        which is how long the caller has to wait before transferring more.
+        """
+        with self._lock:
+            now = self.clock()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            return max(0.0, -self.tokens / self.rate)
+
+class RateLimiter:
+    """
+    limit the transfer rate of all connections to max_rate bytes per second and of the connections to one host to
+    max_rate_per_host. either may be None for no limit. the limiter is thread safe and shared by all downloads.
+
+    throttle() blocks the calling thread, delay() only tells how long to wait, for callers running an event loop.
+    """
+    def __init__(self, max_rate=None, max_rate_per_host=None, clock=time.time, sleep=time.sleep):
+        self.max_rate = max_rate
+        self.max_rate_per_host = max_rate_per_host
+        self.clock = clock
+        self.sleep = sleep
+        self.log = logging.getLogger('RateLimiter')
+        self._global = TokenBucket(max_rate, clock=clock) if max_rate else None
+        self._hosts = {}
+        self._not_before = {}
+        self._lock = threading.Lock()
+
+    def delay(self, host, amount):
+        """
+        account amount bytes transferred from host. returns the seconds to wait before reading more
+        """
+        delays = [0.0]
+        if self._global:
+            delays.append(self._global.reserve(amount))
+        if self.max_rate_per_host:
+            delays.append(self._host_bucket(host).reserve(amount))
+        return max(delays)
+
+    def burst(self, host):
+        """
+        most bytes to read from host at once, so no single read exceeds what the buckets hold. None if unlimited
+        """
+        capacities = []
+        if self._global:
+            capacities.append(self._global.capacity)
+        if self.max_rate_per_host:
+            capacities.append(self._host_bucket(host).capacity)
+        return max(1, int(min(capacities))) if capacities else None
+
+    def throttle(self, host, amount):
+        wait = self.delay(host, amount)
+        if wait > 0:
+            self.sleep(wait)
+
+    def defer(self, host, seconds):
+        """
+        do not start requests to host for the next seconds, as asked by a Retry-After header
+        """
+        with self._lock:
+            not_before = self.clock() + seconds
+            if not_before > self._not_before.get(host, 0):
+                self.log.warn('[%s] asked to retry after %d seconds, pausing requests to it' % (host, seconds))
+                self._not_before[host] = not_before
+
+    def wait_time(self, host):
+        with self._lock:
+            return max(0.0, self._not_before.get(host, 0) - self.clock())
+
+    def wait(self, host):
+        wait = self.wait_time(host)
+        if wait > 0:
+            self.log.info('waiting %.1f seconds before requesting [%s]' % (wait, host))
+            self.sleep(wait)
+
+    def _host_bucket(self, host):
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = TokenBucket(self.max_rate_per_host, clock=self.clock)
+            return self._hosts[host]
+
+def parse_retry_after(value, now=None):
+    """
+    seconds to wait from a Retry-After header, given as delta seconds or HTTP date. None if missing or malformed
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    from email.utils import parsedate_tz, mktime_tz
+    parsed = parsedate_tz(value)
+    if parsed is None:
+        return None
+    return max(0, mktime_tz(parsed) - (time.time() if now is None else now))
+
+def parse_rate(rate):
+    """
+    bytes per second of a rate like '500k', '2M' or '1048576'. None stays None
+    """
+    if rate is None:
+        return None
+    factors = {'k' : 1024, 'm' : 1024 * 1024, 'g' : 1024 * 1024 * 1024}
+    rate = rate.strip().lower()
+    factor = factors.get(rate[-1:], 1)
+    if rate[-1:] in factors:
+        rate = rate[:-1]
+    value = float(rate) * factor
+    if value <= 0:
+        raise ValueError('rate must be positive: %s' % rate)
+    return int(value)
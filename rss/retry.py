@@ -0,0 +1,91 @@
+"""
+retrying of feed fetches and downloads failing for transient reasons, with capped exponential backoff and jitter
+"""
+import httplib
+import logging
+import random
+import socket
+import time
+from urllib2 import HTTPError, URLError
+from rate_limit import parse_retry_after
+
+RETRYABLE_CODES = (408, 425, 429, 500, 502, 503, 504)
+
+class IncompleteTransferError(IOError):
+    """
+    the connection ended before the announced number of bytes arrived
+    """
+    pass
+
+class RetryPolicy:
+    """
+    retry an operation up to attempts times in total, as long as it fails with a retryable error (see
+    is_retryable). the n-th retry waits base_delay * 2 ** (n - 1) seconds, capped at max_delay and reduced by up
+    to jitter (a fraction) at random, so parallel downloads failing together do not retry in lockstep. a longer
+    Retry-After of the server is honored, as long as it is within max_delay.
+    """
+    def __init__(self, attempts=3, base_delay=1.0, max_delay=60.0, jitter=0.5, sleep=time.sleep, random=random.random):
+        self.attempts = max(1, attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.sleep = sleep
+        self.random = random
+        self.log = logging.getLogger('RetryPolicy')
+
+    def is_retryable(self, error):
+        """
+        server errors, throttling, timeouts, resets and incomplete transfers are transient. client errors like
+        404 and local failures (e.g. a full disk) are not.
+        """
+        if isinstance(error, HTTPError):
+            return error.code in RETRYABLE_CODES
+        if isinstance(error, URLError):
+            return isinstance(error.reason, (socket.error, socket.timeout))
+        return isinstance(error, (IncompleteTransferError, socket.error, socket.timeout, httplib.HTTPException))
+
+    def delay(self, attempt, error=None):
+        """
+        seconds to wait after the failed attempt (counting from 1). None if the server asked to wait longer than
+        max_delay
+        """
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        delay *= 1 - self.jitter * self.random()
+        retry_after = parse_retry_after(error.info().getheader('Retry-After')) if isinstance(error, HTTPError) and error.info() else None
+        if retry_after is not None:
+            if retry_after > self.max_delay:
+                return None
+            delay = max(delay, retry_after)
+        return delay
+
+    def retry_delay(self, attempt, error):
+        """
+        seconds to wait before retrying after attempt failed with error, None if it must not be retried
+        """
+        if attempt >= self.attempts or not self.is_retryable(error):
+            return None
+        return self.delay(attempt, error)
+
+    def call(self, function, description):
+        """
+        call function until it succeeds or fails for good, logging the duration of every attempt
+        """
+        attempt = 1
+        while True:
+            start = time.time()
+            try:
+                result = function()
+            except Exception as e:
+                elapsed = time.time() - start
+                delay = self.retry_delay(attempt, e)
+                if delay is None:
+                    if attempt > 1:
+                        self.log.error('attempt %d/%d to %s failed after %.2fs, giving up: %s' % (attempt, self.attempts, description, elapsed, e))
+                    raise
+                self.log.warn('attempt %d/%d to %s failed after %.2fs, retrying in %.1fs: %s' % (attempt, self.attempts, description, elapsed, delay, e))
+                self.sleep(delay)
+                attempt += 1
+                continue
+            if attempt > 1:
+                self.log.info('attempt %d/%d to %s succeeded after %.2fs' % (attempt, self.attempts, description, time.time() - start))
+            return result
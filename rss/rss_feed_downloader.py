@@ -1,36 +1,101 @@
-import feedparser
 import os
 from datetime import datetime
 import time
 from calendar import timegm
-from dateutil.tz import tzlocal
-import pytz
 import logging
+import hashlib
+import json
+import re
+import threading
 from urllib import urlretrieve
+from urllib2 import urlopen, Request, HTTPError
 from urlparse import urlparse
 from progress import Progress
-LOCAL_TIMEZONE = pytz.timezone('Europe/Berlin')
+from transport import HttpTransport
+from feed_stream import iter_vodcasts
+from retry import IncompleteTransferError
+from integrity import DEFAULT_ALGORITHM, ChecksumWriter, IntegrityError, StreamingChecksum, expected_digests, file_checksum
+from selection import NewerThan, Selection, to_epoch
+from planning import DownloadPlanner
+from download_index import RETRIED
+from metrics import NO_METRICS, DownloadTrace, FEED_FETCH, FEED_PARSE
+from storage import BlockWriter, DEFAULT_BUFFER_SIZE, WRITE_DIRECT, WRITE_RENAME, WRITE_FSYNC, commit, copy_stream, preallocate
+from StringIO import StringIO
+
+# feedparser, pytz and multiprocessing are imported where they are needed: a run finding its feed unchanged uses
+# none of them and would spend most of its time importing them (see tests/startup_test.py)
+
+class _LazyTimezone(object):
+    """
+    pytz timezone loaded on first use. use its localize, it is no tzinfo itself
+    """
+    def __init__(self, zone):
+        self.zone = zone
+        self._timezone = None
+
+    def __getattr__(self, name):
+        if self._timezone is None:
+            import pytz
+            self._timezone = pytz.timezone(self.zone)
+        return getattr(self._timezone, name)
+
+LOCAL_TIMEZONE = _LazyTimezone('Europe/Berlin')
+PART_SUFFIX = '.part'
+VALIDATORS_SUFFIX = '.part.json'
+BLOCK_SIZE = 64 * 1024
+MIN_SEGMENT_SIZE = 1024 * 1024
+# descriptions of vodcasts are only logged
+DESCRIPTION_LENGTH = 200
+
+class UserInterrupted(Exception):
+    pass
+
+class Vodcast(object):
+    """
+    compact record of a feed entry: the fields needed to select and download its video enclosure are copied from
+    the (feedparser) entry, which is not referenced afterwards. the publish date is kept as epoch seconds and the
+    description, which is only logged, is cut to DESCRIPTION_LENGTH characters.
+    """
+    __slots__ = ('title', 'url', 'local_filename', 'guid', 'timestamp', 'length', 'description', 'target_filename')
 
-class Vodcast:
     def __init__(self, item):
         self.title = item.title
-        self.url = self._parse_video_url(item.enclosures)
+        video = self._video_enclosure(item.enclosures)
+        self.url = video.href
+        self.length = _parse_length(getattr(video, 'length', None))
         self.local_filename = self._generate_local_filename(self.url)
+        self.guid = getattr(item, 'id', None) or self.url
+        self.timestamp = timegm(item.updated_parsed)
+        self.description = _truncate(getattr(item, 'description', None))
+        self.target_filename = None
 
-        self.updated = datetime.utcfromtimestamp(timegm(item.updated_parsed))
-        
-        self.description = item.description
+    @classmethod
+    def from_record(cls, record):
+        vodcast = cls.__new__(cls)
+        vodcast.title = record['title']
+        vodcast.url = record['url']
+        vodcast.length = record.get('length')
+        vodcast.local_filename = vodcast._generate_local_filename(vodcast.url)
+        vodcast.guid = record.get('guid') or vodcast.url
+        vodcast.timestamp = record['updated']
+        vodcast.description = _truncate(record['description'])
+        vodcast.target_filename = None
+        return vodcast
 
-        self._underlying_item = item
+    def to_record(self):
+        return {'title' : self.title, 'url' : self.url, 'guid' : self.guid, 'updated' : self.timestamp, 'length' : self.length, 'description' : self.description}
 
-    def _parse_video_url(self, enclosures):
+    @property
+    def updated(self):
+        """
+        publish date as naive UTC datetime
+        """
+        return datetime.utcfromtimestamp(self.timestamp)
+
+    def _video_enclosure(self, enclosures):
         video = enclosures[0]
-        if 'video/mp4' == video.type:
-            return video.href
-        if 'video/mpeg' == video.type:
-            return video.href
-        if 'video/x-mp4' == video.type:
-            return video.href
+        if video.type in ('video/mp4', 'video/mpeg', 'video/x-mp4'):
+            return video
         raise Exception('cannot parse url from enclosure [%s]. unknown type: %s' % (video, video.type))
 
     def _generate_local_filename(self, link):
@@ -44,14 +109,32 @@ class Vodcast:
         same = True
         same &= self.title == other.title
         same &= self.url == other.url
-        same &= self.updated == other.updated
+        same &= self.timestamp == other.timestamp
         return same
 
+def _parse_length(length):
+    try:
+        return int(length) if length else None
+    except ValueError:
+        return None
+
+def _truncate(description):
+    if description and len(description) > DESCRIPTION_LENGTH:
+        return description[:DESCRIPTION_LENGTH - 3] + '...'
+    return description
+
 class DownloadProgressHook:
-    def __init__(self, name, interval=1, *args, **kwargs):
+    """
+    urlretrieve report hook logging the download progress every interval seconds.
+
+    a block only adds up the bytes, the eta calculator is sampled at most every sample_interval seconds.
+    """
+    def __init__(self, name, interval=1, sample_interval=0.25, *args, **kwargs):
         self.log = logging.getLogger('DownloadProgressHook')
         self.actual = 0
         self.interval = interval
+        self.sample_interval = sample_interval
+        self.debug = self.log.isEnabledFor(logging.DEBUG)
         
     def report_hook(self, block_number, block_size, total_size):
 
@@ -59,51 +142,332 @@ class DownloadProgressHook:
                 self._eat(block_size)
             else:
                 self._start_reporting(total_size)
-                
-            if time.time() - self.last_report > self.interval:
+
+            now = time.time()
+            if now - self.last_sample >= self.sample_interval:
+                self.eta_calculator.update(self.actual)
+                self.last_sample = now
+            if now - self.last_report > self.interval:
                 self._log_report()
-                self.last_report = time.time()
+                self.last_report = now
                 
     def _eat(self, count):
-        self.log.debug('eating %d bytes [%d/%d]' % (count, self.actual, self.total))
+        if self.debug:
+            self.log.debug('eating %d bytes [%d/%d]', count, self.actual, self.total)
         self.actual += count
-        self.eta_calculator.update(self.actual)
 
     def _start_reporting(self, total):
         self.total = total
         self.eta_calculator = Progress(self.total, unit = 'kb')
-        self.last_report = time.time()
+        self.last_report = self.last_sample = time.time()
 
     def _log_report(self):
+        if not self.log.isEnabledFor(logging.INFO):
+            return
         self.log.info('%02.1f%% [%.0f/%.0f kb]. eta %ds (%dkb/s)' % (self.eta_calculator.percentage(), 
                                         self.actual / 1024, self.total / 1024, 
                                         self.eta_calculator.time_remaining(),
-                                        self.eta_calculator.predicted_rate() / 1024))
+                                        (self.eta_calculator.predicted_rate() or 0) / 1024))
 
 class VodcastDownloader:
-    def __init__(self, basedir=None, url_retriever = urlretrieve):
+    def __init__(self, basedir=None, url_retriever = urlretrieve, url_opener = urlopen, resume = False, segments = 1, min_segment_size = MIN_SEGMENT_SIZE,
+                 index = None, feed_url = None, retry_policy = None, buffer_size = DEFAULT_BUFFER_SIZE, preallocate = True,
+                 write_policy = WRITE_RENAME, checksum_algorithm = None, metrics = None,
+                 post_processor = None, journal = None):
         self.basedir = basedir
         self.log = logging.getLogger('VodcastDownloader')
         self.report_log = logging.getLogger('report')
         self.url_retriever = url_retriever
+        self.url_opener = url_opener
+        self.resume = resume
+        self.segments = segments
+        self.min_segment_size = min_segment_size
+        self.index = index
+        self.feed_url = feed_url
+        self.retry_policy = retry_policy
+        self.buffer_size = buffer_size
+        self.preallocate = preallocate
+        self.write_policy = write_policy
+        self.checksum_algorithm = checksum_algorithm
+        self.metrics = metrics or NO_METRICS
+        self.post_processor = post_processor
+        self.journal = journal
+        self._queued = {}
 
-    def __copy_stream_to_target(self, url, target_filename):
+    def __copy_stream_to_target(self, url, target_filename, trace, length=None):
+        """
+        download url to target_filename. returns the ETag and the checksum of the download, if known. length, the
+        enclosure length announced by the feed, saves the HEAD request of downloads too small to be segmented.
+
+        with a checksum algorithm, the download is hashed while it streams in and verified against the length and
+        the digests announced by the server.
+        """
         if(os.path.exists(target_filename)):
             self.log.warn('skipping already existing file [%s]' % target_filename)
-            return
+            return None, None
+
+        trace.attempt()
+        resumable = self.resume and os.path.exists(target_filename + PART_SUFFIX)
+        if self.segments > 1 and not resumable and (length is None or length >= 2 * self.min_segment_size):
+            downloaded = self.__segmented_stream_to_target(url, target_filename, trace)
+            if downloaded:
+                return downloaded
+
+        if self.resume or self.retry_policy or self.checksum_algorithm:
+            # retries continue the .part file of the failed attempt, checksums are computed on the way
+            return self.__resume_stream_to_target(url, target_filename, trace)
 
-        self.log.debug('downloading [%s] to [%s].', url, target_filename)
+        # unless written directly, readers only ever see the complete file
+        write_filename = target_filename if self.write_policy == WRITE_DIRECT else target_filename + PART_SUFFIX
+        self.log.debug('downloading [%s] to [%s].', url, write_filename)
         
         download_reporter = DownloadProgressHook(target_filename)
-        
+        def report_hook(block_number, block_size, total_size):
+            if not block_number:
+                trace.responded()
+            download_reporter.report_hook(block_number, block_size, total_size)
+
         try:
-            self.url_retriever(url, target_filename, download_reporter.report_hook)
+            retrieved = self.url_retriever(url, write_filename, report_hook)
         except Exception as e:
-            self.__remove_file_if_exists(target_filename, e)
+            self.__remove_file_if_exists(write_filename, e)
             raise
         except KeyboardInterrupt:
-            self.__remove_file_if_exists(target_filename, 'User interrupted')
-            raise Exception('User interrupted')
+            self.__remove_file_if_exists(write_filename, 'User interrupted')
+            raise UserInterrupted('User interrupted')
+        if os.path.exists(write_filename):
+            trace.transferred(os.path.getsize(write_filename))
+        if write_filename != target_filename:
+            self.commit(write_filename, target_filename)
+        if retrieved and hasattr(retrieved[1], 'getheader'):
+            return retrieved[1].getheader('ETag'), None
+        return None, None
+
+    def __resume_stream_to_target(self, url, target_filename, trace):
+        """
+        download into a .part file, which is kept on failure. a later call continues the .part file with a
+        Range request, as long as the server honors the range and the stored validators (ETag, Last-Modified
+        and length) did not change. otherwise the download restarts from scratch.
+        """
+        part_filename = target_filename + PART_SUFFIX
+        validators = self._load_validators(target_filename)
+        offset = 0
+        if validators and os.path.exists(part_filename):
+            offset = os.path.getsize(part_filename)
+
+        response = self.__open_range(url, offset, validators)
+        trace.responded()
+        if response is None:
+            self.log.info('[%s] already complete, finishing download' % part_filename)
+            checksum = file_checksum(part_filename, self.checksum_algorithm) if self.checksum_algorithm else None
+            self.commit(part_filename, target_filename)
+            self._remove_validators(target_filename)
+            return validators.get('etag'), checksum
+        current = _validators_of(response)
+
+        if offset and not self._can_continue(response, offset, validators, current):
+            self.log.warn('cannot resume [%s] at byte %d (server ignored range or validators changed). restarting' % (url, offset))
+            offset = 0
+            if response.getcode() == 206:
+                response.close()
+                response = self.url_opener(Request(url))
+                current = _validators_of(response)
+        if offset:
+            self.log.info('resuming [%s] at byte %d' % (url, offset))
+            length = validators.get('length')
+        else:
+            length = current['length']
+            self._save_validators(target_filename, current)
+
+        checksum = self.create_checksum(response, part_filename, offset)
+        download_reporter = DownloadProgressHook(target_filename)
+        download_reporter.report_hook(0, BLOCK_SIZE, length or -1)
+        download_reporter.actual = offset
+        try:
+            with BlockWriter(part_filename, offset, length, self.preallocate) as part:
+                written = offset + self._copy_response(response, ChecksumWriter(part, checksum) if checksum else part, download_reporter, trace)
+        except KeyboardInterrupt:
+            self.log.warn('keeping [%s] after user interrupt' % part_filename)
+            raise UserInterrupted('User interrupted')
+        finally:
+            response.close()
+
+        if length is not None and written != length:
+            raise IncompleteTransferError('incomplete download of [%s]: got %d of %d bytes, keeping [%s]' % (url, written, length, part_filename))
+        self.verify(url, checksum, length, target_filename)
+        self.commit(part_filename, target_filename)
+        self._remove_validators(target_filename)
+        return (validators if offset else current).get('etag'), checksum.checksum if checksum else None
+
+    def __segmented_stream_to_target(self, url, target_filename, trace):
+        """
+        download a Range capable file with several connections, each writing its byte range directly into a
+        preallocated .part file. returns the ETag and checksum of the download or False, if the server does not
+        support ranges and a single stream should be used instead.
+
+        the segments arrive out of order, so the checksum is computed from the complete .part file.
+        """
+        head = Request(url)
+        head.get_method = lambda: 'HEAD'
+        try:
+            response = self.url_opener(head)
+        except HTTPError as e:
+            self.log.debug('HEAD request to [%s] failed, falling back to single stream: %s' % (url, e))
+            return False
+        trace.responded()
+        response.close()
+        info = response.info()
+        validators = _validators_of(response)
+        length = validators['length']
+        if info.getheader('Accept-Ranges', '').lower() != 'bytes' or not length:
+            self.log.debug('[%s] does not accept ranges, falling back to single stream' % url)
+            return False
+        segments = _split_into_segments(length, self.segments, self.min_segment_size)
+        if len(segments) < 2:
+            return False
+
+        self.log.debug('downloading [%s] to [%s] in %d segments.', url, target_filename, len(segments))
+        part_filename = target_filename + PART_SUFFIX
+        with open(part_filename, 'wb') as part:
+            preallocate(part, length, keep_size=False)
+
+        download_reporter = DownloadProgressHook(target_filename)
+        download_reporter.report_hook(0, BLOCK_SIZE, length)
+        lock = threading.Lock()
+        def report_hook(block_number, block_size, total_size):
+            with lock:
+                trace.transferred(block_size)
+                download_reporter.report_hook(block_number, block_size, total_size)
+
+        errors = []
+        def fetch(first, last):
+            try:
+                self.__fetch_segment(url, part_filename, first, last, validators, report_hook)
+            except Exception as e:
+                errors.append(e)
+
+        workers = [threading.Thread(target=fetch, args=segment, name='segment-%d' % segment[0]) for segment in segments]
+        try:
+            for worker in workers:
+                worker.daemon = True
+                worker.start()
+            while any(worker.is_alive() for worker in workers):
+                for worker in workers:
+                    worker.join(0.5)
+        except KeyboardInterrupt:
+            self.__remove_file_if_exists(part_filename, 'User interrupted')
+            raise UserInterrupted('User interrupted')
+        if errors:
+            self.__remove_file_if_exists(part_filename, errors[0])
+            raise errors[0]
+        checksum = None
+        if self.checksum_algorithm:
+            checksum = StreamingChecksum(self.checksum_algorithm, expected_digests(info))
+            checksum.update_from_file(part_filename)
+            self.verify(url, checksum, length, target_filename)
+        self.commit(part_filename, target_filename)
+        return validators['etag'], checksum.checksum if checksum else None
+
+    def __fetch_segment(self, url, part_filename, first, last, validators, report_hook):
+        headers = {'Range' : 'bytes=%d-%d' % (first, last)}
+        if_range = validators.get('etag') or validators.get('last_modified')
+        if if_range:
+            headers['If-Range'] = if_range
+        response = self.url_opener(Request(url, headers=headers))
+        try:
+            content_range = _parse_content_range(response.info().getheader('Content-Range'))
+            if response.getcode() != 206 or not content_range or content_range[:2] != (first, last):
+                raise IOError('server did not honor range %d-%d of [%s]' % (first, last, url))
+            expected = last - first + 1
+            with open(part_filename, 'r+b', 0) as part:
+                part.seek(first)
+                copied = copy_stream(response, part, self.buffer_size, lambda count: report_hook(1, count, validators['length']), limit=expected)
+            if copied < expected:
+                raise IncompleteTransferError('incomplete segment %d-%d of [%s]: got %d of %d bytes' % (first, last, url, copied, expected))
+        finally:
+            response.close()
+
+    def __open_range(self, url, offset, validators):
+        headers = {}
+        if offset:
+            headers['Range'] = 'bytes=%d-' % offset
+            if_range = validators.get('etag') or validators.get('last_modified')
+            if if_range:
+                headers['If-Range'] = if_range
+        try:
+            return self.url_opener(Request(url, headers=headers))
+        except HTTPError as e:
+            if e.code != 416 or not offset:
+                raise
+            if offset == validators.get('length'):
+                return None
+            self.log.warn('range %d- not satisfiable for [%s], restarting' % (offset, url))
+            return self.url_opener(Request(url))
+
+    def _can_continue(self, response, offset, validators, current):
+        if response.getcode() != 206:
+            return False
+        content_range = _parse_content_range(response.info().getheader('Content-Range'))
+        if not content_range or content_range[0] != offset:
+            return False
+        for key in ('etag', 'last_modified'):
+            if validators.get(key) and current[key] and validators[key] != current[key]:
+                return False
+        return validators.get('length') in (None, content_range[2])
+
+    def _copy_response(self, response, target, reporter, trace):
+        def on_block(count):
+            trace.transferred(count)
+            reporter.report_hook(1, count, reporter.total)
+        return copy_stream(response, target, self.buffer_size, on_block)
+
+    def create_checksum(self, response, part_filename, offset):
+        """
+        checksum of the download of response into part_filename, continuing at offset. the bytes downloaded earlier
+        are hashed from the .part file. None without checksum algorithm
+        """
+        if not self.checksum_algorithm:
+            return None
+        checksum = StreamingChecksum(self.checksum_algorithm, expected_digests(response.info(), partial=offset > 0))
+        if offset:
+            checksum.update_from_file(part_filename, offset)
+        return checksum
+
+    def verify(self, url, checksum, length, target_filename):
+        """
+        check the finished download against its expected length and digests. a corrupted .part file is removed, so
+        the next attempt starts from scratch
+        """
+        if checksum is None:
+            return
+        try:
+            checksum.verify(url, length)
+        except IntegrityError:
+            self.discard_partial(target_filename)
+            raise
+
+    def commit(self, part_filename, target_filename):
+        """
+        rename the complete part_filename to target_filename, flushed to disk first with the fsync write policy
+        """
+        commit(part_filename, target_filename, sync=self.write_policy == WRITE_FSYNC)
+
+    def _load_validators(self, target_filename):
+        try:
+            with open(target_filename + VALIDATORS_SUFFIX, 'r') as validators_file:
+                return json.load(validators_file)
+        except (IOError, ValueError):
+            return None
+
+    def _save_validators(self, target_filename, validators):
+        with open(target_filename + VALIDATORS_SUFFIX, 'w') as validators_file:
+            json.dump(validators, validators_file)
+
+    def _remove_validators(self, target_filename):
+        try:
+            os.remove(target_filename + VALIDATORS_SUFFIX)
+        except OSError:
+            pass
 
     def __remove_file_if_exists(self, filename, exception):
         if(os.path.exists(filename)):
@@ -112,61 +476,685 @@ class VodcastDownloader:
 
     def should_be_downloaded(self, vodcast, reference_date):
         """
-        check if a vodcast should be downloaded with respect to a reference date. 
-        
-        Vodcast dates are assumed to be in UTC (see feedparser._parse_rfc822_date), whereas reference_data is assumed to be in local time
+        check if a vodcast should be downloaded with respect to a reference date (aware, usually in local time).
+
+        Vodcast dates are in UTC (see feedparser._parse_rfc822_date), so both are compared as epoch seconds. to select
+        from many vodcasts, use NewerThan, which converts the reference date only once.
         """
-        local_vodcast_date = pytz.utc.localize(vodcast.updated).astimezone(LOCAL_TIMEZONE)
-        local_reference_date = reference_date
-        self.log.debug('checking if [%s] should be downloaded (%s > %s): %s (in timezone [%s])', vodcast, local_vodcast_date, local_reference_date, local_vodcast_date > local_reference_date, LOCAL_TIMEZONE)
-        return local_vodcast_date > local_reference_date
+        return vodcast.timestamp > to_epoch(reference_date)
 
     def _create_target_filename(self, vodcast):
         target_filename = os.path.join(self.basedir, vodcast.local_filename)
+        if self.index and self.index.owner_of(target_filename) not in (None, (self.feed_url, vodcast.guid)):
+            # another item (e.g. of another feed) already uses that name
+            name, extension = os.path.splitext(vodcast.local_filename)
+            target_filename = os.path.join(self.basedir, '%s-%s%s' % (name, hashlib.sha1(vodcast.guid.encode('utf-8')).hexdigest()[:8], extension))
         return target_filename
 
-    def download(self, vodcast):
+    def _already_downloaded(self, vodcast, target_filename):
+        """
+        check the index, if vodcast was completely downloaded. files not known to the index at all are taken over as
+        downloaded, files of unfinished or differently sized downloads are removed.
+        """
+        record = self.index.get(vodcast.guid, self.feed_url)
+        if record and record.completed and os.path.exists(record.target) and os.path.getsize(record.target) == record.size:
+            self.log.info('skipping already downloaded [%s] in [%s]' % (vodcast.guid, record.target))
+            vodcast.target_filename = record.target
+            return True
+        if record and record.evicted:
+            self.log.info('skipping [%s], evicted from [%s] by the retention policy' % (vodcast.guid, record.target))
+            vodcast.target_filename = record.target
+            return True
+        if not os.path.exists(target_filename):
+            return False
+        if record is None and self.index.owner_of(target_filename) is None:
+            self.log.info('adding existing file [%s] to the index' % target_filename)
+            self.index.mark_completed(vodcast.guid, os.path.getsize(target_filename), feed=self.feed_url, url=vodcast.url, target=target_filename)
+            return True
+        self.__remove_file_if_exists(target_filename, 'incomplete download according to index: %s' % record)
+        return False
+
+    def prepare(self, vodcast):
+        """
+        choose the target of vodcast and register its download in the index. returns None, if vodcast was downloaded
+        already (vodcast.target_filename then points to the existing file)
+        """
         target_filename = self._create_target_filename(vodcast)
         vodcast.target_filename = target_filename
-        self.report_log.info('%(target_filename)s(%(updated)s) - %(url)s - %(description)s' % vodcast.__dict__)
-        self.__copy_stream_to_target(vodcast.url, target_filename)
+        if self.index and self._already_downloaded(vodcast, target_filename):
+            return None
+        self.report_log.info('%s(%s) - %s - %s' % (vodcast.target_filename, vodcast.updated, vodcast.url, vodcast.description))
+        if self.index:
+            self.index.mark_started(vodcast.guid, self.feed_url, vodcast.url, target_filename)
+        if self.journal and self.feed_url:
+            self.journal.started(self.feed_url, vodcast.guid)
+        return target_filename
+
+    def queued(self, vodcast):
+        """
+        remember when the download of vodcast was queued, for its time in queue metric
+        """
+        if self.metrics.enabled:
+            self._queued[vodcast.guid] = time.time()
+
+    def start_trace(self, vodcast):
+        return DownloadTrace(self._queued.pop(vodcast.guid, None))
+
+    def completed(self, vodcast, etag=None, checksum=None, trace=None):
+        if self.index:
+            self.index.mark_completed(vodcast.guid, os.path.getsize(vodcast.target_filename), checksum=checksum, etag=etag, feed=self.feed_url)
+        if self.journal and self.feed_url:
+            self.journal.completed(self.feed_url, vodcast.guid)
+        if trace:
+            self.metrics.download_finished(trace, vodcast, self.feed_url, 'completed')
+        if self.post_processor:
+            self.post_processor.submit(vodcast, vodcast.target_filename, self.feed_url, self.post_processed)
+
+    def post_processed(self, result):
+        """
+        re-record size and checksum of a download the hooks modified in place, so the next run does not take it for
+        an incomplete download and --verify does not report it corrupt
+        """
+        if not self.index or not result.succeeded:
+            return
+        record = self.index.get(result.vodcast.guid, self.feed_url)
+        if record is None or not record.completed:
+            return
+        stat = os.stat(result.filename)
+        if stat.st_size == record.size and stat.st_mtime <= record.updated:
+            return
+        checksum = file_checksum(result.filename, record.checksum.split(':', 1)[0]) if record.checksum else None
+        self.log.info('post-processing modified [%s], recording %d bytes, checksum %s' % (result.filename, stat.st_size, checksum))
+        self.index.mark_completed(record.key, stat.st_size, checksum=checksum, etag=record.etag, feed=record.feed)
+
+    def failed(self, vodcast, trace=None):
+        if self.index:
+            self.index.mark_failed(vodcast.guid, self.feed_url)
+        if self.journal and self.feed_url:
+            self.journal.failed(self.feed_url, vodcast.guid)
+        if trace:
+            self.metrics.download_finished(trace, vodcast, self.feed_url, 'failed')
+
+    def download(self, vodcast):
+        trace = self.start_trace(vodcast)
+        target_filename = self.prepare(vodcast)
+        if target_filename is None:
+            return vodcast.target_filename
+        copy = lambda: self.__copy_stream_to_target(vodcast.url, target_filename, trace, vodcast.length)
+        try:
+            if self.retry_policy:
+                etag, checksum = self.retry_policy.call(copy, 'download [%s]' % vodcast.url)
+            else:
+                etag, checksum = copy()
+        except:
+            self.failed(vodcast, trace)
+            if not self.resume:
+                self.discard_partial(target_filename)
+            raise
+        self.completed(vodcast, etag, checksum, trace)
         return target_filename
 
+    def discard_partial(self, target_filename):
+        """
+        remove the .part file and validators kept for retrying the download to target_filename
+        """
+        for filename in (target_filename + PART_SUFFIX, target_filename + VALIDATORS_SUFFIX):
+            self.__remove_file_if_exists(filename, 'download failed for good')
+
+
+class DownloadResult:
+    def __init__(self, vodcast, target_filename=None, error=None):
+        self.vodcast = vodcast
+        self.target_filename = target_filename
+        self.error = error
+
+    @property
+    def succeeded(self):
+        return self.error is None
+
+    def __str__(self):
+        if self.succeeded:
+            return '%s(%s -> %s)' % (self.__class__, self.vodcast, self.target_filename)
+        return '%s(%s failed: %s)' % (self.__class__, self.vodcast, self.error)
+    def __repr__(self):
+        return str(self)
+
+
+class DownloadPool:
+    """
+    bounded pool of worker threads downloading (downloader, vodcast) jobs.
+
+    at most max_per_host jobs run against the same host at a time. jobs are started in the given order, skipping
+    jobs whose host is busy. a failing job is recorded in its DownloadResult and does not affect the other jobs.
+    """
+    def __init__(self, threads=1, max_per_host=None):
+        self.threads = max(1, threads or 1)
+        self.max_per_host = max_per_host
+        self.log = logging.getLogger('DownloadPool')
+
+    def run(self, jobs):
+        jobs = list(jobs)
+        for downloader, vodcast in jobs:
+            downloader.queued(vodcast)
+        results = [None] * len(jobs)
+        if self.threads == 1 or len(jobs) < 2:
+            for index, job in enumerate(jobs):
+                results[index] = self._download(index, job)
+            return results
+
+        pending = list(enumerate(jobs))
+        active_per_host = {}
+        condition = threading.Condition()
+
+        def next_job():
+            with condition:
+                while pending:
+                    for position, (index, job) in enumerate(pending):
+                        host = urlparse(job[1].url).hostname
+                        if not self.max_per_host or active_per_host.get(host, 0) < self.max_per_host:
+                            del pending[position]
+                            active_per_host[host] = active_per_host.get(host, 0) + 1
+                            return index, job, host
+                    condition.wait()
+                return None
+
+        def worker():
+            while True:
+                picked = next_job()
+                if picked is None:
+                    return
+                index, job, host = picked
+                try:
+                    results[index] = self._download(index, job)
+                finally:
+                    with condition:
+                        active_per_host[host] -= 1
+                        condition.notify_all()
+
+        workers = [threading.Thread(target=worker, name='download-%d' % number) for number in range(min(self.threads, len(jobs)))]
+        for thread in workers:
+            thread.daemon = True
+            thread.start()
+        # join with timeout, so KeyboardInterrupt still reaches the main thread
+        while any(thread.is_alive() for thread in workers):
+            for thread in workers:
+                thread.join(0.5)
+        return results
+
+    def _download(self, index, job):
+        downloader, vodcast = job
+        self.log.info('[%03d] downloading %s...' % (index, vodcast))
+        try:
+            return DownloadResult(vodcast, downloader.download(vodcast))
+        except UserInterrupted:
+            raise
+        except Exception as e:
+            self.log.error('[%03d] failed to download %s: %s' % (index, vodcast, e))
+            return DownloadResult(vodcast, error=e)
+
 
 class VodcastDownloadManager:
-    def __init__(self, rss_feed_or_url, download_dir, threads=1):
-        self.downloader = VodcastDownloader(download_dir)
+    def __init__(self, rss_feed_or_url, download_dir, threads=1, resume=False, segments=1, transport=None, feed_cache=None, index=None,
+                 streaming=False, newest_first=False, engine='threads', max_per_host=None, rate_limiter=None, retry_policy=None,
+                 buffer_size=DEFAULT_BUFFER_SIZE, write_policy=WRITE_RENAME, checksum_algorithm=DEFAULT_ALGORITHM, metrics=None,
+                 policies=(), retention=None, reserve=0, probe_sizes=False, parser=None, post_processor=None,
+                 journal=None, scheduler=None):
+        self.transport = transport or HttpTransport(buffer_size=buffer_size, rate_limiter=rate_limiter)
+        feed_url = rss_feed_or_url if urlparse(rss_feed_or_url or '').scheme else None
+        self.downloader = VodcastDownloader(download_dir, url_retriever=self.transport.retrieve, url_opener=self.transport.open,
+                                            resume=resume, segments=segments, index=index, feed_url=feed_url, retry_policy=retry_policy,
+                                            buffer_size=buffer_size, write_policy=write_policy, checksum_algorithm=checksum_algorithm,
+                                            metrics=metrics, post_processor=post_processor,
+                                            journal=journal)
+        self.metrics = self.downloader.metrics
+        self.planner = DownloadPlanner(download_dir, index, self.transport.open, retention, reserve, probe_sizes)
         self.log = logging.getLogger('DownloadManager')
         self.threads = threads
+        self.engine = engine
+        self.max_per_host = max_per_host
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy
+        self.feed_cache = feed_cache
+        self.newest_first = newest_first
+        self.policies = list(policies)
+        self.parser = parser
+        self.streaming = streaming
+        self.rss_feed_or_url = rss_feed_or_url
+        self.journal = journal
+        self.scheduler = scheduler
+        resumed = journal.pending(feed_url) if journal and feed_url else None
+        if resumed:
+            self.resume_batch(resumed)
+        else:
+            self.refresh()
 
+    def refresh(self):
+        """
+        fetch the feed (again), so a long running process can keep the manager with its transport and index. sets
+        vodcasts, not_modified and the update hints of the feed: ttl and update_period in seconds, None if missing
+        """
+        self._reset()
+        rss_feed_or_url = self.rss_feed_or_url
+        if self.streaming:
+            # the feed is parsed, when the reference date is known (see select_newer)
+            self.log.info('opening feed stream at [%s]...' % rss_feed_or_url)
+            self._feed_stream = self._open_feed_stream(rss_feed_or_url)
+        else:
+            self.log.info('parsing feed at [%s]...' % rss_feed_or_url)
+            parsed_feed = self._fetch_feed(rss_feed_or_url)
+        if self.not_modified:
+            self.vodcasts = [Vodcast.from_record(record) for record in self.feed_cache.entries]
+            self.log.info('feed not modified, restored %d vodcast entries from cache.' % len(self.vodcasts))
+            return
+        if self.streaming:
+            return
+        self.ttl, self.update_period = parsed_feed.ttl, parsed_feed.update_period
+        self.vodcasts = parsed_feed.vodcasts
+        self.log.info('found %d vodcast entries.' % len(self.vodcasts))
+
+    def resume_batch(self, batch):
+        """
+        take over the vodcasts of the JournalBatch an interrupted run left unfinished, instead of fetching the feed.
+        next_batch then returns them as they are, neither selected nor planned again
+        """
+        self._reset()
+        self.resumed = batch
+        self.vodcasts = [Vodcast.from_record(record) for record in batch.remaining]
+        self.log.info('resuming %d downloads of [%s] planned at [%s] by an interrupted run' % (len(self.vodcasts), batch.feed, datetime.fromtimestamp(batch.planned)))
+
+    def _reset(self):
+        self.results = []
+        self.deferred = []
+        self.feed_validators = None
+        self.not_modified = False
+        self.resumed = None
+        self.ttl = None
+        self.update_period = None
+        self._feed_stream = None
         self.vodcasts = []
-        self.log.info('parsing feed at [%s]...' % rss_feed_or_url)
-        rss_feed = feedparser.parse(rss_feed_or_url)
-        for entry in rss_feed.entries:
-            self.log.debug('parsing rss item %s' % entry)
-            vodcast = parse_video_item(entry)
-            self.vodcasts.append(vodcast)
-            self.log.debug('parsed vodcast %s' % vodcast)
-        self.log.info('found %d vodcast entries.' % len(rss_feed.entries))
 
-    def download_all_newer(self, reference_date):
+    def _fetch_feed(self, rss_feed_or_url):
+        """
+        fetch http(s) feeds over the pooled transport, everything else (local files, raw xml) is left to feedparser.
+        returns the ParsedFeed. the fetched content is parsed by the FeedParserPool of the manager, if any.
+
+        with a feed cache, the request is conditional. if the server answers 304, not_modified is set and None returned.
+        """
+        if urlparse(rss_feed_or_url or '').scheme not in ('http', 'https'):
+            return self._parse_feed(rss_feed_or_url)
+        response = self._request_feed(rss_feed_or_url)
+        if response is None:
+            return None if self.not_modified else ParsedFeed()
+        started = time.time()
+        try:
+            content = response.read()
+        finally:
+            response.close()
+        response_headers = dict(response.info().items())
+        if self.parser:
+            parsed_feed = self.parser.parse(content, response_headers)
+        else:
+            parsed_feed = parse_feed(content, response_headers)
+        self.metrics.emit(FEED_PARSE, feed=rss_feed_or_url, seconds=time.time() - started, bytes=len(content), entries=parsed_feed.entries)
+        return parsed_feed
+
+    def _parse_feed(self, rss_feed_or_url):
+        """
+        parse with feedparser. with a retry policy, network failures feedparser reports as bozo are retried
+        """
+        started = time.time()
+        parsed_feed = ParsedFeed.of(self._parse_feed_retrying(rss_feed_or_url))
+        self.metrics.emit(FEED_PARSE, feed=self.downloader.feed_url, seconds=time.time() - started, entries=parsed_feed.entries)
+        return parsed_feed
+
+    def _parse_feed_retrying(self, rss_feed_or_url):
+        import feedparser
+        if not self.retry_policy:
+            return feedparser.parse(rss_feed_or_url)
+        def parse():
+            feed = feedparser.parse(rss_feed_or_url)
+            if feed.get('bozo') and self.retry_policy.is_retryable(feed.get('bozo_exception')):
+                raise feed.bozo_exception
+            return feed
+        try:
+            return self.retry_policy.call(parse, 'parse feed [%s]' % rss_feed_or_url)
+        except Exception as e:
+            self.log.error('failed to fetch feed [%s]: %s' % (rss_feed_or_url, e))
+            return feedparser.parse('')
+
+    def _open_feed_stream(self, rss_feed_or_url):
+        """
+        file like object (or file name) to stream the feed from. http(s) feeds are read directly from the response
+        """
+        if urlparse(rss_feed_or_url or '').scheme in ('http', 'https'):
+            return self._request_feed(rss_feed_or_url)
+        if rss_feed_or_url and rss_feed_or_url.lstrip().startswith('<'):
+            return StringIO(rss_feed_or_url)
+        return rss_feed_or_url
+
+    def _request_feed(self, url):
+        """
+        open the feed at url. with a feed cache, the request is conditional. returns None, if the feed could not be
+        fetched or was not modified (see not_modified)
+        """
+        request = Request(url)
+        if self.feed_cache and self.feed_cache.load():
+            if self.feed_cache.etag:
+                request.add_header('If-None-Match', self.feed_cache.etag)
+            if self.feed_cache.modified:
+                request.add_header('If-Modified-Since', self.feed_cache.modified)
+        open_feed = lambda: self.transport.open(request)
+        started = time.time()
+        try:
+            if self.retry_policy:
+                response = self.retry_policy.call(open_feed, 'fetch feed [%s]' % url)
+            else:
+                response = open_feed()
+        except HTTPError as e:
+            self.metrics.emit(FEED_FETCH, feed=url, host=urlparse(url).hostname, status=e.code, seconds=time.time() - started)
+            if e.code == 304:
+                self.not_modified = True
+            else:
+                self.log.error('failed to fetch feed [%s]: %s' % (url, e))
+            return None
+        except Exception as e:
+            self.metrics.emit(FEED_FETCH, feed=url, host=urlparse(url).hostname, status='failed', seconds=time.time() - started)
+            self.log.error('failed to fetch feed [%s]: %s' % (url, e))
+            return None
+        self.metrics.emit(FEED_FETCH, feed=url, host=urlparse(url).hostname, status=response.getcode(), seconds=time.time() - started)
+        if response.getcode() == 304:
+            response.close()
+            self.not_modified = True
+            return None
+        info = response.info()
+        self.feed_validators = (info.getheader('ETag'), info.getheader('Last-Modified'))
+        return response
+
+    def _parse_feed_stream(self, reference_date):
+        feed_stream, self._feed_stream = self._feed_stream, None
+        started = time.time()
+        try:
+            self.vodcasts = list(iter_vodcasts(feed_stream, reference_date, parse_video_item, self.newest_first, self._retried_keys()))
+        except (SyntaxError, IOError) as e:
+            self.log.error('failed to parse feed: %s' % e)
+            # fetch it in full again next time
+            self.feed_validators = None
+        finally:
+            if hasattr(feed_stream, 'close'):
+                feed_stream.close()
+        self.metrics.emit(FEED_PARSE, feed=self.downloader.feed_url, seconds=time.time() - started, entries=len(self.vodcasts))
+        self.log.info('found %d vodcast entries newer than [%s].' % (len(self.vodcasts), reference_date))
+
+    @property
+    def failed(self):
+        return [result for result in self.results if not result.succeeded]
+
+    @property
+    def retries(self):
+        """
+        vodcasts of the feed whose download failed (also those --verify found corrupt) or was deferred according to
+        the index, which are downloaded again however old
+        """
+        if not self.vodcasts:
+            return []
+        retried = self._retried_keys([vodcast.guid for vodcast in self.vodcasts])
+        return [vodcast for vodcast in self.vodcasts if vodcast.guid in retried]
+
+    def _retried_keys(self, keys=None):
+        index, feed_url = self.downloader.index, self.downloader.feed_url
+        return index.keys(feed_url, RETRIED, keys) if index and feed_url else set()
+
+    def select_newer(self, reference_date):
+        if self.not_modified:
+            retries = self.retries
+            if not retries:
+                self.log.info('feed not modified since last fetch, nothing new to download')
+                return []
+            self.log.info('feed not modified since last fetch, downloading [%d] failed or deferred vodcasts again' % len(retries))
+            return Selection(self.policies).select(retries)
         self.downloader.reference_date = reference_date
+        if self._feed_stream is not None:
+            self._parse_feed_stream(reference_date)
         vodcasts_to_download = []
-        for vodcast in self.vodcasts:
-            if self.downloader.should_be_downloaded(vodcast, reference_date):
-                vodcasts_to_download.append(vodcast)
-
+        if self.vodcasts:
+            retry = [vodcast.guid for vodcast in self.retries]
+            vodcasts_to_download = Selection([NewerThan(reference_date, retry)] + self.policies).select(self.vodcasts)
         self.log.info('will download [%d] vodcasts updated after [%s]' % (len(vodcasts_to_download), reference_date))
+        return vodcasts_to_download
+
+    def plan(self, vodcasts, reserved=0):
+        """
+        order and limit the selected vodcasts by the free space of the download directory, after evicting old
+        downloads according to the retention policy. reserved bytes are planned by other managers already. those
+        skipped for lack of space are deferred to the next run, like failed downloads
+        """
+        planned = self.planner.plan(vodcasts, self.downloader.feed_url, reserved)
+        self.deferred = self.planner.deferred
+        if self.downloader.index:
+            for vodcast in self.deferred:
+                self.downloader.index.mark_deferred(vodcast.guid, self.downloader.feed_url, vodcast.url)
+        return planned
 
-        counter = 0
-        for vodcast_to_download in vodcasts_to_download:
-            self.log.info('[%03d] downloading %s...' % (counter, vodcast_to_download))
-            self.downloader.download(vodcast_to_download)
-            counter += 1
+    def next_batch(self, reference_date, reserved=0):
+        """
+        the vodcasts to download: those of a resumed batch, otherwise the plan of the vodcasts newer than
+        reference_date, journaled before the first download starts
+        """
+        if self.resumed:
+            return self.vodcasts
+        vodcasts = self.plan(self.select_newer(reference_date), reserved)
+        if self.journal and self.downloader.feed_url and vodcasts:
+            self.journal.planned(self.downloader.feed_url, vodcasts)
+        return vodcasts
+
+    def download_all_newer(self, reference_date):
+        jobs = [(self.downloader, vodcast) for vodcast in self.next_batch(reference_date)]
+        if self.scheduler:
+            jobs = self.scheduler.order(jobs)
+        self.log.info('downloading using the [%s] engine' % self.engine)
+        return self.finish(create_download_pool(self.engine, self.threads, self.max_per_host, self.rate_limiter).run(jobs))
+
+    def finish(self, results):
+        """
+        record the results of downloading the selected vodcasts. returns the number of successful downloads
+        """
+        self.results = results
+        counter = len(self.results) - len(self.failed)
+        if self.failed:
+            self.log.warn('failed to download [%d] vodcasts: %s' % (len(self.failed), self.failed))
         self.log.info('downloaded [%d] vodcasts' % counter)
+        if self.deferred:
+            self.log.warn('deferred [%d] vodcasts to the next run for lack of space: %s' % (len(self.deferred), self.deferred))
+        # the index brings back failed and deferred vodcasts, also of an unchanged feed. without one, only remember
+        # the feed version once everything selected from it was downloaded
+        if self.feed_cache and self.feed_validators and (self.downloader.index or not (self.failed or self.deferred)):
+            etag, modified = self.feed_validators
+            self.feed_cache.save(etag, modified, [vodcast.to_record() for vodcast in self.vodcasts])
+        if self.journal and self.downloader.feed_url:
+            self.journal.finished(self.downloader.feed_url)
         return counter
 
 
+class ParsedFeed:
+    """
+    the vodcasts of a parsed feed, the number of its entries and its update hints (see _update_hints)
+    """
+    def __init__(self, vodcasts=(), ttl=None, update_period=None, entries=0):
+        self.vodcasts = list(vodcasts)
+        self.ttl = ttl
+        self.update_period = update_period
+        self.entries = entries
+
+    @classmethod
+    def of(cls, rss_feed):
+        """
+        the ParsedFeed of a feedparser result
+        """
+        ttl, update_period = _update_hints(rss_feed.get('feed', {}))
+        return cls([parse_video_item(entry) for entry in rss_feed.entries], ttl, update_period, len(rss_feed.entries))
+
+def parse_feed(content, response_headers=None):
+    import feedparser
+    return ParsedFeed.of(feedparser.parse(content, response_headers=response_headers))
+
+def _parse_feed_records(content, response_headers):
+    """
+    parse in a FeedParserPool worker. the vodcasts are sent back as records, which pickle compactly
+    """
+    parsed_feed = parse_feed(content, response_headers)
+    parsed_feed.vodcasts = [vodcast.to_record() for vodcast in parsed_feed.vodcasts]
+    return parsed_feed
+
+class FeedParserPool:
+    """
+    parse fetched feeds in a pool of processes, so parsing (pure python and CPU bound) of many feeds scales across
+    cores while the fetching threads wait for the network. parse is called from any number of threads.
+
+    create the pool before starting threads: its workers are forked.
+    """
+    def __init__(self, processes=None):
+        import multiprocessing
+        self.log = logging.getLogger('FeedParserPool')
+        self._pool = multiprocessing.Pool(processes)
+
+    def parse(self, content, response_headers=None):
+        parsed_feed = self._pool.apply(_parse_feed_records, (content, response_headers))
+        parsed_feed.vodcasts = [Vodcast.from_record(record) for record in parsed_feed.vodcasts]
+        return parsed_feed
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+
+# seconds of the sy:updatePeriod values
+UPDATE_PERIODS = {'hourly' : 3600, 'daily' : 86400, 'weekly' : 7 * 86400, 'monthly' : 30 * 86400, 'yearly' : 365 * 86400}
+
+def _update_hints(channel):
+    """
+    (ttl, update period) in seconds announced by the channel of a feed: the RSS ttl and the syndication module's
+    updatePeriod divided by updateFrequency. None, where missing or malformed
+    """
+    ttl = update_period = None
+    try:
+        ttl = int(channel.get('ttl')) * 60 if channel.get('ttl') else None
+    except ValueError:
+        pass
+    period = UPDATE_PERIODS.get((channel.get('sy_updateperiod') or '').strip().lower())
+    if period:
+        try:
+            update_period = period / max(1, int(channel.get('sy_updatefrequency') or 1))
+        except ValueError:
+            update_period = period
+    return ttl, update_period
+
+
+class BatchDownloadManager:
+    """
+    download the newer vodcasts of many subscriptions in one process. feeds are fetched in parallel and every
+    selected vodcast goes to one shared DownloadPool, bounded globally by threads and per host by max_per_host.
+
+    create_manager builds the VodcastDownloadManager for a subscription. with the 'events' engine, the downloads
+    run on one thread instead (see create_download_pool).
+    """
+    def __init__(self, subscriptions, create_manager, threads=1, max_per_host=2, fetch_threads=8, engine='threads', rate_limiter=None,
+                 scheduler=None):
+        self.log = logging.getLogger('BatchDownloadManager')
+        self.scheduler = scheduler
+        self.rate_limiter = rate_limiter
+        self.threads = threads
+        self.engine = engine
+        self.max_per_host = max_per_host
+        self.subscriptions = list(subscriptions)
+        self.log.info('fetching %d feeds...' % len(self.subscriptions))
+
+        def fetch(subscription):
+            try:
+                return create_manager(subscription)
+            except Exception as e:
+                self.log.error('failed to fetch feed [%s]: %s' % (subscription.url, e))
+                return None
+
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(max(1, min(fetch_threads, len(self.subscriptions))))
+        try:
+            self.managers = pool.map(fetch, self.subscriptions)
+        finally:
+            pool.close()
+
+    def download_all_newer(self, reference_dates):
+        """
+        download the vodcasts newer than the reference date of their subscription, or the rest of a resumed batch (no
+        reference date needed). returns a map of subscription to number of downloaded vodcasts, leaving out the
+        subscriptions whose feed could not be fetched
+        """
+        jobs = []
+        selected = {}
+        # feeds sharing a download directory share its free space
+        reserved = {}
+        for subscription, manager in zip(self.subscriptions, self.managers):
+            if manager is None:
+                continue
+            directory = os.path.realpath(subscription.download_directory)
+            selected[subscription] = manager.next_batch(reference_dates.get(subscription), reserved.get(directory, 0))
+            reserved[directory] = reserved.get(directory, 0) + manager.planner.planned_bytes(selected[subscription], manager.downloader.feed_url)
+            jobs.extend((manager.downloader, vodcast) for vodcast in selected[subscription])
+
+        if self.scheduler:
+            jobs = self.scheduler.order(jobs)
+        self.log.info('downloading [%d] vodcasts of [%d] feeds using the [%s] engine (at most [%s] per host)' % (len(jobs), len(selected), self.engine, self.max_per_host))
+        results = create_download_pool(self.engine, self.threads, self.max_per_host, self.rate_limiter).run(jobs)
+        result_of = dict((id(vodcast), result) for (downloader, vodcast), result in zip(jobs, results))
+
+        counters = {}
+        for subscription, manager in zip(self.subscriptions, self.managers):
+            if manager is not None:
+                counters[subscription] = manager.finish([result_of[id(vodcast)] for vodcast in selected[subscription]])
+        return counters
+
+
+def create_download_pool(engine, threads=1, max_per_host=None, rate_limiter=None):
+    """
+    the runner of (downloader, vodcast) jobs for engine: 'threads' for a DownloadPool of that many threads, 'events'
+    for the single threaded EventLoopDownloadEngine. the threaded pool is shaped by the rate limiter of the
+    transport its downloaders use.
+    """
+    if engine == 'events':
+        from event_engine import EventLoopDownloadEngine
+        return EventLoopDownloadEngine(max_per_host=max_per_host, rate_limiter=rate_limiter)
+    if engine != 'threads':
+        raise ValueError('unknown download engine [%s]' % engine)
+    return DownloadPool(threads, max_per_host)
+
+def _validators_of(response):
+    info = response.info()
+    content_range = _parse_content_range(info.getheader('Content-Range'))
+    if content_range:
+        length = content_range[2]
+    elif info.getheader('Content-Length'):
+        length = int(info.getheader('Content-Length'))
+    else:
+        length = None
+    return {'etag' : info.getheader('ETag'), 'last_modified' : info.getheader('Last-Modified'), 'length' : length}
+
+def _parse_content_range(content_range):
+    """
+    parse a 'bytes first-last/length' header into (first, last, length). length is None if unknown ('*')
+    """
+    match = re.match(r'bytes\s+(\d+)-(\d+)/(\d+|\*)', content_range or '')
+    if not match:
+        return None
+    first, last, length = match.groups()
+    return int(first), int(last), None if length == '*' else int(length)
+
+def _split_into_segments(length, count, min_segment_size):
+    """
+    split length bytes into at most count (first, last) ranges of at least min_segment_size bytes
+    """
+    count = max(1, min(count, length // max(1, min_segment_size)))
+    segment_size = -(-length // count)
+    return [(first, min(first + segment_size, length) - 1) for first in range(0, length, segment_size)]
+
 def parse_video_item(item):
     return Vodcast(item)
 
@@ -0,0 +1,149 @@
+"""
+cost-aware order of the download queue.
+
+the planned order (per feed newest first, feeds one after the other) lets a single large special delay every small
+episode behind it. the policies here order all (downloader, vodcast) jobs of a run by what they cost, the enclosure
+length (announced by the feed or probed with HEAD requests, see DownloadPlanner), and by per feed priority and
+deadline tags. the Scheduler logs the chosen order with the predicted time every download is available, simulating
+the downloads on the pool's threads at an expected rate.
+"""
+import heapq
+import logging
+
+# bytes per second of one download, for predicting completion times when no rate is known
+DEFAULT_RATE = 1024 * 1024
+
+class FeedTags:
+    """
+    scheduling tags of a feed: priority (lower goes first) and deadline, the seconds after publishing by which its
+    episodes should be available
+    """
+    def __init__(self, priority=0, deadline=None):
+        self.priority = priority
+        self.deadline = deadline
+
+    def __str__(self):
+        return '%s(priority=%s, deadline=%s)' % (self.__class__, self.priority, self.deadline)
+    def __repr__(self):
+        return str(self)
+
+NO_TAGS = FeedTags()
+
+def estimated_lengths(jobs):
+    """
+    the length of every job's vodcast, the mean of the known ones for those of unknown length
+    """
+    known = [vodcast.length for downloader, vodcast in jobs if vodcast.length is not None]
+    default = sum(known) / len(known) if known else 0
+    return [default if vodcast.length is None else vodcast.length for downloader, vodcast in jobs]
+
+class PlannedOrder:
+    """
+    the jobs as planned
+    """
+    name = 'planned'
+
+    def order(self, jobs, tags):
+        return list(jobs)
+
+class NewestFirst:
+    """
+    the most recently published vodcasts of all feeds first
+    """
+    name = 'newest'
+
+    def order(self, jobs, tags):
+        return sorted(jobs, key=lambda job: -job[1].timestamp)
+
+class SmallestFirst:
+    """
+    shortest job first, minimizing the mean time until a download is available. vodcasts of unknown length go last,
+    newest first
+    """
+    name = 'smallest'
+
+    def order(self, jobs, tags):
+        return sorted(jobs, key=lambda job: (job[1].length is None, job[1].length, -job[1].timestamp))
+
+class FairShare:
+    """
+    interleave the feeds by bytes: the next job is always taken from the feed with the fewest bytes scheduled so far,
+    each feed in its planned order. a feed with one large episode thus does not hold back the others
+    """
+    name = 'fair'
+
+    def order(self, jobs, tags):
+        queues = {}
+        first_seen = {}
+        for position, (job, length) in enumerate(zip(jobs, estimated_lengths(jobs))):
+            feed = job[0].feed_url
+            first_seen.setdefault(feed, position)
+            queues.setdefault(feed, []).append((job, length))
+        # (scheduled bytes, first position of the feed, feed)
+        heap = [(0, first_seen[feed], feed) for feed in queues]
+        heapq.heapify(heap)
+        ordered = []
+        while heap:
+            scheduled, position, feed = heapq.heappop(heap)
+            job, length = queues[feed].pop(0)
+            ordered.append(job)
+            if queues[feed]:
+                heapq.heappush(heap, (scheduled + max(1, length), position, feed))
+        return ordered
+
+class DeadlineFirst:
+    """
+    by priority of the feed, then earliest deadline (publish time plus deadline of the feed, none being last), then
+    smallest first
+    """
+    name = 'deadline'
+
+    def order(self, jobs, tags):
+        def key(job):
+            feed_tags = tags.get(job[0].feed_url, NO_TAGS)
+            due = job[1].timestamp + feed_tags.deadline if feed_tags.deadline is not None else float('inf')
+            return (feed_tags.priority, due, job[1].length is None, job[1].length)
+        return sorted(jobs, key=key)
+
+SCHEDULING_POLICIES = dict((policy.name, policy) for policy in (PlannedOrder, NewestFirst, SmallestFirst, FairShare, DeadlineFirst))
+SCHEDULE_PLANNED = PlannedOrder.name
+
+class Scheduler:
+    """
+    order download jobs by policy (a name of SCHEDULING_POLICIES or a policy) and log the order with the predicted
+    time every download is available. predictions assume threads parallel downloads at rate bytes per second each.
+    tags maps feed urls to their FeedTags
+    """
+    def __init__(self, policy=SCHEDULE_PLANNED, threads=1, rate=None, tags=None):
+        self.policy = SCHEDULING_POLICIES[policy]() if isinstance(policy, basestring) else policy
+        self.threads = max(1, threads or 1)
+        self.rate = rate or DEFAULT_RATE
+        self.tags = tags or {}
+        self.log = logging.getLogger('Scheduler')
+
+    def order(self, jobs):
+        ordered = self.policy.order(list(jobs), self.tags)
+        if ordered and self.log.isEnabledFor(logging.INFO):
+            self._log_forecast(ordered)
+        return ordered
+
+    def forecast(self, jobs):
+        """
+        seconds from now until each of the jobs, started in this order, is predicted to be available
+        """
+        workers = [0.0] * min(self.threads, len(jobs) or 1)
+        available = []
+        for length in estimated_lengths(jobs):
+            started = heapq.heappop(workers)
+            finished = started + float(length) / self.rate
+            heapq.heappush(workers, finished)
+            available.append(finished)
+        return available
+
+    def _log_forecast(self, jobs):
+        available = self.forecast(jobs)
+        self.log.info('scheduled %d downloads in %s order, mean predicted time to available %.0fs (at %d bytes/s per download)'
+                      % (len(jobs), self.policy.name, sum(available) / len(available), self.rate))
+        for position, ((downloader, vodcast), seconds) in enumerate(zip(jobs, available)):
+            self.log.info('%3d. [%s] of [%s], %s bytes, available in %.0fs' % (position + 1, vodcast.title, downloader.feed_url,
+                                                                              vodcast.length if vodcast.length is not None else '?', seconds))
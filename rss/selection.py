@@ -0,0 +1,148 @@
+"""
+selection policies deciding which vodcasts of a feed are downloaded.
+
+filters (NewerThan, TitleMatches, NotDownloaded) narrow the entries of a feed down in one list pass each, comparing
+precomputed values only: the reference date is converted to epoch seconds once, not every vodcast to local time.
+budgets (NewestN, MaxTotalBytes) then admit the remaining vodcasts newest first, in a single pass over them sorted by
+publish time.
+"""
+import logging
+import re
+from calendar import timegm
+from download_index import COMPLETED, EVICTED
+
+def to_epoch(date):
+    """
+    epoch seconds of date, naive dates being in UTC
+    """
+    return timegm(date.utctimetuple())
+
+class NewerThan:
+    """
+    vodcasts published after reference_date, and those whose guid is one of retry however old (e.g. downloads that
+    failed or were found corrupt)
+    """
+    def __init__(self, reference_date, retry=()):
+        self.reference_date = reference_date
+        self.cutoff = to_epoch(reference_date)
+        self.retry = frozenset(retry)
+
+    def filter(self, vodcasts):
+        cutoff = self.cutoff
+        retry = self.retry
+        return [vodcast for vodcast in vodcasts if vodcast.timestamp > cutoff or vodcast.guid in retry]
+
+    def __str__(self):
+        return 'newer than [%s]' % self.reference_date
+
+class TitleMatches:
+    """
+    vodcasts whose title matches the regular expression pattern (anywhere, ignoring case), or not, if exclude
+    """
+    def __init__(self, pattern, exclude=False):
+        self.pattern = re.compile(pattern, re.IGNORECASE | re.UNICODE)
+        self.exclude = exclude
+
+    def filter(self, vodcasts):
+        search = self.pattern.search
+        exclude = self.exclude
+        return [vodcast for vodcast in vodcasts if (search(vodcast.title or '') is None) == exclude]
+
+    def __str__(self):
+        return 'title %s [%s]' % ('not matching' if self.exclude else 'matching', self.pattern.pattern)
+
+class NotDownloaded:
+    """
+    vodcasts of feed whose guid is neither completed nor evicted in the download index. the guids of the vodcasts
+    are looked up once per selection
+    """
+    def __init__(self, index, feed=None):
+        self.index = index
+        self.feed = feed
+
+    def filter(self, vodcasts):
+        downloaded = self.index.keys(self.feed, (COMPLETED, EVICTED), [vodcast.guid for vodcast in vodcasts])
+        return [vodcast for vodcast in vodcasts if vodcast.guid not in downloaded]
+
+    def __str__(self):
+        return 'not downloaded'
+
+class Tally:
+    """
+    number and bytes of the vodcasts admitted so far
+    """
+    def __init__(self):
+        self.count = 0
+        self.bytes = 0
+
+    def add(self, vodcast):
+        self.count += 1
+        self.bytes += vodcast.length or 0
+
+class NewestN:
+    """
+    at most count vodcasts, the newest ones
+    """
+    def __init__(self, count):
+        self.count = count
+
+    def fits(self, vodcast, tally):
+        return tally.count < self.count
+
+    def exhausted(self, tally):
+        return tally.count >= self.count
+
+    def __str__(self):
+        return 'newest %d' % self.count
+
+class MaxTotalBytes:
+    """
+    the newest vodcasts adding up to at most limit bytes. older vodcasts may fill what a large one left. vodcasts of
+    unknown length (no enclosure length in the feed) count as 0 bytes
+    """
+    def __init__(self, limit):
+        self.limit = limit
+
+    def fits(self, vodcast, tally):
+        return tally.bytes + (vodcast.length or 0) <= self.limit
+
+    def exhausted(self, tally):
+        # an older, smaller vodcast may still fit
+        return False
+
+    def __str__(self):
+        return 'at most %d bytes' % self.limit
+
+class Selection:
+    """
+    apply policies to the vodcasts of a feed: first all filters, then all budgets. the selected vodcasts keep the
+    order of the feed
+    """
+    def __init__(self, policies=()):
+        self.policies = list(policies)
+        self.filters = [policy for policy in self.policies if hasattr(policy, 'filter')]
+        self.budgets = [policy for policy in self.policies if hasattr(policy, 'fits')]
+        self.log = logging.getLogger('Selection')
+
+    def select(self, vodcasts):
+        candidates = list(vodcasts)
+        for policy in self.filters:
+            candidates = policy.filter(candidates)
+        if self.budgets:
+            candidates = self._admit(candidates)
+        self.log.debug('selected %d vodcasts (%s)' % (len(candidates), self))
+        return candidates
+
+    def _admit(self, candidates):
+        tally = Tally()
+        admitted = set()
+        for position, vodcast in sorted(enumerate(candidates), key=lambda candidate: -candidate[1].timestamp):
+            if all(budget.fits(vodcast, tally) for budget in self.budgets):
+                tally.add(vodcast)
+                admitted.add(position)
+                if any(budget.exhausted(tally) for budget in self.budgets):
+                    break
+        return [vodcast for position, vodcast in enumerate(candidates) if position in admitted]
+
+    def __str__(self):
+        return ', '.join(str(policy) for policy in self.policies)
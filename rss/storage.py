@@ -0,0 +1,152 @@
+"""
+write path of downloads: large buffered copies, preallocation of the target and the policy of how a finished
+download becomes visible (written in place, renamed from a .part file, or additionally synced to disk).
+"""
+import errno
+import logging
+import os
+
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+
+# write directly to the target. readers may see half written files
+WRITE_DIRECT = 'direct'
+# write to a .part file, renamed to the target when complete
+WRITE_RENAME = 'rename'
+# like rename, flushing file and directory to disk first, so a crash never leaves a truncated target
+WRITE_FSYNC = 'fsync'
+WRITE_POLICIES = (WRITE_DIRECT, WRITE_RENAME, WRITE_FSYNC)
+
+FALLOC_FL_KEEP_SIZE = 1
+
+log = logging.getLogger('storage')
+
+# looked up on the first preallocation, loading ctypes (and searching for libc) takes long compared to a short run
+_fallocate = _posix_fallocate = None
+_libc_loaded = False
+
+def _load_libc():
+    global _fallocate, _posix_fallocate, _libc_loaded
+    if _libc_loaded:
+        return
+    import ctypes
+    import ctypes.util
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    except (OSError, TypeError):
+        libc = None
+    _fallocate = _libc_function(libc, 'fallocate', [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64])
+    _posix_fallocate = _libc_function(libc, 'posix_fallocate', [ctypes.c_int, ctypes.c_int64, ctypes.c_int64])
+    _libc_loaded = True
+
+def _libc_function(libc, name, argtypes):
+    function = getattr(libc, name, None)
+    if function is not None:
+        function.argtypes = argtypes
+    return function
+
+def preallocate(target, length, keep_size=True):
+    """
+    reserve length bytes of disk space for the open file target, so the download is written into contiguous
+    blocks. returns True if space was reserved.
+
+    with keep_size, the file size stays untouched (Linux fallocate with FALLOC_FL_KEEP_SIZE), so the size of a
+    .part file still tells how much was downloaded. otherwise the file is extended to length with posix_fallocate,
+    falling back to a sparse truncate.
+    """
+    _load_libc()
+    target.flush()
+    fd = target.fileno()
+    if keep_size:
+        if _fallocate is None:
+            return False
+        if _fallocate(fd, FALLOC_FL_KEEP_SIZE, 0, length) != 0:
+            import ctypes
+            log.debug('fallocate of %d bytes failed: %s' % (length, os.strerror(ctypes.get_errno())))
+            return False
+        return True
+    if _posix_fallocate is not None:
+        error = _posix_fallocate(fd, 0, length)
+        if error == 0:
+            return True
+        log.debug('posix_fallocate of %d bytes failed: %s' % (length, os.strerror(error)))
+    target.truncate(length)
+    return False
+
+class BlockWriter:
+    """
+    unbuffered writer of a download to filename, starting at offset. the writes come in the large blocks of
+    copy_stream, so no extra buffering is needed. with the expected length, the disk space is reserved upfront.
+    """
+    def __init__(self, filename, offset=0, length=None, preallocate_space=True):
+        self.filename = filename
+        self.position = offset
+        self.file = open(filename, 'r+b' if offset else 'wb', 0)
+        if offset:
+            self.file.seek(offset)
+        if length and preallocate_space:
+            preallocate(self.file, length)
+
+    def write(self, block):
+        self.file.write(block)
+        self.position += len(block)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def copy_stream(source, target, buffer_size=DEFAULT_BUFFER_SIZE, on_block=None, limit=None):
+    """
+    copy source (a response) to target in blocks of buffer_size, up to limit bytes if given. sources supporting
+    readinto are read into one reusable buffer, others with read. on_block is called with the size of every block.
+    returns the number of bytes copied.
+    """
+    copied = 0
+    readinto = getattr(source, 'readinto', None)
+    if readinto is not None:
+        buffer = bytearray(buffer_size)
+        view = memoryview(buffer)
+    while limit is None or copied < limit:
+        size = buffer_size if limit is None else min(buffer_size, limit - copied)
+        if readinto is not None:
+            count = readinto(view[:size])
+            if not count:
+                return copied
+            target.write(view[:count])
+        else:
+            block = source.read(size)
+            if not block:
+                return copied
+            count = len(block)
+            target.write(block)
+        copied += count
+        if on_block:
+            on_block(count)
+    return copied
+
+def commit(part_filename, target_filename, sync=False):
+    """
+    make the finished part_filename visible as target_filename. with sync, the data and the rename are flushed to
+    disk first
+    """
+    if sync:
+        _fsync_path(part_filename)
+    os.rename(part_filename, target_filename)
+    if sync:
+        try:
+            _fsync_path(os.path.dirname(os.path.abspath(target_filename)))
+        except OSError as e:
+            # not every platform or file system can sync a directory
+            if e.errno not in (errno.EINVAL, errno.EBADF, errno.EACCES):
+                raise
+
+def _fsync_path(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
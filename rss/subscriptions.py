@@ -0,0 +1,69 @@
+import logging
+import os
+from xml.etree import cElementTree
+
+class Subscription:
+    """
+    a feed to download into download_directory. priority (lower goes first) and deadline (hours after publishing by
+    which an episode should be available) tag the feed for the deadline scheduling policy
+    """
+    def __init__(self, url, download_directory, day_offset=None, priority=0, deadline=None):
+        self.url = url
+        self.download_directory = download_directory
+        self.day_offset = day_offset
+        self.priority = priority
+        self.deadline = deadline
+
+    def __str__(self):
+        return '%s(url=%s, download_directory=%s, day_offset=%s, priority=%s, deadline=%s)' % (self.__class__, self.url, self.download_directory, self.day_offset, self.priority, self.deadline)
+    def __repr__(self):
+        return str(self)
+
+def load_subscriptions(path, default_download_directory=None, default_day_offset=None):
+    """
+    read subscriptions either from an OPML file or from a plain list.
+
+    OPML outlines need a xmlUrl and may carry downloadDirectory, dayOffset, priority and deadline attributes. plain
+    lists have one 'URL [DIR [DAYS]] [priority=N] [deadline=HOURS]' per line, blank lines and lines starting with #
+    are ignored. missing directories and day offsets fall back to the given defaults.
+    """
+    with open(path, 'r') as subscriptions_file:
+        content = subscriptions_file.read()
+    if content.lstrip().startswith('<'):
+        subscriptions = _parse_opml(content, default_download_directory, default_day_offset)
+    else:
+        subscriptions = _parse_list(content, default_download_directory, default_day_offset)
+    logging.getLogger('subscriptions').info('read %d subscriptions from [%s]' % (len(subscriptions), path))
+    return subscriptions
+
+def _parse_opml(content, default_download_directory, default_day_offset):
+    subscriptions = []
+    for outline in cElementTree.fromstring(content).iter('outline'):
+        url = outline.get('xmlUrl')
+        if not url:
+            continue
+        day_offset = outline.get('dayOffset')
+        subscriptions.append(_create_subscription(url, outline.get('downloadDirectory') or default_download_directory,
+                                                  int(day_offset) if day_offset else default_day_offset,
+                                                  outline.get('priority'), outline.get('deadline')))
+    return subscriptions
+
+def _parse_list(content, default_download_directory, default_day_offset):
+    subscriptions = []
+    for line in content.splitlines():
+        fields = line.split()
+        if not fields or fields[0].startswith('#'):
+            continue
+        # the url may contain '=' itself
+        tags = dict(field.split('=', 1) for field in fields[1:] if '=' in field)
+        fields = fields[:1] + [field for field in fields[1:] if '=' not in field]
+        download_directory = fields[1] if len(fields) > 1 else default_download_directory
+        day_offset = int(fields[2]) if len(fields) > 2 else default_day_offset
+        subscriptions.append(_create_subscription(fields[0], download_directory, day_offset, tags.get('priority'), tags.get('deadline')))
+    return subscriptions
+
+def _create_subscription(url, download_directory, day_offset, priority=None, deadline=None):
+    if not download_directory:
+        raise Exception('no download directory given for subscription [%s]' % url)
+    return Subscription(url, os.path.expanduser(download_directory), day_offset,
+                        int(priority) if priority else 0, float(deadline) if deadline else None)
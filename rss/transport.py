@@ -0,0 +1,209 @@
+import httplib
+import itertools
+import logging
+import socket
+import threading
+from StringIO import StringIO
+from urllib import urlretrieve
+from urllib2 import urlopen, Request, HTTPError
+from urlparse import urlparse, urljoin
+from rate_limit import THROTTLING_CODES, parse_retry_after
+from retry import IncompleteTransferError
+from storage import BlockWriter, DEFAULT_BUFFER_SIZE, copy_stream
+
+DEFAULT_TIMEOUT = 30
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+class PooledResponse:
+    """
+    urllib2 like response of a pooled connection. the connection goes back to the pool once the body
+    has been read completely and the response is closed.
+    """
+    def __init__(self, transport, key, connection, response, url, rate_limiter=None):
+        self._transport = transport
+        self._rate_limiter = rate_limiter
+        self._key = key
+        self._connection = connection
+        self._response = response
+        self.url = url
+        self.code = response.status
+        self.msg = response.reason
+
+    def getcode(self):
+        return self.code
+
+    def geturl(self):
+        return self.url
+
+    def info(self):
+        return self._response.msg
+
+    def read(self, amt=None):
+        burst = self._rate_limiter.burst(self._key[1]) if self._rate_limiter else None
+        if burst is None:
+            return self._throttled(self._response.read(amt))
+        # read at most a burst at a time, a larger block would arrive well above the rate before the limiter kicks in
+        if amt is not None:
+            return self._throttled(self._response.read(min(amt, burst)))
+        blocks = []
+        while True:
+            block = self._throttled(self._response.read(burst))
+            if not block:
+                return ''.join(blocks)
+            blocks.append(block)
+
+    def _throttled(self, block):
+        if self._rate_limiter and block:
+            self._rate_limiter.throttle(self._key[1], len(block))
+        return block
+
+    def close(self):
+        if self._connection is None:
+            return
+        connection, self._connection = self._connection, None
+        if self._response.length == 0:
+            # bodyless responses (HEAD, 204, empty range) still need to be marked as read
+            self._response.read()
+        if self._response.isclosed() and not self._response.will_close:
+            self._transport._release(self._key, connection)
+        else:
+            connection.close()
+
+class HttpTransport:
+    """
+    HTTP transport keeping a pool of persistent (keep-alive) connections per host.
+
+    open() is a drop in for urllib2.urlopen and retrieve() for urllib.urlretrieve, so an instance plugs into
+    the url_opener and url_retriever of a VodcastDownloader. urls with other schemes than http(s) are handed
+    to urllib2/urllib.
+
+    with a RateLimiter, response bodies are read no faster than it allows, and hosts answering 429 or 503 with
+    a Retry-After are not asked again before that time.
+    """
+    def __init__(self, timeout=DEFAULT_TIMEOUT, buffer_size=DEFAULT_BUFFER_SIZE, max_redirects=5, max_idle_per_host=8, rate_limiter=None, preallocate=True):
+        self.timeout = timeout
+        self.preallocate = preallocate
+        self.rate_limiter = rate_limiter
+        self.buffer_size = buffer_size
+        self.max_redirects = max_redirects
+        self.max_idle_per_host = max_idle_per_host
+        self.connections_opened = 0
+        self.log = logging.getLogger('HttpTransport')
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def open(self, request):
+        if not isinstance(request, Request):
+            request = Request(request)
+        url = request.get_full_url()
+        if urlparse(url).scheme not in ('http', 'https'):
+            return urlopen(request, timeout=self.timeout)
+
+        method = request.get_method()
+        headers = dict(request.header_items())
+        for redirect in range(self.max_redirects + 1):
+            if self.rate_limiter:
+                self.rate_limiter.wait(urlparse(url).hostname)
+            key, connection, response = self._request(method, url, headers)
+            location = response.getheader('Location')
+            if response.status in REDIRECT_CODES and location:
+                response.read()
+                self._finish(key, connection, response)
+                url = urljoin(url, location)
+                if response.status == 303:
+                    method = 'GET'
+                self.log.debug('following redirect to [%s]' % url)
+                continue
+            if response.status >= 400:
+                body = response.read()
+                self._finish(key, connection, response)
+                self._defer_if_throttled(key[1], response)
+                raise HTTPError(url, response.status, response.reason, response.msg, StringIO(body))
+            return PooledResponse(self, key, connection, response, url, self.rate_limiter)
+        raise HTTPError(url, response.status, 'too many redirects', response.msg, StringIO())
+
+    def retrieve(self, url, filename, reporthook=None):
+        if urlparse(url).scheme not in ('http', 'https'):
+            return urlretrieve(url, filename, reporthook)
+
+        response = self.open(url)
+        try:
+            headers = response.info()
+            size = int(headers.getheader('Content-Length', -1))
+            if reporthook:
+                reporthook(0, self.buffer_size, size)
+            block_numbers = itertools.count(1)
+            def on_block(count):
+                if reporthook:
+                    reporthook(next(block_numbers), count, size)
+            with BlockWriter(filename, length=max(0, size), preallocate_space=self.preallocate) as target:
+                read = copy_stream(response, target, self.buffer_size, on_block)
+        finally:
+            response.close()
+        if size >= 0 and read < size:
+            raise IncompleteTransferError('retrieval incomplete: got only %d out of %d bytes' % (read, size))
+        return filename, headers
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+    def _defer_if_throttled(self, host, response):
+        retry_after = parse_retry_after(response.getheader('Retry-After'))
+        if self.rate_limiter and response.status in THROTTLING_CODES and retry_after:
+            self.rate_limiter.defer(host, retry_after)
+
+    def _request(self, method, url, headers):
+        parsed = urlparse(url)
+        key = (parsed.scheme, parsed.hostname, parsed.port)
+        path = parsed.path or '/'
+        if parsed.query:
+            path += '?' + parsed.query
+        connection = self._acquire(key)
+        reused = connection is not None
+        if not reused:
+            connection = self._connect(key)
+        try:
+            connection.request(method, path, headers=headers)
+            return key, connection, connection.getresponse()
+        except (httplib.HTTPException, socket.error):
+            connection.close()
+            if not reused:
+                raise
+        # the server closed the idle connection meanwhile. try once more with a fresh one
+        self.log.debug('pooled connection to [%s] went stale, reconnecting' % parsed.hostname)
+        connection = self._connect(key)
+        connection.request(method, path, headers=headers)
+        return key, connection, connection.getresponse()
+
+    def _finish(self, key, connection, response):
+        if response.will_close:
+            connection.close()
+        else:
+            self._release(key, connection)
+
+    def _connect(self, key):
+        scheme, host, port = key
+        connection_class = httplib.HTTPSConnection if scheme == 'https' else httplib.HTTPConnection
+        self.log.debug('opening connection to [%s://%s:%s]' % (scheme, host, port))
+        with self._lock:
+            self.connections_opened += 1
+        return connection_class(host, port, timeout=self.timeout)
+
+    def _acquire(self, key):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop()
+        return None
+
+    def _release(self, key, connection):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append(connection)
+                return
+        connection.close()
@@ -0,0 +1,144 @@
+"""
+watch mode: a long running process polls its feeds from a priority queue ordered by the time of their next poll.
+the interval of every feed adapts to its publish history, so rarely updated feeds are fetched less often and daily
+shows are picked up soon after they appear.
+"""
+import heapq
+import itertools
+import logging
+import time
+
+MIN_INTERVAL = 15 * 60
+MAX_INTERVAL = 24 * 60 * 60
+# interval of feeds without publish history or update hints
+DEFAULT_INTERVAL = 60 * 60
+# once the next episode is due, poll this many times within the typical gap between two episodes
+POLLS_PER_GAP = 24
+# publish times remembered per feed
+HISTORY_SIZE = 20
+
+class PublishHistory:
+    """
+    the recent publish times (epoch seconds) of a feed and the update hints of the feed itself (ttl, update period
+    in seconds), from which the poll interval is derived
+    """
+    def __init__(self, size=HISTORY_SIZE):
+        self.size = size
+        self.updates = []
+        self.ttl = None
+        self.update_period = None
+
+    def observe(self, vodcasts, ttl=None, update_period=None):
+        updates = set(self.updates)
+        updates.update(vodcast.timestamp for vodcast in vodcasts)
+        self.updates = sorted(updates)[-self.size:]
+        if ttl is not None:
+            self.ttl = ttl
+        if update_period is not None:
+            self.update_period = update_period
+
+    @property
+    def typical_gap(self):
+        """
+        median of the gaps between the publish times, None without two distinct ones
+        """
+        gaps = sorted(later - earlier for earlier, later in zip(self.updates, self.updates[1:]))
+        return gaps[len(gaps) // 2] if gaps else None
+
+    def interval(self, now, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL):
+        """
+        seconds until the next poll. with a publish history, the feed is left alone until the next episode is due
+        (typical gap after the last one) and then polled POLLS_PER_GAP times per gap. without one, the announced
+        update period or DEFAULT_INTERVAL is used. the ttl of the feed is never undercut.
+        """
+        gap = self.typical_gap
+        if gap:
+            step = float(gap) / POLLS_PER_GAP
+            due = self.updates[-1] + gap - step
+            interval = due - now if due > now else step
+        else:
+            interval = self.update_period or DEFAULT_INTERVAL
+        return min(max_interval, max(min_interval, self.ttl or 0, interval))
+
+class PollScheduler:
+    """
+    priority queue of feeds ordered by the time of their next poll
+    """
+    def __init__(self, clock=time.time, sleep=time.sleep):
+        self.clock = clock
+        self.sleep = sleep
+        self.log = logging.getLogger('PollScheduler')
+        self._queue = []
+        self._sequence = itertools.count()
+
+    def __len__(self):
+        return len(self._queue)
+
+    def schedule(self, feed, delay=0):
+        heapq.heappush(self._queue, (self.clock() + delay, next(self._sequence), feed))
+
+    def run(self, poll, error_interval=MIN_INTERVAL, max_polls=None):
+        """
+        call poll(feed) whenever a feed is due and schedule it again after the seconds poll returns (None drops
+        the feed). a failing poll is retried after error_interval. runs until no feed is left or after max_polls
+        polls
+        """
+        polls = 0
+        while self._queue and (max_polls is None or polls < max_polls):
+            due, _, feed = self._queue[0]
+            wait = due - self.clock()
+            if wait > 0:
+                self.sleep(wait)
+                continue
+            heapq.heappop(self._queue)
+            polls += 1
+            try:
+                delay = poll(feed)
+            except Exception as e:
+                self.log.error('failed to poll [%s], retrying in %d seconds: %s' % (getattr(feed, 'url', feed), error_interval, e))
+                delay = error_interval
+            if delay is not None:
+                self.schedule(feed, delay)
+        return polls
+
+class FeedWatcher:
+    """
+    poll feeds forever, keeping one VodcastDownloadManager (with its transport and index) per feed alive between
+    polls. create_manager(feed) builds the manager on the first poll, later polls refresh it. download(feed,
+    manager) downloads what is new, unless the feed was not modified. the feeds are polled one after another.
+    """
+    def __init__(self, feeds, create_manager, download, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL,
+                 clock=time.time, sleep=time.sleep):
+        self.feeds = list(feeds)
+        self.create_manager = create_manager
+        self.download = download
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.clock = clock
+        self.log = logging.getLogger('FeedWatcher')
+        self.managers = {}
+        self.histories = {}
+        self.scheduler = PollScheduler(clock, sleep)
+
+    def poll(self, feed):
+        """
+        fetch feed, download its new vodcasts and the failed ones to retry, and return the seconds until its next poll
+        """
+        manager = self.managers.get(feed)
+        if manager is None:
+            manager = self.managers[feed] = self.create_manager(feed)
+        else:
+            manager.refresh()
+        if not manager.not_modified or manager.retries:
+            self.download(feed, manager)
+        history = self.histories.setdefault(feed, PublishHistory())
+        history.observe(manager.vodcasts, manager.ttl, manager.update_period)
+        interval = history.interval(self.clock(), self.min_interval, self.max_interval)
+        self.log.info('polling [%s] again in %d minutes' % (getattr(feed, 'url', feed), interval / 60))
+        return interval
+
+    def run(self, max_polls=None):
+        for feed in self.feeds:
+            self.scheduler.schedule(feed)
+        self.log.info('watching %d feeds' % len(self.feeds))
+        return self.scheduler.run(self.poll, self.min_interval, max_polls)
@@ -0,0 +1,179 @@
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+from calendar import timegm
+from datetime import datetime
+sys.path.insert(0,os.path.abspath(__file__+"/../.."))
+from rss import download_index
+from rss.download_index import DownloadIndex, COMPLETED, EVICTED, FAILED
+from rss.rss_feed_downloader import VodcastDownloader, VodcastDownloadManager, Vodcast
+from range_http_server import RangeHTTPServer, Resource
+
+class EntryMock:
+    class EnclosureMock:
+        type = 'video/mp4'
+    def __init__(self, guid, url):
+        self.id = guid
+        self.title = guid
+        self.updated_parsed = (2010, 10, 28, 9, 53, 49)
+        self.description = 'unused'
+        enclosure = EntryMock.EnclosureMock()
+        enclosure.href = url
+        self.enclosures = [enclosure]
+
+class DownloadIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.server = RangeHTTPServer().start()
+        self.server.resources['/episode.mp4'] = Resource('episode')
+        self.server.resources['/other/episode.mp4'] = Resource('other episode')
+        self.tempdir = tempfile.mkdtemp()
+        self.index = DownloadIndex(os.path.join(self.tempdir, 'index.sqlite'))
+        self.downloader = VodcastDownloader(self.tempdir, index=self.index)
+        self.target = os.path.join(self.tempdir, 'episode.mp4')
+
+    def tearDown(self):
+        self.index.close()
+        self.server.stop()
+        shutil.rmtree(self.tempdir)
+
+    def __vodcast(self, guid, path='/episode.mp4'):
+        return Vodcast(EntryMock(guid, self.server.url(path)))
+
+    def __read(self, filename):
+        with open(filename, 'rb') as f:
+            return f.read()
+
+    def __write(self, filename, content):
+        with open(filename, 'wb') as f:
+            f.write(content)
+
+    def test_givenDownloadWhenFinishedThenIndexHoldsCompletedRecord(self):
+        self.downloader.download(self.__vodcast('guid-1'))
+
+        record = self.index.get('guid-1')
+        self.assertTrue(record.completed)
+        self.assertEqual(self.target, record.target)
+        self.assertEqual(len('episode'), record.size)
+        self.assertEqual('"v1"', record.etag)
+
+    def test_givenCompletedRecordWhenDownloadingAgainThenNothingIsTransferred(self):
+        self.downloader.download(self.__vodcast('guid-1'))
+        requests = len(self.server.requests)
+
+        self.assertEqual(self.target, self.downloader.download(self.__vodcast('guid-1')))
+
+        self.assertEqual(requests, len(self.server.requests))
+
+    def test_givenTruncatedFileOfUnfinishedDownloadWhenDownloadingThenItIsDownloadedAgain(self):
+        self.index.mark_started('guid-1', None, self.server.url('/episode.mp4'), self.target)
+        self.__write(self.target, 'epi')
+
+        self.downloader.download(self.__vodcast('guid-1'))
+
+        self.assertEqual('episode', self.__read(self.target))
+        self.assertTrue(self.index.get('guid-1').completed)
+
+    def test_givenExistingFileUnknownToIndexWhenDownloadingThenItIsTakenOver(self):
+        self.__write(self.target, 'downloaded before the index existed')
+
+        self.downloader.download(self.__vodcast('guid-1'))
+
+        self.assertEqual([], self.server.requests)
+        self.assertEqual(len('downloaded before the index existed'), self.index.get('guid-1').size)
+
+    def test_givenSameBasenameOfDifferentItemsWhenDownloadingThenBothAreKept(self):
+        self.downloader.download(self.__vodcast('guid-1'))
+        other_target = self.downloader.download(self.__vodcast('guid-2', '/other/episode.mp4'))
+
+        self.assertNotEqual(self.target, other_target)
+        self.assertEqual('episode', self.__read(self.target))
+        self.assertEqual('other episode', self.__read(other_target))
+
+    def test_givenFailingDownloadWhenFinishedThenRecordIsMarkedFailed(self):
+        self.server.resources['/episode.mp4'].abort_after = 3
+        self.assertRaises(IOError, self.downloader.download, self.__vodcast('guid-1'))
+
+        self.assertEqual('failed', self.index.get('guid-1').state)
+
+    def test_givenFailedDownloadWhenRunningAgainThenTimestampAdvancedAndItIsRetriedThoughOlder(self):
+        import main
+        self.server.resources['/feed.xml'] = Resource(r'''<?xml version='1.0' encoding='UTF-8'?>
+<rss version='2.0'><channel><title>Extra3</title>
+<item><title>Extra 3 vom 28.10.</title><pubDate>Thu, 28 Oct 2010 11:53:49 +0200</pubDate><description>unused</description>
+<enclosure url='%s' type='video/mp4' /></item></channel></rss>''' % self.server.url('/missing.mp4'))
+        feed_url = self.server.url('/feed.xml')
+        main._saveLastFetchedTimestamp(self.index, feed_url, timegm(datetime(2010, 10, 1).timetuple()))
+        last_fetched = self.index.last_fetched(feed_url)
+        def run():
+            manager = VodcastDownloadManager(feed_url, self.tempdir, index=self.index)
+            downloaded = manager.download_all_newer(main._determineReferenceDate(self.index, self.tempdir, 0, feed_url))
+            main._update_last_fetched_timestamp(manager, self.index, feed_url, downloaded)
+            return downloaded
+
+        self.assertEqual(0, run())
+        self.assertNotEqual(last_fetched, self.index.last_fetched(feed_url))
+        self.server.resources['/missing.mp4'] = Resource('episode')
+
+        self.assertEqual(1, run())
+        self.assertTrue(self.index.get(self.server.url('/missing.mp4'), feed_url).completed)
+
+    def test_givenFeedsWithTheSameGuidsWhenDownloadingIntoOneDirectoryThenBothEpisodesAreDownloaded(self):
+        for name in ('a', 'b'):
+            self.server.resources['/%s/episode.mp4' % name] = Resource('episode of %s' % name)
+            self.server.resources['/%s.xml' % name] = Resource(r'''<?xml version='1.0' encoding='UTF-8'?>
+<rss version='2.0'><channel><title>%s</title>
+<item><title>%s one</title><guid isPermaLink='false'>1</guid><pubDate>Thu, 28 Oct 2010 11:53:49 +0200</pubDate>
+<description>unused</description><enclosure url='%s' type='video/mp4' /></item></channel></rss>''' % (name, name, self.server.url('/%s/episode.mp4' % name)))
+        reference_date = datetime(2010, 10, 1)
+
+        downloaded = [VodcastDownloadManager(self.server.url('/%s.xml' % name), self.tempdir, index=self.index).download_all_newer(reference_date)
+                      for name in ('a', 'b')]
+
+        self.assertEqual([1, 1], downloaded)
+        self.assertEqual(['/a/episode.mp4', '/b/episode.mp4'], [path for command, path, headers in self.server.requests if path.endswith('.mp4')])
+        targets = [self.index.get('1', self.server.url('/%s.xml' % name)).target for name in ('a', 'b')]
+        self.assertEqual(['episode of a', 'episode of b'], [self.__read(target) for target in targets])
+
+    def test_givenKeysWhenLookingUpThenOnlyThoseOfTheFeedInTheStatesAreFound(self):
+        for number in range(12):
+            self.index.mark_completed('guid-%d' % number, 1, feed='a', url='http://localhost/%d.mp4' % number)
+        self.index.mark_completed('guid-3', 1, feed='b')
+        self.index.mark_failed('guid-5', 'a')
+        self.index.mark_evicted('guid-7', 'a')
+        keys_per_query = download_index.KEYS_PER_QUERY
+        download_index.KEYS_PER_QUERY = 2
+        try:
+            found = self.index.keys('a', (COMPLETED, EVICTED), ['guid-%d' % number for number in range(3, 9)] + ['unknown'])
+        finally:
+            download_index.KEYS_PER_QUERY = keys_per_query
+
+        self.assertEqual(set(['guid-3', 'guid-4', 'guid-6', 'guid-7', 'guid-8']), found)
+        self.assertEqual(set(['guid-5']), self.index.keys('a', (FAILED,)))
+
+    def test_givenIndexKeyedByGuidAloneWhenOpeningThenItIsMigrated(self):
+        self.index.close()
+        path = os.path.join(self.tempdir, 'unversioned.sqlite')
+        connection = sqlite3.connect(path)
+        connection.executescript('''
+            CREATE TABLE items (key TEXT PRIMARY KEY, feed TEXT, url TEXT, target TEXT, size INTEGER, checksum TEXT, etag TEXT,
+                                state TEXT NOT NULL, updated REAL NOT NULL);
+            CREATE INDEX items_target ON items (target);
+            INSERT INTO items VALUES ('1', 'http://localhost/a.xml', 'http://localhost/a.mp4', '/tmp/a.mp4', 7, NULL, NULL, 'completed', 0);
+            INSERT INTO items VALUES ('2', NULL, 'http://localhost/b.mp4', '/tmp/b.mp4', 7, NULL, NULL, 'completed', 0);
+            ''')
+        connection.commit()
+        connection.close()
+
+        self.index = DownloadIndex(path)
+
+        self.assertEqual('/tmp/a.mp4', self.index.get('1', 'http://localhost/a.xml').target)
+        self.assertEqual(('http://localhost/a.xml', '1'), self.index.owner_of('/tmp/a.mp4'))
+        self.assertEqual(None, self.index.get('2').feed)
+        self.index.mark_completed('1', 8, feed='http://localhost/b.xml', url='http://localhost/b1.mp4', target='/tmp/b1.mp4')
+        self.assertEqual(3, len(self.index.records(COMPLETED)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,269 @@
+import base64
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+sys.path.insert(0,os.path.abspath(__file__+"/../.."))
+from rss import event_engine
+from rss.event_engine import EventLoopDownloadEngine
+from rss.download_index import DownloadIndex
+from rss.integrity import IntegrityError
+from rss.metrics import Metrics, CallbackSink
+from rss.rate_limit import RateLimiter
+from rss.retry import RetryPolicy
+from rss.rss_feed_downloader import VodcastDownloader, VodcastDownloadManager, Vodcast, UserInterrupted, DownloadProgressHook, LOCAL_TIMEZONE
+from datetime import datetime
+from range_http_server import RangeHTTPServer, Resource
+
+FEED = r'''<?xml version='1.0' encoding='UTF-8'?>
+<rss version='2.0'>
+<channel>
+<title>Extra3</title>
+<item>
+<title>Extra 3 one</title>
+<pubDate>Tue, 26 Oct 2010 11:53:49 +0200</pubDate>
+<description>unused</description>
+<enclosure url='%s' type='video/mp4' />
+</item></channel></rss>'''
+
+class ItemMock:
+    class EnclosureMock:
+        pass
+    def __init__(self, title, url):
+        self.title = title
+        self.updated_parsed = (2010, 10, 28, 9, 53, 49)
+        self.description = 'unused'
+        enclosure = ItemMock.EnclosureMock()
+        enclosure.type = 'video/mp4'
+        enclosure.href = url
+        self.enclosures = [enclosure]
+
+class InterruptingProgressHook(DownloadProgressHook):
+    blocks = 0
+    def report_hook(self, block_number, block_size, total_size):
+        if block_number:
+            InterruptingProgressHook.blocks += 1
+            if InterruptingProgressHook.blocks == 3:
+                raise KeyboardInterrupt()
+        DownloadProgressHook.report_hook(self, block_number, block_size, total_size)
+
+class HandOverDownloader(VodcastDownloader):
+    """
+    records the vodcasts downloaded on a helper thread instead of fetching them
+    """
+    def __init__(self, basedir):
+        VodcastDownloader.__init__(self, basedir)
+        self.handed_over = []
+
+    def download(self, vodcast):
+        self.handed_over.append(vodcast.url)
+        return os.path.join(self.basedir, vodcast.local_filename)
+
+class EventLoopDownloadEngineTest(unittest.TestCase):
+    def setUp(self):
+        self.server = RangeHTTPServer().start()
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        event_engine.DownloadProgressHook = DownloadProgressHook
+        self.server.stop()
+        shutil.rmtree(self.tempdir)
+
+    def __read(self, filename):
+        with open(filename, 'rb') as f:
+            return f.read()
+
+    def __vodcasts(self, count, size):
+        vodcasts = []
+        for number in range(count):
+            self.server.resources['/episode%d.mp4' % number] = Resource(chr(65 + number % 26) * size)
+            vodcasts.append(Vodcast(ItemMock('episode %d' % number, self.server.url('/episode%d.mp4' % number))))
+        return vodcasts
+
+    def test_givenManyVodcastsWhenRunningThenAllAreDownloadedOnTheCallingThread(self):
+        downloader = VodcastDownloader(self.tempdir)
+        vodcasts = self.__vodcasts(30, 20000)
+        engine = EventLoopDownloadEngine(max_transfers=10, buffer_size=4096)
+        threads = []
+        results = []
+        def done(result):
+            threads.append(threading.current_thread())
+            results.append(result)
+
+        for vodcast in vodcasts:
+            engine.download(downloader, vodcast, done)
+        engine.run_until_complete()
+
+        self.assertEqual([threading.current_thread()] * 30, threads)
+        self.assertTrue(all(result.succeeded for result in results), results)
+        for number in range(30):
+            self.assertEqual(chr(65 + number % 26) * 20000, self.__read(os.path.join(self.tempdir, 'episode%d.mp4' % number)))
+        self.assertEqual({}, engine.socket_map)
+
+    def test_givenJobsWhenRunningThenResultsAreInInputOrder(self):
+        downloader = VodcastDownloader(self.tempdir)
+        vodcasts = self.__vodcasts(3, 1000)
+        vodcasts[1].url = self.server.url('/missing.mp4')
+
+        results = EventLoopDownloadEngine(max_per_host=2).run([(downloader, vodcast) for vodcast in vodcasts])
+
+        self.assertEqual(vodcasts, [result.vodcast for result in results])
+        self.assertEqual([True, False, True], [result.succeeded for result in results])
+        self.assertEqual(404, results[1].error.code)
+        self.assertFalse(os.path.exists(os.path.join(self.tempdir, 'missing.mp4.part')))
+
+    def test_givenRateLimiterWhenRunningThenAllTransfersShareTheMaxRate(self):
+        downloader = VodcastDownloader(self.tempdir)
+        vodcasts = self.__vodcasts(3, 100 * 1024)
+        engine = EventLoopDownloadEngine(buffer_size=16 * 1024, rate_limiter=RateLimiter(max_rate=200 * 1024))
+
+        start = time.time()
+        results = engine.run([(downloader, vodcast) for vodcast in vodcasts])
+        elapsed = time.time() - start
+
+        self.assertTrue(all(result.succeeded for result in results))
+        # a quarter second burst, the remaining 250k at 200k/s
+        self.assertTrue(1.1 <= elapsed < 2, elapsed)
+
+    def test_givenRetryAfterWhenRunningThenHostIsHeldBack(self):
+        self.server.resources['/busy.mp4'] = Resource(retry_after=60)
+        vodcast = Vodcast(ItemMock('busy', self.server.url('/busy.mp4')))
+        rate_limiter = RateLimiter()
+
+        results = EventLoopDownloadEngine(rate_limiter=rate_limiter).run([(VodcastDownloader(self.tempdir), vodcast)])
+
+        self.assertEqual(429, results[0].error.code)
+        self.assertTrue(rate_limiter.wait_time('127.0.0.1') > 55)
+
+    def test_givenBrokenTransferWhenRetryingThenDownloadContinuesWithRange(self):
+        content = 'x' * 200 * 1024
+        self.server.resources['/episode.mp4'] = Resource(content, abort_after=50 * 1024, abort_times=1)
+        vodcast = Vodcast(ItemMock('episode', self.server.url('/episode.mp4')))
+        downloader = VodcastDownloader(self.tempdir, retry_policy=RetryPolicy(3, base_delay=0.1))
+
+        results = EventLoopDownloadEngine().run([(downloader, vodcast)])
+
+        self.assertTrue(results[0].succeeded, results[0])
+        self.assertEqual(content, self.__read(os.path.join(self.tempdir, 'episode.mp4')))
+        self.assertEqual('bytes=%d-' % (50 * 1024), self.server.requests[-1][2]['range'])
+        self.assertEqual(['episode.mp4'], os.listdir(self.tempdir))
+
+    def test_givenChecksumAlgorithmWhenRunningThenBlocksAreHashedAndVerified(self):
+        content = 'x' * 200 * 1024
+        self.server.resources['/episode.mp4'] = Resource(content, headers={'Content-MD5' : base64.b64encode(hashlib.md5(content).digest())})
+        self.server.resources['/corrupt.mp4'] = Resource(content, headers={'Content-MD5' : base64.b64encode(hashlib.md5('y').digest())})
+        index = DownloadIndex(os.path.join(self.tempdir, 'index.sqlite'))
+        downloader = VodcastDownloader(self.tempdir, index=index, checksum_algorithm='sha256')
+        vodcasts = [Vodcast(ItemMock(name, self.server.url('/%s.mp4' % name))) for name in ('episode', 'corrupt')]
+
+        results = EventLoopDownloadEngine(buffer_size=16 * 1024).run([(downloader, vodcast) for vodcast in vodcasts])
+
+        self.assertTrue(results[0].succeeded, results[0])
+        self.assertEqual('sha256:' + hashlib.sha256(content).hexdigest(), index.get(vodcasts[0].guid).checksum)
+        self.assertTrue(isinstance(results[1].error, IntegrityError), results[1])
+        self.assertEqual('failed', index.get(vodcasts[1].guid).state)
+        self.assertEqual(['episode.mp4', 'index.sqlite'], sorted(os.listdir(self.tempdir)))
+        index.close()
+
+    def test_givenMetricsWhenRunningThenEveryDownloadIsTraced(self):
+        events = []
+        downloader = VodcastDownloader(self.tempdir, metrics=Metrics([CallbackSink(events.append)]))
+        vodcasts = self.__vodcasts(3, 50000)
+
+        EventLoopDownloadEngine(max_per_host=1).run([(downloader, vodcast) for vodcast in vodcasts])
+
+        self.assertEqual([50000] * 3, [event['bytes'] for event in events])
+        self.assertTrue(all(event['queue_seconds'] >= 0 and event['ttfb_seconds'] >= 0 for event in events), events)
+
+    def test_givenRedirectWhenFetchingThenBodyOfTheTargetIsReturned(self):
+        self.server.resources['/latest.xml'] = Resource(redirect=self.server.url('/feed.xml'))
+        self.server.resources['/feed.xml'] = Resource('<rss/>')
+        responses = []
+
+        engine = EventLoopDownloadEngine()
+        engine.fetch(self.server.url('/latest.xml'), lambda response, error: responses.append((response, error)))
+        engine.run_until_complete()
+
+        response, error = responses[0]
+        self.assertEqual(None, error)
+        self.assertEqual(200, response.getcode())
+        self.assertEqual('<rss/>', response.read())
+        self.assertEqual('"v1"', response.info().getheader('ETag'))
+        self.assertEqual(self.server.url('/feed.xml'), response.geturl())
+
+    def test_givenRedirectToOtherHostWhenDownloadingThenTheSlotMovesToThatHost(self):
+        self.server.resources['/episode.mp4'] = Resource(redirect=self.server.url('/moved.mp4').replace('127.0.0.1', 'localhost'))
+        self.server.resources['/moved.mp4'] = Resource('x' * 1000)
+        vodcast = Vodcast(ItemMock('episode', self.server.url('/episode.mp4')))
+        engine = EventLoopDownloadEngine(max_per_host=1)
+
+        results = engine.run([(VodcastDownloader(self.tempdir), vodcast)])
+
+        self.assertTrue(results[0].succeeded, results)
+        self.assertEqual({'127.0.0.1' : 0, 'localhost' : 0}, engine._active_per_host)
+
+    def test_givenRedirectToHttpsWhenDownloadingThenVodcastIsHandedToAHelperThread(self):
+        self.server.resources['/episode.mp4'] = Resource(redirect=self.server.url('/episode.mp4').replace('http:', 'https:'))
+        vodcast = Vodcast(ItemMock('episode', self.server.url('/episode.mp4')))
+        downloader = HandOverDownloader(self.tempdir)
+
+        results = EventLoopDownloadEngine().run([(downloader, vodcast)])
+
+        self.assertTrue(results[0].succeeded, results)
+        self.assertEqual([self.server.url('/episode.mp4')], downloader.handed_over)
+        self.assertEqual(['/episode.mp4'], [path for command, path, headers in self.server.requests])
+
+    def test_givenRedirectToHttpsWhenFetchingThenItFailsClearly(self):
+        self.server.resources['/feed.xml'] = Resource(redirect=self.server.url('/feed.xml').replace('http:', 'https:'))
+        responses = []
+
+        engine = EventLoopDownloadEngine()
+        engine.fetch(self.server.url('/feed.xml'), lambda response, error: responses.append((response, error)))
+        engine.run_until_complete()
+
+        response, error = responses[0]
+        self.assertEqual(None, response)
+        self.assertTrue('cannot fetch' in str(error), error)
+        self.assertEqual(1, len(self.server.requests))
+
+    def test_givenCtrlCWhenDownloadingThenTransfersAreCancelledAndResumedOnNextRun(self):
+        downloader = VodcastDownloader(self.tempdir, resume=True)
+        vodcasts = self.__vodcasts(4, 512 * 1024)
+        event_engine.DownloadProgressHook = InterruptingProgressHook
+        engine = EventLoopDownloadEngine(buffer_size=4096)
+
+        self.assertRaises(UserInterrupted, engine.run, [(downloader, vodcast) for vodcast in vodcasts])
+
+        self.assertEqual({}, engine.socket_map)
+        self.assertEqual([], engine.running)
+        parts = [name for name in os.listdir(self.tempdir) if name.endswith('.part')]
+        self.assertTrue(parts)
+        self.assertFalse([name for name in os.listdir(self.tempdir) if name.endswith('.mp4')])
+
+        event_engine.DownloadProgressHook = DownloadProgressHook
+        results = EventLoopDownloadEngine().run([(downloader, vodcast) for vodcast in vodcasts])
+
+        self.assertTrue(all(result.succeeded for result in results))
+        for number in range(4):
+            self.assertEqual(chr(65 + number) * 512 * 1024, self.__read(os.path.join(self.tempdir, 'episode%d.mp4' % number)))
+        self.assertTrue([request for request in self.server.requests if 'range' in request[2]])
+
+    def test_givenEventsEngineWhenManagerDownloadsThenVodcastIsSaved(self):
+        self.server.resources['/episode.mp4'] = Resource('episode')
+        self.server.resources['/feed.xml'] = Resource(FEED % self.server.url('/episode.mp4'))
+
+        vdm = VodcastDownloadManager(self.server.url('/feed.xml'), self.tempdir, engine='events')
+        self.addCleanup(vdm.transport.close)
+
+        self.assertEqual(1, vdm.download_all_newer(LOCAL_TIMEZONE.localize(datetime(2010, 10, 1))))
+        self.assertEqual('episode', self.__read(os.path.join(self.tempdir, 'episode.mp4')))
+
+if __name__ == '__main__':
+    import logging
+    logging.basicConfig(filename = 'test_debug.log', level=logging.DEBUG)
+
+    unittest.main()
@@ -0,0 +1,98 @@
+from datetime import datetime
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+sys.path.insert(0,os.path.abspath(__file__+"/../.."))
+from rss.feed_cache import FeedCache, IndexFeedCache
+from rss.download_index import DownloadIndex
+from rss.rss_feed_downloader import VodcastDownloadManager, LOCAL_TIMEZONE
+from rss.transport import HttpTransport
+from range_http_server import RangeHTTPServer, Resource
+
+FEED = r'''<?xml version='1.0' encoding='UTF-8'?>
+<rss version='2.0'>
+<channel>
+<title>Extra3</title>
+<item>
+<title>Extra 3 one</title>
+<pubDate>Tue, 26 Oct 2010 11:53:49 +0200</pubDate>
+<description>Tatort Taliban</description>
+<enclosure url='%s' type='video/mp4' />
+</item></channel></rss>'''
+
+class FeedCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.server = RangeHTTPServer().start()
+        self.tempdir = tempfile.mkdtemp()
+        self.transport = HttpTransport()
+        self.feed_cache = FeedCache(os.path.join(self.tempdir, 'feed.cache'))
+        self.reference_date = LOCAL_TIMEZONE.localize(datetime(2010, 10, 1))
+        self.server.resources['/feed.xml'] = Resource(FEED % self.server.url('/episode.mp4'), etag='"feed-v1"')
+        self.server.resources['/episode.mp4'] = Resource('episode')
+
+    def tearDown(self):
+        self.transport.close()
+        self.server.stop()
+        shutil.rmtree(self.tempdir)
+
+    def __create_manager(self):
+        return VodcastDownloadManager(self.server.url('/feed.xml'), self.tempdir, transport=self.transport, feed_cache=FeedCache(self.feed_cache.path))
+
+    def test_givenUnchangedFeedWhenFetchingAgainThenNotModifiedShortCircuitsDownload(self):
+        first = self.__create_manager()
+        self.assertEqual(1, first.download_all_newer(self.reference_date))
+
+        second = self.__create_manager()
+
+        self.assertEqual('"feed-v1"', self.server.requests[-1][2]['if-none-match'])
+        self.assertTrue(second.not_modified)
+        self.assertEqual(first.vodcasts, second.vodcasts)
+        self.assertEqual('Tatort Taliban', second.vodcasts[0].description)
+        self.assertEqual(0, second.download_all_newer(self.reference_date))
+
+    def test_givenChangedFeedWhenFetchingAgainThenFeedIsParsed(self):
+        self.__create_manager().download_all_newer(self.reference_date)
+        self.server.resources['/feed.xml'].etag = '"feed-v2"'
+
+        manager = self.__create_manager()
+
+        self.assertFalse(manager.not_modified)
+        self.assertEqual(1, len(manager.vodcasts))
+
+    def test_givenFailedDownloadWhenFetchingAgainThenFeedIsNotConsideredUnchanged(self):
+        del self.server.resources['/episode.mp4']
+        self.assertEqual(0, self.__create_manager().download_all_newer(self.reference_date))
+
+        self.assertFalse(os.path.exists(self.feed_cache.path))
+        self.assertFalse(self.__create_manager().not_modified)
+
+    def test_givenFailedDownloadAndIndexWhenFetchingAgainThenFeedIsNotModifiedAndTheDownloadIsRetried(self):
+        index = DownloadIndex(os.path.join(self.tempdir, 'index.sqlite'))
+        feed_url = self.server.url('/feed.xml')
+        create_manager = lambda: VodcastDownloadManager(feed_url, self.tempdir, transport=self.transport, index=index,
+                                                        feed_cache=IndexFeedCache(index, feed_url))
+        del self.server.resources['/episode.mp4']
+        self.assertEqual(0, create_manager().download_all_newer(self.reference_date))
+        self.server.resources['/episode.mp4'] = Resource('episode')
+
+        manager = create_manager()
+
+        self.assertTrue(manager.not_modified)
+        self.assertEqual(1, manager.download_all_newer(self.reference_date))
+        self.assertTrue(index.get(self.server.url('/episode.mp4'), feed_url).completed)
+        index.close()
+
+    def test_givenIndexFeedCacheWhenSavedThenItIsLoadedFromTheIndex(self):
+        index = DownloadIndex(os.path.join(self.tempdir, 'index.sqlite'))
+        self.assertFalse(IndexFeedCache(index, 'http://some.domain/rss.xml').load())
+        IndexFeedCache(index, 'http://some.domain/rss.xml').save('"feed-v1"', None, [{'title' : 'Extra 3 one'}])
+
+        feed_cache = IndexFeedCache(index, 'http://some.domain/rss.xml')
+        self.assertTrue(feed_cache.load())
+        self.assertEqual('"feed-v1"', feed_cache.etag)
+        self.assertEqual([{'title' : 'Extra 3 one'}], feed_cache.entries)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+from datetime import datetime
+from StringIO import StringIO
+import os
+import sys
+import unittest
+sys.path.insert(0,os.path.abspath(__file__+"/../.."))
+from rss.feed_stream import iter_feed_items, iter_vodcasts
+from rss.rss_feed_downloader import VodcastDownloadManager, parse_video_item, LOCAL_TIMEZONE
+from rss.transport import HttpTransport
+from range_http_server import RangeHTTPServer, Resource
+
+ITEM = '''<item>
+<title>Extra 3 %(day)d</title>
+<description>Tatort Taliban</description>
+<pubDate>%(day)02d Oct 2010 11:53:49 +0200</pubDate>
+<enclosure url='http://media.ndr.de/download/podcasts/extradrei196/TV-201010%(day)02d.h264.mp4' type='video/mp4' length='1024' />
+<guid isPermaLink='false'>TV-201010%(day)02d-V</guid>
+</item>'''
+
+def create_feed(days, tail='</channel></rss>'):
+    return "<?xml version='1.0' encoding='UTF-8'?><rss version='2.0'><channel><title>Extra3</title>%s%s" % (
+        ''.join(ITEM % {'day' : day} for day in days), tail)
+
+class FeedStreamTest(unittest.TestCase):
+    def setUp(self):
+        self.reference_date = LOCAL_TIMEZONE.localize(datetime(2010, 10, 27, 0, 0, 0))
+
+    def __titles(self, vodcasts):
+        return [vodcast.title for vodcast in vodcasts]
+
+    def test_givenFeedWhenStreamingItemsThenAllFieldsAreParsed(self):
+        items = list(iter_feed_items(StringIO(create_feed([26]))))
+
+        self.assertEqual(1, len(items))
+        vodcast = parse_video_item(items[0])
+        self.assertEqual('Extra 3 26', vodcast.title)
+        self.assertEqual('TV-20101026-V', vodcast.guid)
+        self.assertEqual('TV-20101026.h264.mp4', vodcast.local_filename)
+        self.assertEqual(datetime(2010, 10, 26, 9, 53, 49), vodcast.updated)
+        self.assertEqual('1024', items[0].enclosures[0].length)
+
+    def test_givenAtomFeedWhenStreamingItemsThenEnclosureLinksAreParsed(self):
+        feed = '''<feed xmlns="http://www.w3.org/2005/Atom"><entry>
+        <title>Extra 3 one</title><id>urn:extra3:1</id><updated>2010-10-26T09:53:49Z</updated>
+        <link rel="alternate" href="http://www.ndr.de/extra3"/>
+        <link rel="enclosure" type="video/mp4" href="http://media.ndr.de/one.mp4"/>
+        </entry></feed>'''
+
+        vodcast = parse_video_item(list(iter_feed_items(StringIO(feed)))[0])
+
+        self.assertEqual('http://media.ndr.de/one.mp4', vodcast.url)
+        self.assertEqual(datetime(2010, 10, 26, 9, 53, 49), vodcast.updated)
+
+    def test_givenUnsortedFeedWhenStreamingThenOnlyNewerVodcastsAreYielded(self):
+        vodcasts = iter_vodcasts(StringIO(create_feed([26, 28, 20, 27])), self.reference_date, parse_video_item)
+
+        self.assertEqual(['Extra 3 28', 'Extra 3 27'], self.__titles(vodcasts))
+
+    def test_givenNewestFirstFeedWhenStreamingThenParsingStopsAtFirstOlderVodcast(self):
+        # everything after the cutoff is broken, it must never be parsed
+        feed = create_feed([29, 28, 26], tail='<item><title>broken</broken>')
+
+        vodcasts = iter_vodcasts(StringIO(feed), self.reference_date, parse_video_item, newest_first=True)
+
+        self.assertEqual(['Extra 3 29', 'Extra 3 28'], self.__titles(vodcasts))
+
+    def test_givenVodcastToRetryWhenStreamingThenItIsYieldedThoughOlder(self):
+        vodcasts = iter_vodcasts(StringIO(create_feed([29, 28, 26, 20])), self.reference_date, parse_video_item, newest_first=True,
+                                 retry=set(['TV-20101020-V']))
+
+        self.assertEqual(['Extra 3 29', 'Extra 3 28', 'Extra 3 20'], self.__titles(vodcasts))
+
+class StreamingDownloadManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.server = RangeHTTPServer().start()
+        self.transport = HttpTransport()
+        self.reference_date = LOCAL_TIMEZONE.localize(datetime(2010, 10, 27, 0, 0, 0))
+
+    def tearDown(self):
+        self.transport.close()
+        self.server.stop()
+
+    def test_givenStreamingManagerWhenSelectingThenOnlyNewerVodcastsAreKept(self):
+        self.server.resources['/feed.xml'] = Resource(create_feed([29, 28] + range(26, 1, -1)))
+        manager = VodcastDownloadManager(self.server.url('/feed.xml'), None, transport=self.transport, streaming=True, newest_first=True)
+        self.assertEqual([], manager.vodcasts)
+
+        selected = manager.select_newer(self.reference_date)
+
+        self.assertEqual(['Extra 3 29', 'Extra 3 28'], [vodcast.title for vodcast in selected])
+        self.assertEqual(selected, manager.vodcasts)
+
+    def test_givenRawFeedWhenStreamingThenItIsParsedToo(self):
+        manager = VodcastDownloadManager(create_feed([26, 28]), None, streaming=True)
+
+        self.assertEqual(['Extra 3 28'], [vodcast.title for vodcast in manager.select_newer(self.reference_date)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+import base64
+import hashlib
+import mimetools
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from datetime import datetime
+from StringIO import StringIO
+sys.path.insert(0,os.path.abspath(__file__+"/../.."))
+from rss import integrity
+from rss.download_index import DownloadIndex
+from rss.feed_cache import IndexFeedCache
+from rss.integrity import StreamingChecksum, IntegrityError, expected_digests, file_checksum, verify_archive
+from rss.rss_feed_downloader import VodcastDownloadManager, LOCAL_TIMEZONE
+from rss.transport import HttpTransport
+from range_http_server import RangeHTTPServer, Resource
+
+FEED = r'''<?xml version='1.0' encoding='UTF-8'?>
+<rss version='2.0'><channel><title>Extra3</title>
+<item><title>Extra 3 vom 28.10.</title><pubDate>Thu, 28 Oct 2010 11:53:49 +0200</pubDate><description>unused</description>
+<enclosure url='%s' type='video/mp4' /></item>
+</channel></rss>'''
+
+def headers(text):
+    return mimetools.Message(StringIO(text))
+
+class IntegrityTest(unittest.TestCase):
+    CONTENT = ''.join(chr(byte % 241) for byte in range(100 * 1024))
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.index = DownloadIndex(os.path.join(self.tempdir, 'index.sqlite'))
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.tempdir)
+
+    def __write(self, name, content):
+        filename = os.path.join(self.tempdir, name)
+        with open(filename, 'wb') as f:
+            f.write(content)
+        return filename
+
+    def __completed(self, key, filename, content):
+        self.index.mark_started(key, 'feed', 'http://localhost/%s' % key, filename)
+        self.index.mark_completed(key, len(content), checksum='sha256:' + hashlib.sha256(content).hexdigest(), feed='feed')
+
+    def test_givenBlocksWhenHashingThenChecksumEqualsHashOfWhole(self):
+        checksum = StreamingChecksum('sha256')
+        for offset in range(0, len(self.CONTENT), 1000):
+            checksum.update(self.CONTENT[offset:offset + 1000])
+
+        self.assertEqual('sha256:' + hashlib.sha256(self.CONTENT).hexdigest(), checksum.checksum)
+        self.assertEqual(len(self.CONTENT), checksum.length)
+
+    def test_givenPrefixInFileWhenContinuingThenChecksumCoversFileAndBlocks(self):
+        filename = self.__write('episode.mp4.part', self.CONTENT[:30000] + 'garbage after the offset')
+        checksum = StreamingChecksum('sha256')
+
+        checksum.update_from_file(filename, 30000)
+        checksum.update(self.CONTENT[30000:])
+
+        self.assertEqual('sha256:' + hashlib.sha256(self.CONTENT).hexdigest(), checksum.checksum)
+
+    def test_givenSmallSlicesWhenHashingFileThenWholeFileIsHashed(self):
+        filename = self.__write('episode.mp4', self.CONTENT)
+        slice_size = integrity.HASH_SLICE_SIZE
+        integrity.HASH_SLICE_SIZE = 4096
+        try:
+            self.assertEqual('md5:' + hashlib.md5(self.CONTENT).hexdigest(), file_checksum(filename, 'md5'))
+        finally:
+            integrity.HASH_SLICE_SIZE = slice_size
+
+    def test_givenContentMD5AndDigestWhenParsingThenAllDigestsAreExpected(self):
+        md5 = base64.b64encode(hashlib.md5(self.CONTENT).digest())
+        sha = base64.b64encode(hashlib.sha1(self.CONTENT).digest())
+
+        digests = expected_digests(headers('Content-MD5: %s\r\nDigest: SHA=%s, unknown=abc\r\n\r\n' % (md5, sha)))
+
+        self.assertEqual({'md5' : hashlib.md5(self.CONTENT).digest(), 'sha1' : hashlib.sha1(self.CONTENT).digest()}, digests)
+
+    def test_givenPartialResponseWhenParsingThenContentMD5OfRangeIsIgnored(self):
+        md5 = base64.b64encode(hashlib.md5(self.CONTENT).digest())
+
+        self.assertEqual({}, expected_digests(headers('Content-MD5: %s\r\n\r\n' % md5), partial=True))
+
+    def test_givenWrongDigestWhenVerifyingThenIntegrityErrorIsRaised(self):
+        checksum = StreamingChecksum('sha256', {'md5' : hashlib.md5('other').digest()})
+        checksum.update(self.CONTENT)
+
+        self.assertRaisesRegexp(IntegrityError, 'md5 digest mismatch', checksum.verify, 'http://localhost/episode.mp4')
+
+    def test_givenShortTransferWhenVerifyingThenLengthMismatchIsReported(self):
+        checksum = StreamingChecksum('sha256')
+        checksum.update(self.CONTENT)
+
+        self.assertRaisesRegexp(IntegrityError, 'length mismatch', checksum.verify, 'http://localhost/episode.mp4', len(self.CONTENT) + 1)
+
+    def test_givenCorruptedFileWhenVerifyingArchiveThenItIsMarkedFailed(self):
+        intact = self.__write('intact.mp4', self.CONTENT)
+        corrupted = self.__write('corrupted.mp4', self.CONTENT)
+        self.__completed('intact', intact, self.CONTENT)
+        self.__completed('corrupted', corrupted, self.CONTENT)
+        self.__write('corrupted.mp4', self.CONTENT[:-1] + 'x')
+
+        results = verify_archive(self.index, threads=2)
+
+        self.assertEqual([('corrupted', False), ('intact', True)], sorted((result.record.key, result.ok) for result in results))
+        self.assertEqual('failed', self.index.get('corrupted', 'feed').state)
+        self.assertTrue(self.index.get('intact', 'feed').completed)
+
+    def test_givenMissingOrTruncatedFileWhenVerifyingArchiveThenProblemIsReported(self):
+        truncated = self.__write('truncated.mp4', self.CONTENT[:100])
+        self.__completed('truncated', truncated, self.CONTENT)
+        self.__completed('missing', os.path.join(self.tempdir, 'missing.mp4'), self.CONTENT)
+
+        problems = dict((result.record.key, result.problem) for result in verify_archive(self.index))
+
+        self.assertEqual('missing', problems['missing'])
+        self.assertTrue(problems['truncated'].startswith('size 100 differs'))
+
+class RedownloadTest(unittest.TestCase):
+    def setUp(self):
+        self.server = RangeHTTPServer().start()
+        self.transport = HttpTransport()
+        self.tempdir = tempfile.mkdtemp()
+        self.index = DownloadIndex(os.path.join(self.tempdir, 'index.sqlite'))
+        self.server.resources['/28.mp4'] = Resource('x' * 1000)
+        self.server.resources['/feed.xml'] = Resource(FEED % self.server.url('/28.mp4'), etag='"feed-v1"')
+
+    def tearDown(self):
+        self.transport.close()
+        self.server.stop()
+        self.index.close()
+        shutil.rmtree(self.tempdir)
+
+    def __download(self, reference_date):
+        feed_url = self.server.url('/feed.xml')
+        manager = VodcastDownloadManager(feed_url, self.tempdir, transport=self.transport, index=self.index,
+                                         feed_cache=IndexFeedCache(self.index, feed_url))
+        return manager, manager.download_all_newer(LOCAL_TIMEZONE.localize(reference_date))
+
+    def __corrupt_and_verify(self):
+        target = self.index.get(self.server.url('/28.mp4'), self.server.url('/feed.xml')).target
+        with open(target, 'r+b') as corrupted:
+            corrupted.write('y')
+        verify_archive(self.index)
+        return target
+
+    def test_givenCorruptDownloadWhenRunningAgainThenItIsDownloadedAgainThoughOlderThanTheReferenceDate(self):
+        self.__download(datetime(2010, 10, 1))
+        target = self.__corrupt_and_verify()
+        self.server.resources['/feed.xml'].etag = '"feed-v2"'
+
+        manager, downloaded = self.__download(datetime(2010, 11, 1))
+
+        self.assertFalse(manager.not_modified)
+        self.assertEqual(1, downloaded)
+        self.assertEqual('x' * 1000, open(target, 'rb').read())
+        self.assertTrue(self.index.get(self.server.url('/28.mp4'), self.server.url('/feed.xml')).completed)
+
+    def test_givenCorruptDownloadAndUnchangedFeedWhenRunningAgainThenItIsDownloadedAgain(self):
+        self.__download(datetime(2010, 10, 1))
+        target = self.__corrupt_and_verify()
+
+        manager, downloaded = self.__download(datetime(2010, 11, 1))
+
+        self.assertTrue(manager.not_modified)
+        self.assertEqual(1, downloaded)
+        self.assertEqual('x' * 1000, open(target, 'rb').read())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from datetime import datetime
+sys.path.insert(0,os.path.abspath(__file__+"/../.."))
+from rss.journal import DownloadJournal, JOURNAL_FILENAME
+from rss.download_index import DownloadIndex, INDEX_FILENAME
+from rss.rss_feed_downloader import Vodcast, VodcastDownloadManager
+from rss.transport import HttpTransport
+from range_http_server import RangeHTTPServer, Resource
+
+FEED_URL = 'http://localhost/feed.xml'
+
+def vodcast(name, updated=1288259629):
+    return Vodcast.from_record({'title' : name, 'url' : 'http://localhost/%s.mp4' % name, 'guid' : name, 'updated' : updated, 'description' : 'unused'})
+
+class CountingJournal(DownloadJournal):
+    syncs = 0
+
+    def _sync(self):
+        self.syncs += 1
+        DownloadJournal._sync(self)
+
+class DownloadJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, JOURNAL_FILENAME)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_givenInterruptedBatchWhenReopeningThenRemainingVodcastsArePending(self):
+        journal = DownloadJournal(self.path)
+        journal.planned(FEED_URL, [vodcast('one'), vodcast('two'), vodcast('three')])
+        journal.started(FEED_URL, 'one')
+        journal.completed(FEED_URL, 'one')
+        journal.started(FEED_URL, 'two')
+        planned = journal.pending(FEED_URL).planned
+        journal.close()
+
+        batch = DownloadJournal(self.path).pending(FEED_URL)
+
+        self.assertEqual(['two', 'three'], [record['guid'] for record in batch.remaining])
+        self.assertEqual(planned, batch.planned)
+
+    def test_givenFinishedBatchWhenReopeningThenNothingIsPendingAndTheJournalIsEmpty(self):
+        journal = DownloadJournal(self.path)
+        journal.planned(FEED_URL, [vodcast('one')])
+        journal.finished(FEED_URL)
+        journal.close()
+
+        journal = DownloadJournal(self.path)
+
+        self.assertEqual(None, journal.pending(FEED_URL))
+        self.assertEqual(0, os.path.getsize(self.path))
+
+    def test_givenTornLastLineWhenReopeningThenItIsIgnored(self):
+        journal = DownloadJournal(self.path)
+        journal.planned(FEED_URL, [vodcast('one'), vodcast('two')])
+        journal.close()
+        with open(self.path, 'a') as journal_file:
+            journal_file.write('{"event": "completed", "feed": "http://loc')
+
+        batch = DownloadJournal(self.path).pending(FEED_URL)
+
+        self.assertEqual(['one', 'two'], [record['guid'] for record in batch.remaining])
+
+    def test_givenDownloadEventsWhenJournalingThenTheyAreSyncedInBatches(self):
+        journal = CountingJournal(self.path, sync_every=4, sync_interval=60)
+        journal.planned(FEED_URL, [vodcast('one'), vodcast('two')])
+        for name in ('one', 'two'):
+            journal.started(FEED_URL, name)
+            journal.completed(FEED_URL, name)
+
+        # the plan right away, the four download events at once
+        self.assertEqual(2, journal.syncs)
+        journal.close()
+
+class ResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.server = RangeHTTPServer().start()
+        self.transport = HttpTransport()
+        self.index = DownloadIndex(os.path.join(self.tempdir, INDEX_FILENAME))
+        self.journal_path = os.path.join(self.tempdir, JOURNAL_FILENAME)
+
+    def tearDown(self):
+        self.transport.close()
+        self.server.stop()
+        self.index.close()
+        shutil.rmtree(self.tempdir)
+
+    def test_givenInterruptedRunWhenCreatingManagerThenRemainingDownloadsResumeWithoutFetchingTheFeed(self):
+        self.server.resources['/feed.xml'] = Resource('not fetched')
+        self.server.resources['/two.mp4'] = Resource('x' * 1000)
+        feed_url = self.server.url('/feed.xml')
+        first, second = vodcast('one'), vodcast('two')
+        second.url = self.server.url('/two.mp4')
+        interrupted = DownloadJournal(self.journal_path)
+        interrupted.planned(feed_url, [first, second])
+        interrupted.completed(feed_url, 'one')
+        planned = interrupted.pending(feed_url).planned
+        interrupted.close()
+        journal = DownloadJournal(self.journal_path)
+
+        manager = VodcastDownloadManager(feed_url, self.tempdir, transport=self.transport, index=self.index, journal=journal)
+        downloaded = manager.download_all_newer(None)
+
+        self.assertEqual(1, downloaded)
+        self.assertEqual([('GET', '/two.mp4')], [(command, path) for command, path, headers in self.server.requests])
+        self.assertTrue(self.index.get('two', feed_url).completed)
+        self.assertEqual(None, journal.pending(feed_url))
+        journal.close()
+
+        # episodes published after the interrupted run planned its batch are downloaded by the next run
+        import main
+        main._update_last_fetched_timestamp(manager, self.index, feed_url, downloaded)
+        self.assertEqual(datetime.fromtimestamp(planned).strftime('%c'), self.index.last_fetched(feed_url))
+
+    def test_givenNoInterruptedRunWhenDownloadingThenThePlanIsJournaledAndFinished(self):
+        self.server.resources['/feed.xml'] = Resource(r'''<?xml version='1.0' encoding='UTF-8'?>
+<rss version='2.0'><channel><title>Extra3</title>
+<item><title>Extra 3 vom 28.10.</title><pubDate>Thu, 28 Oct 2010 11:53:49 +0200</pubDate><description>unused</description>
+<enclosure url='%s' type='video/mp4' /></item></channel></rss>''' % self.server.url('/28.mp4'))
+        self.server.resources['/28.mp4'] = Resource('x' * 1000)
+        journal = DownloadJournal(self.journal_path)
+        manager = VodcastDownloadManager(self.server.url('/feed.xml'), self.tempdir, transport=self.transport, index=self.index, journal=journal)
+
+        manager.download_all_newer(datetime(2010, 10, 1))
+        journal.close()
+
+        with open(self.journal_path) as journal_file:
+            self.assertEqual(['planned', 'started', 'completed', 'finished'], [json.loads(line)['event'] for line in journal_file])
+
+if __name__ == '__main__':
+    unittest.main()
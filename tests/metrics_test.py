@@ -0,0 +1,124 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from datetime import datetime
+from urllib2 import urlopen
+sys.path.insert(0,os.path.abspath(__file__+"/../.."))
+from rss.metrics import Metrics, CallbackSink, JsonLinesSink, PrometheusSink, DOWNLOAD, FEED_FETCH, FEED_PARSE
+from rss.retry import RetryPolicy
+from rss.rss_feed_downloader import VodcastDownloader, VodcastDownloadManager, Vodcast, LOCAL_TIMEZONE
+from range_http_server import RangeHTTPServer, Resource
+
+FEED = r'''<?xml version='1.0' encoding='UTF-8'?>
+<rss version='2.0'><channel><title>Extra3</title>
+<item><title>Extra 3 one</title><pubDate>Tue, 26 Oct 2010 11:53:49 +0200</pubDate><description>unused</description>
+<enclosure url='%s' type='video/mp4' /></item></channel></rss>'''
+
+REFERENCE_DATE = LOCAL_TIMEZONE.localize(datetime(2010, 1, 1))
+
+class ItemMock:
+    class EnclosureMock:
+        type = 'video/mp4'
+    def __init__(self, url):
+        self.title = 'episode'
+        self.updated_parsed = (2010, 10, 28, 9, 53, 49)
+        self.description = 'unused'
+        self.enclosures = [ItemMock.EnclosureMock()]
+        self.enclosures[0].href = url
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.server = RangeHTTPServer().start()
+        self.tempdir = tempfile.mkdtemp()
+        self.events = []
+        self.metrics = Metrics([CallbackSink(self.events.append)])
+
+    def tearDown(self):
+        self.metrics.close()
+        self.server.stop()
+        shutil.rmtree(self.tempdir)
+
+    def __events(self, name):
+        return [event for event in self.events if event['event'] == name]
+
+    def test_givenDownloadWhenFinishedThenDownloadEventHoldsTimingsAndBytes(self):
+        self.server.resources['/episode.mp4'] = Resource('x' * 100000)
+        downloader = VodcastDownloader(self.tempdir, resume=True, metrics=self.metrics)
+
+        downloader.download(Vodcast(ItemMock(self.server.url('/episode.mp4'))))
+
+        event = self.__events(DOWNLOAD)[0]
+        self.assertEqual('completed', event['outcome'])
+        self.assertEqual('127.0.0.1', event['host'])
+        self.assertEqual(100000, event['bytes'])
+        self.assertEqual(0, event['retries'])
+        self.assertTrue(0 <= event['ttfb_seconds'] <= event['seconds'])
+        self.assertTrue(event['throughput_bps'] > 0)
+
+    def test_givenRetriedDownloadWhenFinishedThenRetriesAreCounted(self):
+        self.server.resources['/episode.mp4'] = Resource('x' * 100000, fail_times=2)
+        downloader = VodcastDownloader(self.tempdir, retry_policy=RetryPolicy(3, sleep=lambda delay: None), metrics=self.metrics)
+
+        downloader.download(Vodcast(ItemMock(self.server.url('/episode.mp4'))))
+
+        self.assertEqual(2, self.__events(DOWNLOAD)[0]['retries'])
+
+    def test_givenMissingEnclosureWhenDownloadingThenFailedDownloadIsReported(self):
+        downloader = VodcastDownloader(self.tempdir, resume=True, metrics=self.metrics)
+
+        self.assertRaises(IOError, downloader.download, Vodcast(ItemMock(self.server.url('/missing.mp4'))))
+
+        self.assertEqual(['failed'], [event['outcome'] for event in self.__events(DOWNLOAD)])
+
+    def test_givenManagerWhenDownloadingThenFeedAndQueueMetricsAreReported(self):
+        self.server.resources['/feed.xml'] = Resource(FEED % self.server.url('/episode.mp4'))
+        self.server.resources['/episode.mp4'] = Resource('episode')
+        manager = VodcastDownloadManager(self.server.url('/feed.xml'), self.tempdir, metrics=self.metrics)
+
+        manager.download_all_newer(REFERENCE_DATE)
+
+        fetch = self.__events(FEED_FETCH)[0]
+        self.assertEqual((self.server.url('/feed.xml'), 200), (fetch['feed'], fetch['status']))
+        self.assertEqual(1, self.__events(FEED_PARSE)[0]['entries'])
+        download = self.__events(DOWNLOAD)[0]
+        self.assertEqual(self.server.url('/feed.xml'), download['feed'])
+        self.assertTrue(download['queue_seconds'] >= 0)
+
+    def test_givenJsonLinesSinkWhenEmittingThenOneObjectPerLineIsAppended(self):
+        path = os.path.join(self.tempdir, 'metrics.jsonl')
+        metrics = Metrics([JsonLinesSink(path)])
+
+        metrics.emit(FEED_FETCH, feed='http://localhost/feed.xml', seconds=0.5)
+        metrics.emit(FEED_PARSE, feed='http://localhost/feed.xml', seconds=0.25, entries=3)
+        metrics.close()
+
+        with open(path, 'r') as lines:
+            events = [json.loads(line) for line in lines]
+        self.assertEqual([(FEED_FETCH, 0.5), (FEED_PARSE, 0.25)], [(event['event'], event['seconds']) for event in events])
+
+    def test_givenPrometheusSinkWhenEmittingThenSummariesAndCountersAreRendered(self):
+        path = os.path.join(self.tempdir, 'metrics.prom')
+        sink = PrometheusSink(path, port=0, host='127.0.0.1')
+        metrics = Metrics([sink])
+
+        metrics.emit(DOWNLOAD, feed='f', host='cdn', outcome='completed', url='http://cdn/1.mp4', seconds=2.0, bytes=100, retries=1)
+        metrics.emit(DOWNLOAD, feed='f', host='cdn', outcome='completed', url='http://cdn/2.mp4', seconds=1.0, bytes=50, retries=0)
+
+        labels = '{feed="f",host="cdn",outcome="completed"}'
+        with open(path, 'r') as prometheus_file:
+            rendered = prometheus_file.read()
+        self.assertTrue('vodcast_download_total%s 2\n' % labels in rendered, rendered)
+        self.assertTrue('vodcast_download_bytes_total%s 150\n' % labels in rendered, rendered)
+        self.assertTrue('vodcast_download_retries_total%s 1\n' % labels in rendered, rendered)
+        self.assertTrue('vodcast_download_seconds_sum%s 3.0\n' % labels in rendered, rendered)
+        self.assertTrue('vodcast_download_seconds_count%s 2\n' % labels in rendered, rendered)
+        self.assertFalse('1.mp4' in rendered)
+        served = urlopen('http://127.0.0.1:%d/metrics' % sink._server.server_address[1]).read()
+        self.assertEqual(rendered, served)
+        metrics.close()
+
+if __name__ == '__main__':
+    unittest.main()
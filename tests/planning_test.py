@@ -0,0 +1,195 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from datetime import datetime
+from calendar import timegm
+sys.path.insert(0,os.path.abspath(__file__+"/../.."))
+from rss.planning import DownloadPlanner, RetentionPolicy
+from rss.download_index import DownloadIndex, INDEX_FILENAME, EVICTED, DEFERRED
+from rss.feed_cache import IndexFeedCache
+from rss.rss_feed_downloader import VodcastDownloader, VodcastDownloadManager, LOCAL_TIMEZONE
+from rss.transport import HttpTransport
+from range_http_server import RangeHTTPServer, Resource
+
+FEED = r'''<?xml version='1.0' encoding='UTF-8'?>
+<rss version='2.0'><channel><title>Extra3</title>
+<item><title>Extra 3 vom 28.10.</title><pubDate>Thu, 28 Oct 2010 11:53:49 +0200</pubDate><description>unused</description>
+<enclosure url='%s' type='video/mp4' /></item>
+<item><title>Extra 3 vom 27.10.</title><pubDate>Wed, 27 Oct 2010 11:53:49 +0200</pubDate><description>unused</description>
+<enclosure url='%s' type='video/mp4' length='500' /></item>
+</channel></rss>'''
+
+class VodcastMock:
+    def __init__(self, title, updated, length=None):
+        self.title = title
+        self.guid = title
+        self.url = 'http://localhost/%s.mp4' % title
+        self.local_filename = '%s.mp4' % title
+        self.target_filename = None
+        self.description = None
+        self.timestamp = timegm(updated.timetuple())
+        self.updated = updated
+        self.length = length
+
+    def __repr__(self):
+        return self.title
+
+def episodes():
+    return [VodcastMock('tuesday', datetime(2010, 10, 26, 9, 53, 49), 200),
+            VodcastMock('thursday', datetime(2010, 10, 28, 9, 53, 49), 300),
+            VodcastMock('wednesday', datetime(2010, 10, 27, 9, 53, 49), 500)]
+
+class DownloadPlannerTest(unittest.TestCase):
+    def test_givenEnoughFreeSpaceWhenPlanningThenAllVodcastsAreDownloadedNewestFirst(self):
+        planner = DownloadPlanner('/downloads', free_space=lambda directory: 1000)
+
+        self.assertEqual(['thursday', 'wednesday', 'tuesday'], [vodcast.title for vodcast in planner.plan(episodes())])
+
+    def test_givenTooLittleFreeSpaceWhenPlanningThenNewestFittingVodcastsAreKept(self):
+        planner = DownloadPlanner('/downloads', reserve=100, free_space=lambda directory: 800)
+
+        self.assertEqual(['thursday', 'tuesday'], [vodcast.title for vodcast in planner.plan(episodes())])
+        self.assertEqual(['wednesday'], [vodcast.title for vodcast in planner.deferred])
+
+    def test_givenSpaceReservedByOtherFeedsWhenPlanningThenItIsNotAvailable(self):
+        planner = DownloadPlanner('/downloads', free_space=lambda directory: 1000)
+
+        self.assertEqual(['thursday'], [vodcast.title for vodcast in planner.plan(episodes(), reserved=650)])
+
+    def test_givenUnknownFreeSpaceWhenPlanningThenDownloadsAreNotLimited(self):
+        def failing_free_space(directory):
+            raise OSError(2, 'No such file or directory')
+        planner = DownloadPlanner('/missing', free_space=failing_free_space)
+
+        self.assertEqual(3, len(planner.plan(episodes())))
+
+    def test_givenIndexWhenPlanningThenOnlyTheGuidsOfTheFeedAreLookedUp(self):
+        tempdir = tempfile.mkdtemp()
+        index = DownloadIndex(os.path.join(tempdir, INDEX_FILENAME))
+        try:
+            index.mark_completed('thursday', 300, feed='extra3')
+            index.mark_completed('wednesday', 500, feed='weltspiegel')
+            index.records = lambda state=None: self.fail('the whole archive is read')
+            planner = DownloadPlanner('/downloads', index, free_space=lambda directory: 1000)
+
+            self.assertEqual(['wednesday', 'tuesday', 'thursday'], [vodcast.title for vodcast in planner.plan(episodes(), 'extra3')])
+            self.assertEqual(700, planner.planned_bytes(episodes(), 'extra3'))
+        finally:
+            index.close()
+            shutil.rmtree(tempdir)
+
+    def test_givenTooLittleFreeSpaceWhenRunningTwiceThenDeferredVodcastIsDownloadedByTheSecondRunThoughOlder(self):
+        import main
+        server = RangeHTTPServer().start()
+        transport = HttpTransport()
+        tempdir = tempfile.mkdtemp()
+        index = DownloadIndex(os.path.join(tempdir, INDEX_FILENAME))
+        try:
+            server.resources['/28.mp4'] = Resource('x' * 700)
+            server.resources['/27.mp4'] = Resource('x' * 500)
+            server.resources['/feed.xml'] = Resource(FEED % (server.url('/28.mp4'), server.url('/27.mp4')), etag='"feed-v1"')
+            feed_url = server.url('/feed.xml')
+            main._saveLastFetchedTimestamp(index, feed_url, timegm(datetime(2010, 10, 1).timetuple()))
+            last_fetched = index.last_fetched(feed_url)
+            def run(free):
+                manager = VodcastDownloadManager(feed_url, tempdir, transport=transport, index=index, feed_cache=IndexFeedCache(index, feed_url))
+                manager.planner.free_space = lambda directory: free
+                downloaded = manager.download_all_newer(main._determineReferenceDate(index, tempdir, 0, feed_url))
+                main._update_last_fetched_timestamp(manager, index, feed_url, downloaded)
+                return manager, downloaded
+
+            # the length of 28.mp4 is unknown and assumed to fit
+            first, downloaded = run(400)
+
+            self.assertEqual(1, downloaded)
+            self.assertEqual(['Extra 3 vom 27.10.'], [vodcast.title for vodcast in first.deferred])
+            self.assertEqual(DEFERRED, index.get(server.url('/27.mp4'), feed_url).state)
+            # the timestamp advances past the deferred episode, the index brings it back
+            self.assertNotEqual(last_fetched, index.last_fetched(feed_url))
+            self.assertTrue(IndexFeedCache(index, feed_url).load())
+
+            second, downloaded = run(10000)
+
+            self.assertTrue(second.not_modified)
+            self.assertEqual([], second.deferred)
+            self.assertTrue(index.get(server.url('/27.mp4'), feed_url).completed)
+            self.assertEqual(['/27.mp4', '/28.mp4'], sorted(path for command, path, headers in server.requests if path.endswith('.mp4')))
+        finally:
+            index.close()
+            transport.close()
+            server.stop()
+            shutil.rmtree(tempdir)
+
+    def test_givenEnclosuresWithoutLengthWhenProbingThenHeadRequestsEstimateTheirSize(self):
+        server = RangeHTTPServer().start()
+        transport = HttpTransport()
+        try:
+            server.resources['/28.mp4'] = Resource('x' * 700)
+            server.resources['/27.mp4'] = Resource('x' * 500)
+            tempdir = tempfile.mkdtemp()
+            manager = VodcastDownloadManager(FEED % (server.url('/28.mp4'), server.url('/27.mp4')), tempdir, transport=transport, probe_sizes=True)
+            manager.planner.free_space = lambda directory: 1000
+
+            planned = manager.plan(manager.select_newer(LOCAL_TIMEZONE.localize(datetime(2010, 10, 1))))
+
+            self.assertEqual([('Extra 3 vom 28.10.', 700)], [(vodcast.title, vodcast.length) for vodcast in planned])
+            self.assertEqual(['HEAD'], [command for command, path, headers in server.requests])
+            shutil.rmtree(tempdir)
+        finally:
+            transport.close()
+            server.stop()
+
+class RetentionPolicyTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.index = DownloadIndex(os.path.join(self.tempdir, INDEX_FILENAME))
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.tempdir)
+
+    def __download(self, name, size, feed, mtime):
+        target = os.path.join(self.tempdir, name)
+        with open(target, 'w') as download:
+            download.write('x' * size)
+        os.utime(target, (mtime, mtime))
+        self.index.mark_completed(name, size, feed=feed, url='http://localhost/%s' % name, target=target)
+        return target
+
+    def __remaining(self):
+        return sorted(name for name in os.listdir(self.tempdir) if name != INDEX_FILENAME)
+
+    def test_givenKeepLastWhenEvictingThenOldestDownloadsOfTheFeedMakeRoomForIncomingOnes(self):
+        for day in range(4):
+            self.__download('extra3-%d.mp4' % day, 10, 'extra3', 1000 + day)
+        self.__download('weltspiegel.mp4', 10, 'weltspiegel', 0)
+
+        freed = RetentionPolicy(keep_last=3).evict(self.index, 'extra3', incoming=1)
+
+        self.assertEqual(20, freed)
+        self.assertEqual(['extra3-2.mp4', 'extra3-3.mp4', 'weltspiegel.mp4'], self.__remaining())
+        self.assertEqual(EVICTED, self.index.get('extra3-0.mp4', 'extra3').state)
+
+    def test_givenMaxBytesWhenEvictingThenLeastRecentlyModifiedDownloadsOfTheDirectoryGo(self):
+        self.__download('old.mp4', 100, 'weltspiegel', 1000)
+        self.__download('middle.mp4', 100, 'extra3', 2000)
+        self.__download('new.mp4', 100, 'extra3', 3000)
+
+        RetentionPolicy(max_bytes=250).evict(self.index, 'extra3', incoming=1, incoming_bytes=50)
+
+        self.assertEqual(['middle.mp4', 'new.mp4'], self.__remaining())
+
+    def test_givenEvictedDownloadWhenDownloadingAgainThenItIsSkipped(self):
+        target = self.__download('episode.mp4', 10, 'extra3', 1000)
+        RetentionPolicy(keep_last=0).evict(self.index, 'extra3')
+        vodcast = VodcastMock('episode', datetime(2010, 10, 28, 9, 53, 49))
+        vodcast.guid = 'episode.mp4'
+
+        VodcastDownloader(self.tempdir, url_retriever=lambda *args: self.fail('evicted vodcast downloaded'), index=self.index, feed_url='extra3').download(vodcast)
+
+        self.assertFalse(os.path.exists(target))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,164 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime
+sys.path.insert(0,os.path.abspath(__file__+"/../.."))
+from rss.postprocess import PostProcessor, CommandHook, POST_PROCESS
+from rss.download_index import DownloadIndex, INDEX_FILENAME
+from rss.integrity import verify_archive
+from rss.rss_feed_downloader import VodcastDownloadManager, LOCAL_TIMEZONE
+from rss.metrics import Metrics, CallbackSink
+from rss.transport import HttpTransport
+from range_http_server import RangeHTTPServer, Resource
+
+FEED = r'''<?xml version='1.0' encoding='UTF-8'?>
+<rss version='2.0'><channel><title>Extra3</title>
+<item><title>Extra 3 vom 28.10.</title><pubDate>Thu, 28 Oct 2010 11:53:49 +0200</pubDate><description>unused</description>
+<enclosure url='%s' type='video/mp4' /></item>
+<item><title>Extra 3 vom 27.10.</title><pubDate>Wed, 27 Oct 2010 11:53:49 +0200</pubDate><description>unused</description>
+<enclosure url='%s' type='video/mp4' /></item>
+</channel></rss>'''
+
+class VodcastMock:
+    def __init__(self, title):
+        self.title = title
+        self.guid = title
+        self.url = 'http://localhost/%s.mp4' % title
+
+class PostProcessorTest(unittest.TestCase):
+    def test_givenHooksWhenPostProcessingThenStagesRunInOrderAndAreTimed(self):
+        calls = []
+        def tag(vodcast, filename):
+            calls.append(('tag', filename))
+        def thumbnail(vodcast, filename):
+            calls.append(('thumbnail', filename))
+        events = []
+        processor = PostProcessor([tag, thumbnail], metrics=Metrics([CallbackSink(events.append)]))
+
+        processor.submit(VodcastMock('one'), '/tmp/one.mp4', 'feed')
+        processor.close()
+
+        self.assertEqual([('tag', '/tmp/one.mp4'), ('thumbnail', '/tmp/one.mp4')], calls)
+        self.assertEqual(['tag', 'thumbnail'], [stage for stage, seconds in processor.results[0].stages])
+        self.assertEqual({'tag' : 1, 'thumbnail' : 1}, dict((stage, count) for stage, (count, seconds) in processor.timings.items()))
+        self.assertEqual([(POST_PROCESS, 'tag', 'completed', 'feed'), (POST_PROCESS, 'thumbnail', 'completed', 'feed')],
+                         [(event['event'], event['stage'], event['outcome'], event['feed']) for event in events])
+
+    def test_givenFailingStageWhenPostProcessingThenRemainingStagesAreSkipped(self):
+        calls = []
+        def remux(vodcast, filename):
+            raise Exception('broken container')
+        def thumbnail(vodcast, filename):
+            calls.append(filename)
+        processor = PostProcessor([remux, thumbnail])
+
+        processor.submit(VodcastMock('one'), '/tmp/one.mp4')
+        processor.close()
+
+        self.assertEqual([], calls)
+        self.assertFalse(processor.results[0].succeeded)
+        self.assertEqual('remux', processor.results[0].failed_stage)
+
+    def test_givenFullQueueWhenSubmittingThenSubmitBlocksUntilAWorkerCatchesUp(self):
+        release = threading.Event()
+        def slow(vodcast, filename):
+            release.wait(5)
+        processor = PostProcessor([slow], workers=1, queue_size=1)
+        # the worker takes the first, the second fills the queue
+        processor.submit(VodcastMock('one'), '/tmp/one.mp4')
+        processor.submit(VodcastMock('two'), '/tmp/two.mp4')
+        submitted = threading.Event()
+        def submit_third():
+            processor.submit(VodcastMock('three'), '/tmp/three.mp4')
+            submitted.set()
+        thread = threading.Thread(target=submit_third)
+        thread.start()
+
+        self.assertFalse(submitted.wait(0.2))
+        release.set()
+        self.assertTrue(submitted.wait(5))
+        thread.join()
+        processor.close()
+        self.assertEqual(3, len(processor.results))
+
+class CommandHookTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_givenCommandWhenRunThenFieldsOfTheDownloadAreSubstituted(self):
+        copy = os.path.join(self.tempdir, 'copy.txt')
+        CommandHook("sh -c 'echo \"$0 $1\" > %s' {title} {file}" % copy)(VodcastMock(u'Extra 3'), '/tmp/one.mp4')
+
+        with open(copy) as copied:
+            self.assertEqual('Extra 3 /tmp/one.mp4\n', copied.read())
+
+    def test_givenFailingCommandWhenRunThenStageFails(self):
+        self.assertRaises(Exception, CommandHook('false'), VodcastMock('one'), '/tmp/one.mp4')
+
+class ManagerPostProcessingTest(unittest.TestCase):
+    def test_givenPostProcessorWhenDownloadingThenFirstEpisodeIsProcessedWhileTheSecondDownloads(self):
+        server = RangeHTTPServer().start()
+        transport = HttpTransport()
+        tempdir = tempfile.mkdtemp()
+        overlapped = []
+        def checksum(vodcast, filename):
+            # the second download is requested while the first is post-processed
+            deadline = time.time() + 5
+            while time.time() < deadline and '/27.mp4' not in [path for command, path, headers in server.requests]:
+                time.sleep(0.01)
+            overlapped.append((os.path.basename(filename), '/27.mp4' in [path for command, path, headers in server.requests]))
+        processor = PostProcessor([checksum])
+        try:
+            server.resources['/28.mp4'] = Resource('x' * 1000)
+            server.resources['/27.mp4'] = Resource('y' * 1000, latency=0.5)
+            manager = VodcastDownloadManager(FEED % (server.url('/28.mp4'), server.url('/27.mp4')), tempdir, transport=transport,
+                                             newest_first=True, post_processor=processor)
+
+            manager.download_all_newer(LOCAL_TIMEZONE.localize(datetime(2010, 10, 1)))
+            processor.close()
+
+            self.assertEqual(('28.mp4', True), overlapped[0])
+            self.assertEqual(2, len(processor.results))
+        finally:
+            transport.close()
+            server.stop()
+            shutil.rmtree(tempdir)
+
+    def test_givenHookModifyingTheFileWhenRunningAgainThenItIsNeitherDownloadedAgainNorCorrupt(self):
+        server = RangeHTTPServer().start()
+        transport = HttpTransport()
+        tempdir = tempfile.mkdtemp()
+        index = DownloadIndex(os.path.join(tempdir, INDEX_FILENAME))
+        def tag(vodcast, filename):
+            with open(filename, 'ab') as tagged:
+                tagged.write('tags')
+        try:
+            server.resources['/28.mp4'] = Resource('x' * 1000)
+            server.resources['/27.mp4'] = Resource('y' * 1000)
+            feed = FEED % (server.url('/28.mp4'), server.url('/27.mp4'))
+            reference_date = LOCAL_TIMEZONE.localize(datetime(2010, 10, 1))
+            processor = PostProcessor([tag])
+            VodcastDownloadManager(feed, tempdir, transport=transport, index=index, post_processor=processor).download_all_newer(reference_date)
+            processor.close()
+            downloads = len(server.requests)
+
+            VodcastDownloadManager(feed, tempdir, transport=transport, index=index).download_all_newer(reference_date)
+
+            self.assertEqual(downloads, len(server.requests))
+            self.assertEqual([1004, 1004], [os.path.getsize(os.path.join(tempdir, name)) for name in ('28.mp4', '27.mp4')])
+            self.assertTrue(all(result.ok for result in verify_archive(index)))
+        finally:
+            index.close()
+            transport.close()
+            server.stop()
+            shutil.rmtree(tempdir)
+
+if __name__ == '__main__':
+    unittest.main()
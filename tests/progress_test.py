@@ -0,0 +1,55 @@
+import os
+import sys
+import unittest
+sys.path.insert(0,os.path.abspath(__file__+"/../.."))
+from rss import progress
+from rss.progress import Progress
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+    def __call__(self):
+        return self.now
+
+class ProgressTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.original_time = progress._time
+        progress._time = self.clock
+
+    def tearDown(self):
+        progress._time = self.original_time
+
+    def __run(self, tracker, seconds, rate):
+        for second in range(seconds):
+            self.clock.now += 1
+            tracker.update(tracker.history[-1][0] + rate)
+
+    def test_givenLongTransferWhenUpdatingThenHistoryStaysBounded(self):
+        tracker = Progress(10 ** 9, unit='kb', history_size=60)
+
+        self.__run(tracker, 3600, 1000)
+
+        self.assertEqual(60, len(tracker.history))
+        self.assertEqual([], tracker.log)
+        self.assertAlmostEqual(1000, tracker.predicted_rate(), places=3)
+        self.assertAlmostEqual(1000, tracker.overall_rate(), places=3)
+
+    def test_givenKeepLogWhenUpdatingThenPredictionsAreRecorded(self):
+        tracker = Progress(100000, unit='kb', keep_log=True)
+
+        self.__run(tracker, 10, 1000)
+
+        self.assertEqual(11, len(tracker.log))
+        self.assertEqual(4, len(tracker.log[-1][2]))
+
+    def test_givenStalledTransferWhenUpdatingThenPredictionDoesNotFail(self):
+        tracker = Progress(100000, unit='kb')
+
+        self.__run(tracker, 3, 1000)
+        self.__run(tracker, 3, 0)
+
+        self.assertTrue(tracker.time_remaining() > 0)
+
+if __name__ == '__main__':
+    unittest.main()
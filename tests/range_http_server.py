@@ -0,0 +1,145 @@
+"""
+local HTTP stand-in for download tests. serves in-memory content with ETag/Last-Modified validators and
+supports single Range requests (including If-Range) and conditional requests with If-None-Match.
+"""
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+import re
+import threading
+import time
+
+class Resource:
+    def __init__(self, content='', etag='"v1"', last_modified='Tue, 26 Oct 2010 09:53:49 GMT', accept_ranges=True, abort_after=None, redirect=None, retry_after=None,
+                 abort_times=None, fail_times=0, headers=None, latency=0, rate=None):
+        self.content = content
+        self.etag = etag
+        self.last_modified = last_modified
+        self.accept_ranges = accept_ranges
+        # close the connection after sending that many body bytes (simulates a broken transfer), only for the first
+        # abort_times responses if given
+        self.abort_after = abort_after
+        self.abort_times = abort_times
+        # answer the first fail_times requests with a 503
+        self.fail_times = fail_times
+        # answer with a 302 to this location
+        self.redirect = redirect
+        # answer with a 429 asking to retry after that many seconds
+        self.retry_after = retry_after
+        # additional headers of every complete response (e.g. Digest, Content-MD5)
+        self.headers = headers or {}
+        # wait that many seconds before answering and send the body with at most rate bytes per second
+        self.latency = latency
+        self.rate = rate
+
+class RangeRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def _serve(self, send_body):
+        self.server.requests.append((self.command, self.path, dict(self.headers)))
+        self.server.connections.add(self.client_address)
+        resource = self.server.resources.get(self.path)
+        if resource is None:
+            self.send_error(404)
+            return
+        if resource.latency:
+            time.sleep(resource.latency)
+        if resource.fail_times:
+            resource.fail_times -= 1
+            self.send_error(503)
+            return
+        if resource.retry_after is not None:
+            self.send_response(429)
+            self.send_header('Retry-After', str(resource.retry_after))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if resource.redirect:
+            self.send_response(302)
+            self.send_header('Location', resource.redirect)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if resource.etag and self.headers.getheader('If-None-Match') == resource.etag:
+            self.send_response(304)
+            self.send_header('ETag', resource.etag)
+            self.end_headers()
+            return
+        content = resource.content
+        first, last = 0, len(content) - 1
+        status = 200
+        range_header = self.headers.getheader('Range')
+        if_range = self.headers.getheader('If-Range')
+        if range_header and resource.accept_ranges and if_range in (None, resource.etag, resource.last_modified):
+            match = re.match(r'bytes=(\d+)-(\d*)', range_header)
+            first = int(match.group(1))
+            if match.group(2):
+                last = min(last, int(match.group(2)))
+            if first >= len(content):
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */%d' % len(content))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            status = 206
+        body = content[first:last + 1]
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', resource.etag)
+        self.send_header('Last-Modified', resource.last_modified)
+        if resource.accept_ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        if status == 206:
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (first, last, len(content)))
+        for name, value in resource.headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        if not send_body:
+            return
+        if resource.abort_after is not None and resource.abort_times != 0:
+            if resource.abort_times:
+                resource.abort_times -= 1
+            self.wfile.write(body[:resource.abort_after])
+            self.wfile.flush()
+            self.close_connection = 1
+            return
+        if resource.rate:
+            self._write_throttled(body, resource.rate)
+        else:
+            self.wfile.write(body)
+
+    def _write_throttled(self, body, rate):
+        chunk_size = max(1, rate / 20)
+        for offset in range(0, len(body), chunk_size):
+            self.wfile.write(body[offset:offset + chunk_size])
+            time.sleep(float(chunk_size) / rate)
+
+class RangeHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), RangeRequestHandler)
+        self.resources = {}
+        self.requests = []
+        self.connections = set()
+
+    def url(self, path):
+        return 'http://127.0.0.1:%d%s' % (self.server_address[1], path)
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,90 @@
+import os
+import sys
+import unittest
+sys.path.insert(0,os.path.abspath(__file__+"/../.."))
+from rss.rate_limit import TokenBucket, RateLimiter, parse_retry_after, parse_rate
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+class TokenBucketTest(unittest.TestCase):
+    def test_givenFullBucketWhenReservingLessThanCapacityThenNoWaitIsNeeded(self):
+        bucket = TokenBucket(1000, clock=FakeClock())
+
+        self.assertEqual(0, bucket.reserve(250))
+
+    def test_givenEmptyBucketWhenReservingThenWaitPaysOffTheDebt(self):
+        clock = FakeClock()
+        bucket = TokenBucket(1000, clock=clock)
+
+        self.assertEqual(0.75, bucket.reserve(1000))
+        clock.now += 0.75
+        self.assertEqual(0.5, bucket.reserve(500))
+
+    def test_givenIdleBucketWhenRefillingThenBurstIsBoundedByCapacity(self):
+        clock = FakeClock()
+        bucket = TokenBucket(1000, capacity=100, clock=clock)
+        clock.now += 60
+
+        self.assertEqual(0.9, bucket.reserve(1000))
+
+class RateLimiterTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def test_givenGlobalRateWhenThrottlingManyBlocksThenThroughputStaysAtRate(self):
+        limiter = RateLimiter(max_rate=1000, clock=self.clock, sleep=self.clock.sleep)
+        start = self.clock.now
+
+        for block in range(40):
+            limiter.throttle('media.ndr.de' if block % 2 else 'daserste.de', 100)
+
+        self.assertAlmostEqual(3.75, self.clock.now - start)
+
+    def test_givenPerHostRateWhenThrottlingThenHostsAreLimitedIndependently(self):
+        limiter = RateLimiter(max_rate_per_host=1000, clock=self.clock, sleep=self.clock.sleep)
+
+        self.assertEqual(0.75, limiter.delay('media.ndr.de', 1000))
+        self.assertEqual(0, limiter.delay('daserste.de', 100))
+
+    def test_givenRatesWhenAskingForTheBurstThenTheSmallerBucketCapacityIsReturned(self):
+        self.assertEqual(250, RateLimiter(max_rate=4000, max_rate_per_host=1000, clock=self.clock).burst('media.ndr.de'))
+        self.assertEqual(None, RateLimiter(clock=self.clock).burst('media.ndr.de'))
+
+    def test_givenRetryAfterWhenWaitingThenHostIsPausedUntilThen(self):
+        limiter = RateLimiter(clock=self.clock, sleep=self.clock.sleep)
+        limiter.defer('media.ndr.de', 30)
+        limiter.defer('media.ndr.de', 10)
+
+        self.assertEqual(0, limiter.wait_time('daserste.de'))
+        limiter.wait('media.ndr.de')
+
+        self.assertEqual([30], self.clock.slept)
+        self.assertEqual(0, limiter.wait_time('media.ndr.de'))
+
+class ParseTest(unittest.TestCase):
+    def test_givenRetryAfterValuesWhenParsingThenSecondsAreReturned(self):
+        self.assertEqual(120, parse_retry_after('120'))
+        self.assertEqual(60, parse_retry_after('Wed, 21 Oct 2015 07:29:00 GMT', now=1445412480))
+        self.assertEqual(None, parse_retry_after('soon'))
+        self.assertEqual(None, parse_retry_after(None))
+
+    def test_givenRatesWhenParsingThenBytesPerSecondAreReturned(self):
+        self.assertEqual(500 * 1024, parse_rate('500k'))
+        self.assertEqual(int(1.5 * 1024 * 1024), parse_rate('1.5M'))
+        self.assertEqual(1000, parse_rate('1000'))
+        self.assertEqual(None, parse_rate(None))
+        self.assertRaises(ValueError, parse_rate, '0')
+        self.assertRaises(ValueError, parse_rate, 'fast')
+
+if __name__ == '__main__':
+    unittest.main()
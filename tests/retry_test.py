@@ -0,0 +1,67 @@
+import os
+import socket
+import sys
+import unittest
+from StringIO import StringIO
+from urllib2 import HTTPError, URLError
+from mimetools import Message
+sys.path.insert(0,os.path.abspath(__file__+"/../.."))
+from rss.retry import RetryPolicy, IncompleteTransferError
+
+def http_error(code, retry_after=None):
+    headers = Message(StringIO('Retry-After: %s\r\n\r\n' % retry_after if retry_after else '\r\n'))
+    return HTTPError('http://media.ndr.de/episode.mp4', code, 'error', headers, None)
+
+class RetryPolicyTest(unittest.TestCase):
+    def setUp(self):
+        self.delays = []
+        self.policy = RetryPolicy(4, base_delay=1, max_delay=5, sleep=self.delays.append, random=lambda: 0)
+
+    def test_givenErrorsWhenClassifyingThenOnlyTransientOnesAreRetryable(self):
+        for error in (http_error(500), http_error(503), http_error(429), socket.timeout(), socket.error(104, 'reset'),
+                      URLError(socket.error(111, 'refused')), IncompleteTransferError('incomplete')):
+            self.assertTrue(self.policy.is_retryable(error), error)
+        for error in (http_error(404), http_error(403), URLError('unknown url type'), IOError(28, 'no space left'), ValueError()):
+            self.assertFalse(self.policy.is_retryable(error), error)
+
+    def test_givenAttemptsWhenComputingDelayThenItDoublesUpToTheCap(self):
+        self.assertEqual([1, 2, 4, 5, 5], [self.policy.delay(attempt) for attempt in range(1, 6)])
+
+    def test_givenJitterWhenComputingDelayThenItIsReducedByUpToTheJitter(self):
+        policy = RetryPolicy(jitter=0.5, random=lambda: 1)
+
+        self.assertEqual(2, policy.delay(3))
+
+    def test_givenRetryAfterWhenComputingDelayThenServerDelayIsHonoredWithinTheCap(self):
+        self.assertEqual(3, self.policy.delay(1, http_error(503, 3)))
+        self.assertEqual(None, self.policy.delay(1, http_error(503, 60)))
+
+    def test_givenTransientFailuresWhenCallingThenFunctionIsRetried(self):
+        failures = [socket.timeout(), http_error(502)]
+        def flaky():
+            if failures:
+                raise failures.pop(0)
+            return 'feed'
+
+        self.assertEqual('feed', self.policy.call(flaky, 'fetch feed'))
+        self.assertEqual([1, 2], self.delays)
+
+    def test_givenFatalErrorWhenCallingThenItIsRaisedRightAway(self):
+        def missing():
+            raise http_error(404)
+
+        self.assertRaises(HTTPError, self.policy.call, missing, 'fetch feed')
+        self.assertEqual([], self.delays)
+
+    def test_givenPersistentFailureWhenCallingThenItIsRaisedAfterAllAttempts(self):
+        calls = []
+        def broken():
+            calls.append(1)
+            raise socket.timeout()
+
+        self.assertRaises(socket.timeout, self.policy.call, broken, 'fetch feed')
+        self.assertEqual(4, len(calls))
+        self.assertEqual([1, 2, 4], self.delays)
+
+if __name__ == '__main__':
+    unittest.main()
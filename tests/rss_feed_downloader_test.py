@@ -1,4 +1,9 @@
+import base64
 import feedparser
+import gc
+import hashlib
+import json
+import logging
 from datetime import datetime
 import os
 import sys
@@ -10,7 +15,16 @@ from rss.rss_feed_downloader import parse_video_item
 from rss.rss_feed_downloader import VodcastDownloader
 from rss.rss_feed_downloader import VodcastDownloadManager
 from rss.rss_feed_downloader import Vodcast
+from rss.rss_feed_downloader import DownloadPool
+from rss.retry import RetryPolicy
+from rss.download_index import DownloadIndex
+from rss.integrity import IntegrityError
+from range_http_server import RangeHTTPServer, Resource
+import shutil
 import tempfile
+import threading
+import time
+from urllib2 import HTTPError
 
 def as_local_datetime(date):
     local_timezone = pytz.timezone('Europe/Berlin')
@@ -71,6 +85,27 @@ class VodcastFeedDownloaderTest(unittest.TestCase):
         self.assertEqual(vodcast.local_filename, 'TV-20101023-2220-5801.h264.mp4')
         self.assertEqual(vodcast.updated, datetime(2010, 10, 26, 9, 53, 49))
 
+    def test_givenParsedEntryWhenVodcastIsCreatedThenOnlyCompactFieldsAreKept(self):
+        entry = self.rss_feed.entries[0]
+        entry.description = 'x' * 1000
+        # feedparser derives the enclosures from the links on every access
+        [link for link in entry.links if link.rel == 'enclosure'][0]['length'] = '123456'
+        vodcast = parse_video_item(entry)
+
+        self.assertFalse(hasattr(vodcast, '__dict__'))
+        self.assertEqual(1288086829, vodcast.timestamp)
+        self.assertEqual(123456, vodcast.length)
+        self.assertEqual(200, len(vodcast.description))
+        self.assertFalse(any(referent is entry for referent in gc.get_referents(vodcast)))
+
+    def test_givenVodcastRecordWhenRestoredThenFieldsAreEqual(self):
+        vodcast = parse_video_item(self.rss_feed.entries[0])
+
+        restored = Vodcast.from_record(json.loads(json.dumps(vodcast.to_record())))
+
+        self.assertEqual(vodcast, restored)
+        self.assertEqual((vodcast.guid, vodcast.description, vodcast.length), (restored.guid, restored.description, restored.length))
+
     def test_givenVideoUrlWithParametersWhenGeneratingLocalFileThenParametersAreStriped(self):
         entry = type('Entry', (object,), {}) 
         entry.title = 'test_givenVideoUrlWithParametersWhenGeneratingLocalFileThenParametersAreStriped'
@@ -205,23 +240,394 @@ class VodcastFeedDownloaderTest(unittest.TestCase):
         self.assertRaisesRegexp(Exception, 'User interrupted' ,vodcast_downloader.download, vodcast)
         self.assertFileNotPresent(None, testfile)
         
-    def test_create_timestamp_file_if_it_doesnt_exists_and_no_file_was_downloaded(self):
+    def test_givenRenamePolicyWhenDownloadingThenTargetOnlyAppearsWhenComplete(self):
+        tempdir = tempfile.mkdtemp()
+        vodcast = Vodcast(ItemMock('Extra 3 three', (2010, 10, 28, 9, 53, 49), 'http://media.ndr.de/episode.mp4'))
+        target = os.path.join(tempdir, 'episode.mp4')
+        def retrieve(url, filename, hook):
+            self.assertEqual(target + '.part', filename)
+            self.assertFileNotPresent(None, target)
+            with open(filename, 'wb') as part:
+                part.write('episode')
+
+        try:
+            VodcastDownloader(tempdir, url_retriever=retrieve).download(vodcast)
+            self.assertEqual(['episode.mp4'], os.listdir(tempdir))
+        finally:
+            shutil.rmtree(tempdir)
+
+    def test_givenDirectPolicyWhenDownloadingThenTargetIsWrittenInPlace(self):
+        tempdir = tempfile.mkdtemp()
+        vodcast = Vodcast(ItemMock('Extra 3 three', (2010, 10, 28, 9, 53, 49), 'http://media.ndr.de/episode.mp4'))
+        filenames = []
+
+        try:
+            VodcastDownloader(tempdir, url_retriever=lambda url, filename, hook: filenames.append(filename), write_policy='direct').download(vodcast)
+            self.assertEqual([os.path.join(tempdir, 'episode.mp4')], filenames)
+        finally:
+            shutil.rmtree(tempdir)
+
+    def test_create_timestamp_if_it_doesnt_exists_and_no_file_was_downloaded(self):
         from main import main as rss_main
         import main
         from optparse import OptionParser
+        from rss.download_index import DownloadIndex, INDEX_FILENAME
         import sys
         def throwing_error(self, msg):
             raise Exception(msg)
         main.OptionParser = op = OptionParser
         op.error = throwing_error
-        download_directory = tempfile.gettempdir()
-        expected_filename = main._create_fetch_info_path(download_directory, 'localhost')
+        download_directory = tempfile.mkdtemp()
         try:
-            self.assertFileNotPresent('', expected_filename)
             rss_main(['-d', download_directory, '-u', 'localhost'])
-            self.assertFilePresent('', expected_filename)
+            self.assertIsNotNone(DownloadIndex(os.path.join(download_directory, INDEX_FILENAME)).last_fetched('localhost'))
+        finally:
+            shutil.rmtree(download_directory)
+
+    def test_take_over_timestamp_file_of_earlier_versions(self):
+        import main
+        from rss.download_index import DownloadIndex
+        download_directory = tempfile.mkdtemp()
+        try:
+            index = DownloadIndex(os.path.join(download_directory, 'index'))
+            timestamp_file = main._create_fetch_info_path(download_directory, 'http://some.domain/rss.xml')
+            with open(timestamp_file, 'w') as f:
+                f.write(datetime.strftime(datetime(2010, 10, 27, 0, 0, 0), '%c'))
+
+            reference_date = main._determineReferenceDate(index, download_directory, None, 'http://some.domain/rss.xml')
+
+            self.assertEqual(as_local_datetime(datetime(2010, 10, 27, 0, 0, 0)), reference_date)
+            self.assertFileNotPresent('', timestamp_file)
+            self.assertEqual(reference_date, main._determineReferenceDate(index, download_directory, None, 'http://some.domain/rss.xml'))
+        finally:
+            shutil.rmtree(download_directory)
+
+    def __create_vodcasts(self, count):
+        return [Vodcast(ItemMock('Extra 3 %d' % number, (2010, 10, 28, 9, 53, 49), 'http://media.ndr.de/download/podcasts/extradrei196/TV-%d.h264.mp4' % number))
+                for number in range(count)]
+
+    def test_givenFailingVodcastWhenDownloadingAllThenRemainingVodcastsAreStillDownloaded(self):
+        vodcasts = self.__create_vodcasts(5)
+        downloaded = []
+        def download(vodcast):
+            if vodcast.title == 'Extra 3 1':
+                raise Exception('connection reset')
+            downloaded.append(vodcast)
+            return vodcast.local_filename
+
+        vodcast_download_manager = VodcastDownloadManager(None, None, threads=2)
+        vodcast_download_manager.vodcasts = vodcasts
+        vodcast_download_manager.downloader.download = download
+
+        self.assertEqual(vodcast_download_manager.download_all_newer(as_local_datetime(datetime(2010, 10, 27, 0, 0, 0))), 4)
+        self.assertEqual(4, len(downloaded))
+        self.assertEqual([vodcasts[1]], [result.vodcast for result in vodcast_download_manager.failed])
+        self.assertEqual('connection reset', str(vodcast_download_manager.failed[0].error))
+
+    def test_givenMultipleThreadsWhenDownloadingThenDownloadsRunConcurrentlyBoundedByThreads(self):
+        lock = threading.Lock()
+        running = [0]
+        max_running = [0]
+        def download(vodcast):
+            with lock:
+                running[0] += 1
+                max_running[0] = max(max_running[0], running[0])
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+            return vodcast.local_filename
+
+        downloader = VodcastDownloader()
+        downloader.download = download
+        results = DownloadPool(3).run((downloader, vodcast) for vodcast in self.__create_vodcasts(9))
+
+        self.assertEqual(3, max_running[0])
+        self.assertEqual(['TV-%d.h264.mp4' % number for number in range(9)], [result.target_filename for result in results])
+        self.assertTrue(all(result.succeeded for result in results))
+
+    def test_givenMaxPerHostWhenDownloadingThenConnectionsPerHostAreCappedButOtherHostsProceed(self):
+        lock = threading.Lock()
+        running = {}
+        max_running = {}
+        def download(vodcast):
+            host = vodcast.url.split('/')[2]
+            with lock:
+                running[host] = running.get(host, 0) + 1
+                max_running[host] = max(max_running.get(host, 0), running[host])
+            time.sleep(0.05)
+            with lock:
+                running[host] -= 1
+            return vodcast.local_filename
+
+        downloader = VodcastDownloader()
+        downloader.download = download
+        vodcasts = self.__create_vodcasts(6)
+        for vodcast in vodcasts[4:]:
+            vodcast.url = vodcast.url.replace('media.ndr.de', 'www.daserste.de')
+        results = DownloadPool(4, max_per_host=2).run((downloader, vodcast) for vodcast in vodcasts)
+
+        self.assertEqual({'media.ndr.de' : 2, 'www.daserste.de' : 2}, max_running)
+        self.assertTrue(all(result.succeeded for result in results))
+
+class ResumeDownloadTest(unittest.TestCase):
+    CONTENT = ''.join(chr(byte % 256) for byte in range(300 * 1024))
+
+    def setUp(self):
+        self.server = RangeHTTPServer().start()
+        self.tempdir = tempfile.mkdtemp()
+        self.downloader = VodcastDownloader(self.tempdir, resume=True)
+        self.vodcast = Vodcast(ItemMock('Extra 3 one', (2010, 10, 28, 9, 53, 49), self.server.url('/episode.mp4')))
+        self.target = os.path.join(self.tempdir, 'episode.mp4')
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tempdir)
+
+    def __read(self, filename):
+        with open(filename, 'rb') as f:
+            return f.read()
+
+    def __interrupt_at(self, offset):
+        self.server.resources['/episode.mp4'] = Resource(self.CONTENT, abort_after=offset)
+        self.assertRaisesRegexp(IOError, 'incomplete download', self.downloader.download, self.vodcast)
+        self.assertFalse(os.path.exists(self.target))
+        self.assertEqual(offset, os.path.getsize(self.target + '.part'))
+
+    def test_givenInterruptedDownloadWhenDownloadingAgainThenTransferContinuesWithRange(self):
+        self.__interrupt_at(100 * 1024)
+        self.server.resources['/episode.mp4'] = Resource(self.CONTENT)
+
+        self.downloader.download(self.vodcast)
+
+        self.assertEqual(self.CONTENT, self.__read(self.target))
+        self.assertFalse(os.path.exists(self.target + '.part'))
+        self.assertFalse(os.path.exists(self.target + '.part.json'))
+        headers = self.server.requests[-1][2]
+        self.assertEqual('bytes=%d-' % (100 * 1024), headers['range'])
+        self.assertEqual('"v1"', headers['if-range'])
+
+    def test_givenResumableDownloadWhenFinishedThenNothingIsWarned(self):
+        self.server.resources['/episode.mp4'] = Resource(self.CONTENT)
+        warnings = []
+        handler = logging.Handler(logging.WARN)
+        handler.emit = warnings.append
+        logging.getLogger('VodcastDownloader').addHandler(handler)
+        try:
+            self.downloader.download(self.vodcast)
         finally:
-            os.unlink(expected_filename)
+            logging.getLogger('VodcastDownloader').removeHandler(handler)
+
+        self.assertEqual([], [record.getMessage() for record in warnings])
+        self.assertFalse(os.path.exists(self.target + '.part.json'))
+
+    def test_givenChangedEtagWhenResumingThenDownloadRestartsFromScratch(self):
+        self.__interrupt_at(100 * 1024)
+        changed_content = self.CONTENT[::-1]
+        self.server.resources['/episode.mp4'] = Resource(changed_content, etag='"v2"')
+
+        self.downloader.download(self.vodcast)
+
+        self.assertEqual(changed_content, self.__read(self.target))
+
+    def test_givenServerIgnoringRangeWhenResumingThenDownloadRestartsFromScratch(self):
+        self.__interrupt_at(100 * 1024)
+        self.server.resources['/episode.mp4'] = Resource(self.CONTENT, accept_ranges=False)
+
+        self.downloader.download(self.vodcast)
+
+        self.assertEqual(self.CONTENT, self.__read(self.target))
+
+    def test_givenCompletePartFileWhenResumingThenItIsFinishedWithoutTransfer(self):
+        self.__interrupt_at(100 * 1024)
+        with open(self.target + '.part', 'wb') as part:
+            part.write(self.CONTENT)
+        self.server.resources['/episode.mp4'] = Resource(self.CONTENT)
+
+        self.downloader.download(self.vodcast)
+
+        self.assertEqual(self.CONTENT, self.__read(self.target))
+        self.assertEqual('bytes=%d-' % len(self.CONTENT), self.server.requests[-1][2]['range'])
+
+class SegmentedDownloadTest(unittest.TestCase):
+    CONTENT = ''.join(chr(byte % 251) for byte in range(256 * 1024 + 17))
+
+    def setUp(self):
+        self.server = RangeHTTPServer().start()
+        self.tempdir = tempfile.mkdtemp()
+        self.downloader = VodcastDownloader(self.tempdir, segments=4, min_segment_size=16 * 1024)
+        self.vodcast = Vodcast(ItemMock('Extra 3 one', (2010, 10, 28, 9, 53, 49), self.server.url('/episode.mp4')))
+        self.target = os.path.join(self.tempdir, 'episode.mp4')
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tempdir)
+
+    def __read(self, filename):
+        with open(filename, 'rb') as f:
+            return f.read()
+
+    def __ranges_requested(self):
+        return sorted(headers['range'] for command, path, headers in self.server.requests if 'range' in headers)
+
+    def test_givenRangeCapableServerWhenDownloadingSegmentedThenSegmentsAreStitchedInPlace(self):
+        self.server.resources['/episode.mp4'] = Resource(self.CONTENT)
+
+        self.downloader.download(self.vodcast)
+
+        self.assertEqual(self.CONTENT, self.__read(self.target))
+        self.assertEqual(['bytes=0-65540', 'bytes=131082-196622', 'bytes=196623-262160', 'bytes=65541-131081'], self.__ranges_requested())
+        self.assertFalse(os.path.exists(self.target + '.part'))
+
+    def test_givenServerWithoutAcceptRangesWhenDownloadingSegmentedThenSingleStreamIsUsed(self):
+        self.server.resources['/episode.mp4'] = Resource(self.CONTENT, accept_ranges=False)
+
+        self.downloader.download(self.vodcast)
+
+        self.assertEqual(self.CONTENT, self.__read(self.target))
+        self.assertEqual([], self.__ranges_requested())
+
+    def test_givenAnnouncedLengthTooSmallForSegmentsWhenDownloadingThenNoHeadRequestIsSent(self):
+        self.server.resources['/episode.mp4'] = Resource(self.CONTENT[:20 * 1024])
+        self.vodcast.length = 20 * 1024
+
+        self.downloader.download(self.vodcast)
+
+        self.assertEqual(self.CONTENT[:20 * 1024], self.__read(self.target))
+        self.assertEqual(['GET'], [command for command, path, headers in self.server.requests])
+
+    def test_givenBrokenSegmentWhenDownloadingSegmentedThenPartialFileIsRemoved(self):
+        self.server.resources['/episode.mp4'] = Resource(self.CONTENT, abort_after=1024)
+
+        self.assertRaisesRegexp(IOError, 'incomplete segment', self.downloader.download, self.vodcast)
+
+        self.assertFalse(os.path.exists(self.target))
+        self.assertFalse(os.path.exists(self.target + '.part'))
+
+class ChecksumDownloadTest(unittest.TestCase):
+    CONTENT = ''.join(chr(byte % 253) for byte in range(200 * 1024))
+
+    def setUp(self):
+        self.server = RangeHTTPServer().start()
+        self.tempdir = tempfile.mkdtemp()
+        self.index = DownloadIndex(os.path.join(self.tempdir, 'index.sqlite'))
+        self.vodcast = Vodcast(ItemMock('Extra 3 one', (2010, 10, 28, 9, 53, 49), self.server.url('/episode.mp4')))
+        self.target = os.path.join(self.tempdir, 'episode.mp4')
+        self.sha256 = 'sha256:' + hashlib.sha256(self.CONTENT).hexdigest()
+
+    def tearDown(self):
+        self.index.close()
+        self.server.stop()
+        shutil.rmtree(self.tempdir)
+
+    def __downloader(self, **kwargs):
+        return VodcastDownloader(self.tempdir, index=self.index, checksum_algorithm='sha256', **kwargs)
+
+    def test_givenChecksumAlgorithmWhenDownloadingThenChecksumIsStoredInIndex(self):
+        self.server.resources['/episode.mp4'] = Resource(self.CONTENT)
+
+        self.__downloader().download(self.vodcast)
+
+        self.assertEqual(self.sha256, self.index.get(self.vodcast.guid).checksum)
+
+    def test_givenMatchingDigestHeaderWhenDownloadingThenDownloadIsVerified(self):
+        digest = base64.b64encode(hashlib.md5(self.CONTENT).digest())
+        self.server.resources['/episode.mp4'] = Resource(self.CONTENT, headers={'Content-MD5' : digest, 'Digest' : 'SHA-256=' + base64.b64encode(hashlib.sha256(self.CONTENT).digest())})
+
+        self.__downloader().download(self.vodcast)
+
+        self.assertTrue(self.index.get(self.vodcast.guid).completed)
+
+    def test_givenMismatchingContentMD5WhenDownloadingThenPartialDownloadIsDiscarded(self):
+        digest = base64.b64encode(hashlib.md5('something else').digest())
+        self.server.resources['/episode.mp4'] = Resource(self.CONTENT, headers={'Content-MD5' : digest})
+
+        self.assertRaisesRegexp(IntegrityError, 'md5 digest mismatch', self.__downloader().download, self.vodcast)
+
+        self.assertEqual(['index.sqlite'], os.listdir(self.tempdir))
+        self.assertFalse(self.index.get(self.vodcast.guid).completed)
+
+    def test_givenResumedDownloadWhenFinishedThenChecksumCoversTheWholeFile(self):
+        self.server.resources['/episode.mp4'] = Resource(self.CONTENT, abort_after=50 * 1024, abort_times=1)
+        downloader = self.__downloader(resume=True)
+        self.assertRaises(IOError, downloader.download, self.vodcast)
+
+        downloader.download(self.vodcast)
+
+        self.assertEqual('bytes=%d-' % (50 * 1024), self.server.requests[-1][2]['range'])
+        self.assertEqual(self.sha256, self.index.get(self.vodcast.guid).checksum)
+
+    def test_givenSegmentedDownloadWhenFinishedThenChecksumIsComputedFromFile(self):
+        self.server.resources['/episode.mp4'] = Resource(self.CONTENT)
+
+        self.__downloader(segments=4, min_segment_size=16 * 1024).download(self.vodcast)
+
+        self.assertEqual(self.sha256, self.index.get(self.vodcast.guid).checksum)
+
+class RetryDownloadTest(unittest.TestCase):
+    CONTENT = ''.join(chr(byte % 256) for byte in range(300 * 1024))
+    FEED = r'''<?xml version='1.0' encoding='UTF-8'?>
+<rss version='2.0'><channel><title>Extra3</title>
+<item><title>Extra 3 one</title><pubDate>Tue, 26 Oct 2010 11:53:49 +0200</pubDate><description>unused</description>
+<enclosure url='%s' type='video/mp4' /></item></channel></rss>'''
+
+    def setUp(self):
+        self.server = RangeHTTPServer().start()
+        self.tempdir = tempfile.mkdtemp()
+        self.delays = []
+        self.retry_policy = RetryPolicy(3, sleep=self.delays.append, random=lambda: 0)
+        self.downloader = VodcastDownloader(self.tempdir, retry_policy=self.retry_policy)
+        self.vodcast = Vodcast(ItemMock('Extra 3 one', (2010, 10, 28, 9, 53, 49), self.server.url('/episode.mp4')))
+        self.target = os.path.join(self.tempdir, 'episode.mp4')
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tempdir)
+
+    def __read(self, filename):
+        with open(filename, 'rb') as f:
+            return f.read()
+
+    def test_givenBrokenTransferWhenRetryingThenDownloadContinuesWithRange(self):
+        self.server.resources['/episode.mp4'] = Resource(self.CONTENT, abort_after=100 * 1024, abort_times=1)
+
+        self.downloader.download(self.vodcast)
+
+        self.assertEqual(self.CONTENT, self.__read(self.target))
+        self.assertEqual([1.0], self.delays)
+        self.assertEqual('bytes=%d-' % (100 * 1024), self.server.requests[-1][2]['range'])
+        self.assertEqual(['episode.mp4'], os.listdir(self.tempdir))
+
+    def test_givenServerErrorsWhenRetryingThenBackoffDoubles(self):
+        self.server.resources['/episode.mp4'] = Resource(self.CONTENT, fail_times=2)
+
+        self.downloader.download(self.vodcast)
+
+        self.assertEqual(self.CONTENT, self.__read(self.target))
+        self.assertEqual([1.0, 2.0], self.delays)
+
+    def test_givenMissingEnclosureWhenDownloadingThenItFailsWithoutRetry(self):
+        self.assertRaises(HTTPError, self.downloader.download, self.vodcast)
+
+        self.assertEqual([], self.delays)
+        self.assertEqual(1, len(self.server.requests))
+        self.assertEqual([], os.listdir(self.tempdir))
+
+    def test_givenPersistentFailureWhenRetriesAreExhaustedThenPartialDownloadIsRemoved(self):
+        self.server.resources['/episode.mp4'] = Resource(self.CONTENT, abort_after=10 * 1024)
+
+        self.assertRaises(IOError, self.downloader.download, self.vodcast)
+
+        self.assertEqual(3, len(self.server.requests))
+        self.assertEqual([], os.listdir(self.tempdir))
+
+    def test_givenFeedFailingOnceWhenManagerFetchesThenFetchIsRetried(self):
+        self.server.resources['/episode.mp4'] = Resource('episode')
+        self.server.resources['/feed.xml'] = Resource(self.FEED % self.server.url('/episode.mp4'), fail_times=1)
+
+        manager = VodcastDownloadManager(self.server.url('/feed.xml'), self.tempdir, retry_policy=self.retry_policy)
+
+        self.assertEqual(1, len(manager.vodcasts))
+        self.assertEqual([1.0], self.delays)
 
 if __name__ == '__main__':
     import logging
@@ -0,0 +1,116 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from datetime import datetime
+from calendar import timegm
+sys.path.insert(0,os.path.abspath(__file__+"/../.."))
+from rss.scheduling import Scheduler, FeedTags, PlannedOrder, NewestFirst, SmallestFirst, FairShare, DeadlineFirst
+from rss.subscriptions import Subscription
+from rss.rss_feed_downloader import BatchDownloadManager, VodcastDownloadManager, LOCAL_TIMEZONE
+from rss.transport import HttpTransport
+from range_http_server import RangeHTTPServer, Resource
+
+FEED = r'''<?xml version='1.0' encoding='UTF-8'?>
+<rss version='2.0'><channel><title>%s</title>
+<item><title>%s special</title><pubDate>Thu, 28 Oct 2010 11:53:49 +0200</pubDate><description>unused</description>
+<enclosure url='%s' type='video/mp4' length='%d' /></item>
+</channel></rss>'''
+
+class DownloaderMock:
+    def __init__(self, feed_url):
+        self.feed_url = feed_url
+
+class VodcastMock:
+    def __init__(self, title, updated, length=None):
+        self.title = title
+        self.timestamp = timegm(updated.timetuple())
+        self.length = length
+
+EXTRA3 = DownloaderMock('extra3')
+WELTSPIEGEL = DownloaderMock('weltspiegel')
+
+def jobs():
+    # as planned: per feed newest first
+    return [(EXTRA3, VodcastMock('extra3 special', datetime(2010, 10, 28), 3000)),
+            (EXTRA3, VodcastMock('extra3 daily', datetime(2010, 10, 27), 100)),
+            (EXTRA3, VodcastMock('extra3 unknown', datetime(2010, 10, 26))),
+            (WELTSPIEGEL, VodcastMock('weltspiegel one', datetime(2010, 10, 27, 12), 200)),
+            (WELTSPIEGEL, VodcastMock('weltspiegel two', datetime(2010, 10, 25), 300))]
+
+def titles(jobs):
+    return [vodcast.title for downloader, vodcast in jobs]
+
+class SchedulingPolicyTest(unittest.TestCase):
+    def test_givenPlannedOrderWhenOrderingThenJobsStayAsPlanned(self):
+        self.assertEqual(titles(jobs()), titles(PlannedOrder().order(jobs(), {})))
+
+    def test_givenNewestFirstWhenOrderingThenFeedsAreMerged(self):
+        self.assertEqual(['extra3 special', 'weltspiegel one', 'extra3 daily', 'extra3 unknown', 'weltspiegel two'],
+                         titles(NewestFirst().order(jobs(), {})))
+
+    def test_givenSmallestFirstWhenOrderingThenUnknownLengthsGoLast(self):
+        self.assertEqual(['extra3 daily', 'weltspiegel one', 'weltspiegel two', 'extra3 special', 'extra3 unknown'],
+                         titles(SmallestFirst().order(jobs(), {})))
+
+    def test_givenFairShareWhenOrderingThenFeedWithFewestScheduledBytesGoesNext(self):
+        self.assertEqual(['extra3 special', 'weltspiegel one', 'weltspiegel two', 'extra3 daily', 'extra3 unknown'],
+                         titles(FairShare().order(jobs(), {})))
+
+    def test_givenDeadlineTagsWhenOrderingThenPriorityThenEarliestDeadlineGoFirst(self):
+        tags = {'weltspiegel' : FeedTags(priority=0, deadline=3600), 'extra3' : FeedTags(priority=1)}
+
+        self.assertEqual(['weltspiegel two', 'weltspiegel one', 'extra3 daily', 'extra3 special', 'extra3 unknown'],
+                         titles(DeadlineFirst().order(jobs(), tags)))
+
+class SchedulerTest(unittest.TestCase):
+    def test_givenThreadsWhenForecastingThenDownloadsAreAvailableAfterTheirPredecessorsOnTheSameThread(self):
+        scheduler = Scheduler('smallest', threads=2, rate=100)
+
+        ordered = scheduler.order(jobs())
+
+        # the unknown length counts as the mean of the known ones (900 bytes)
+        self.assertEqual([1, 2, 4, 32, 13], scheduler.forecast(ordered))
+
+    def test_givenSmallestFirstWhenForecastingThenMeanTimeToAvailableIsLowerThanPlanned(self):
+        planned, smallest = Scheduler('planned', rate=100), Scheduler('smallest', rate=100)
+
+        mean = lambda available: sum(available) / len(available)
+
+        self.assertTrue(mean(smallest.forecast(smallest.order(jobs()))) < mean(planned.forecast(planned.order(jobs()))))
+
+class BatchSchedulingTest(unittest.TestCase):
+    def setUp(self):
+        self.server = RangeHTTPServer().start()
+        self.tempdir = tempfile.mkdtemp()
+        self.transport = HttpTransport()
+
+    def tearDown(self):
+        self.transport.close()
+        self.server.stop()
+        shutil.rmtree(self.tempdir)
+
+    def __subscribe(self, name, length):
+        self.server.resources['/%s.mp4' % name] = Resource('x' * length)
+        self.server.resources['/%s.xml' % name] = Resource(FEED % (name, name, self.server.url('/%s.mp4' % name), length))
+        directory = os.path.join(self.tempdir, name)
+        os.mkdir(directory)
+        return Subscription(self.server.url('/%s.xml' % name), directory)
+
+    def test_givenSmallestFirstWhenDownloadingSubscriptionsThenSmallEpisodeIsDownloadedFirst(self):
+        subscriptions = [self.__subscribe('extra3', 3000), self.__subscribe('weltspiegel', 100)]
+        batch = BatchDownloadManager(subscriptions,
+                                     lambda subscription: VodcastDownloadManager(subscription.url, subscription.download_directory, transport=self.transport),
+                                     threads=1, scheduler=Scheduler('smallest'))
+        reference_date = LOCAL_TIMEZONE.localize(datetime(2010, 10, 1))
+
+        num_updated = batch.download_all_newer(dict((subscription, reference_date) for subscription in subscriptions))
+
+        self.assertEqual(['/weltspiegel.mp4', '/extra3.mp4'], [path for command, path, headers in self.server.requests if path.endswith('.mp4')])
+        self.assertEqual([1, 1], [num_updated[subscription] for subscription in subscriptions])
+        self.assertEqual([self.server.url('/extra3.mp4'), self.server.url('/weltspiegel.mp4')],
+                         [manager.results[0].vodcast.url for manager in batch.managers])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from datetime import datetime
+from calendar import timegm
+sys.path.insert(0,os.path.abspath(__file__+"/../.."))
+from rss.selection import Selection, NewerThan, TitleMatches, NotDownloaded, NewestN, MaxTotalBytes, to_epoch
+from rss.download_index import DownloadIndex, INDEX_FILENAME
+from rss.rss_feed_downloader import VodcastDownloadManager, LOCAL_TIMEZONE
+
+FEED = r'''<?xml version='1.0' encoding='UTF-8'?>
+<rss version='2.0'><channel><title>Extra3</title>
+<item><title>Extra 3 vom 28.10.</title><pubDate>Thu, 28 Oct 2010 11:53:49 +0200</pubDate><description>unused</description>
+<enclosure url='http://localhost/28.mp4' type='video/mp4' length='300' /></item>
+<item><title>Extra 3 Spezial</title><pubDate>Wed, 27 Oct 2010 11:53:49 +0200</pubDate><description>unused</description>
+<enclosure url='http://localhost/27.mp4' type='video/mp4' length='500' /></item>
+<item><title>Extra 3 vom 26.10.</title><pubDate>Tue, 26 Oct 2010 11:53:49 +0200</pubDate><description>unused</description>
+<enclosure url='http://localhost/26.mp4' type='video/mp4' length='200' /></item>
+</channel></rss>'''
+
+class VodcastMock:
+    def __init__(self, title, updated, length=None):
+        self.title = title
+        self.guid = title
+        self.timestamp = timegm(updated.timetuple())
+        self.length = length
+
+    def __repr__(self):
+        return self.title
+
+def episodes():
+    # feed order, not sorted by date
+    return [VodcastMock('tuesday', datetime(2010, 10, 26, 9, 53, 49), 200),
+            VodcastMock('thursday', datetime(2010, 10, 28, 9, 53, 49), 300),
+            VodcastMock('wednesday', datetime(2010, 10, 27, 9, 53, 49), 500)]
+
+class SelectionTest(unittest.TestCase):
+    def test_givenLocalReferenceDateWhenFilteringThenEpochOfTheSameInstantIsCompared(self):
+        reference_date = LOCAL_TIMEZONE.localize(datetime(2010, 10, 27, 11, 53, 49))
+
+        self.assertEqual(timegm(datetime(2010, 10, 27, 9, 53, 49).timetuple()), to_epoch(reference_date))
+        self.assertEqual(['thursday'], [vodcast.title for vodcast in Selection([NewerThan(reference_date)]).select(episodes())])
+
+    def test_givenRetriedGuidWhenFilteringThenItIsKeptThoughOlder(self):
+        reference_date = LOCAL_TIMEZONE.localize(datetime(2010, 10, 27, 11, 53, 49))
+
+        self.assertEqual(['tuesday', 'thursday'], [vodcast.title for vodcast in Selection([NewerThan(reference_date, ['tuesday'])]).select(episodes())])
+
+    def test_givenTitlePatternsWhenFilteringThenMatchingTitlesAreKeptOrSkipped(self):
+        self.assertEqual(['wednesday'], [vodcast.title for vodcast in Selection([TitleMatches('^WED')]).select(episodes())])
+        self.assertEqual(['tuesday', 'thursday'], [vodcast.title for vodcast in Selection([TitleMatches('wed', exclude=True)]).select(episodes())])
+
+    def test_givenNewestNWhenSelectingThenNewestAreKeptInFeedOrder(self):
+        self.assertEqual(['thursday', 'wednesday'], [vodcast.title for vodcast in Selection([NewestN(2)]).select(episodes())])
+
+    def test_givenMaxTotalBytesWhenSelectingThenOlderSmallerVodcastsFillTheBudget(self):
+        selected = Selection([MaxTotalBytes(500)]).select(episodes())
+
+        self.assertEqual(['tuesday', 'thursday'], [vodcast.title for vodcast in selected])
+
+    def test_givenBudgetsWhenSelectingThenVodcastsMustFitAllOfThem(self):
+        selected = Selection([NewestN(1), MaxTotalBytes(250)]).select(episodes())
+
+        self.assertEqual(['tuesday'], [vodcast.title for vodcast in selected])
+
+class NotDownloadedTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.index = DownloadIndex(os.path.join(self.tempdir, INDEX_FILENAME))
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.tempdir)
+
+    def test_givenCompletedGuidsWhenSelectingNewestThenOnlyNewVodcastsCount(self):
+        self.index.mark_completed('thursday', 300, feed='feed', url='http://localhost/28.mp4', target='/tmp/28.mp4')
+        self.index.mark_started('wednesday', 'feed', 'http://localhost/27.mp4', '/tmp/27.mp4')
+
+        selected = Selection([NotDownloaded(self.index, 'feed'), NewestN(1)]).select(episodes())
+
+        self.assertEqual(['wednesday'], [vodcast.title for vodcast in selected])
+
+class ManagerSelectionTest(unittest.TestCase):
+    def test_givenPoliciesWhenSelectingNewerThenBudgetsApplyToEnclosureLengthsAfterTheReferenceDate(self):
+        manager = VodcastDownloadManager(FEED, '/tmp', policies=[MaxTotalBytes(600)])
+
+        selected = manager.select_newer(LOCAL_TIMEZONE.localize(datetime(2010, 10, 26, 12, 0, 0)))
+
+        self.assertEqual(['Extra 3 vom 28.10.'], [vodcast.title for vodcast in selected])
+
+if __name__ == '__main__':
+    unittest.main()
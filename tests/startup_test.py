@@ -0,0 +1,73 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+sys.path.insert(0,os.path.abspath(__file__+"/../.."))
+from rss.download_index import DownloadIndex, INDEX_FILENAME
+from rss.feed_cache import IndexFeedCache
+from range_http_server import RangeHTTPServer, Resource
+
+ROOT = os.path.abspath(__file__+"/../..")
+
+# modules only some paths need, each taking longer to import than a run with an unchanged feed takes otherwise
+HEAVY_MODULES = ('feedparser', 'pytz', 'dateutil', 'logging.config', 'multiprocessing', 'BaseHTTPServer', 'ctypes', 'email.utils')
+# seconds to import main, ten times what it takes so a busy machine passes. the heavy modules are what keeps it
+# short, test_givenMainWhenImportedThenHeavyModulesAreNotLoaded is the check that counts
+IMPORT_BUDGET = 1.0
+
+# python 2 has no -X importtime, the child process reports the time to import main and the modules it loaded
+PROBE = r'''
+import json, sys, time
+sys.path.insert(0, %(root)r)
+started = time.time()
+import main
+seconds = time.time() - started
+if %(args)r:
+    main.main(%(args)r)
+print(json.dumps({'seconds' : seconds, 'modules' : sorted(name for name, module in sys.modules.items() if module)}))
+'''
+
+FEED = r'''<?xml version='1.0' encoding='UTF-8'?>
+<rss version='2.0'><channel><title>Extra3</title>
+<item><title>Extra 3 one</title><pubDate>Tue, 26 Oct 2010 11:53:49 +0200</pubDate><description>unused</description>
+<enclosure url='http://localhost/episode.mp4' type='video/mp4' /></item></channel></rss>'''
+
+def probe(args=None):
+    output = subprocess.check_output([sys.executable, '-c', PROBE % {'root' : ROOT, 'args' : args}], cwd=ROOT)
+    return json.loads(output.strip().splitlines()[-1])
+
+class StartupTest(unittest.TestCase):
+    def __loaded(self, modules):
+        return [name for name in HEAVY_MODULES if name in modules]
+
+    def test_givenMainWhenImportedThenHeavyModulesAreNotLoaded(self):
+        self.assertEqual([], self.__loaded(probe()['modules']))
+
+    def test_givenMainWhenImportedThenImportTimeStaysWithinBudget(self):
+        # the first run compiles, the best of the others counts
+        seconds = min(probe()['seconds'] for run in range(4))
+
+        self.assertTrue(seconds < IMPORT_BUDGET, 'importing main took %.3fs, budget is %.3fs' % (seconds, IMPORT_BUDGET))
+
+    def test_givenUnchangedFeedWhenRunningThenNeitherParserNorTimezonesAreLoaded(self):
+        server = RangeHTTPServer().start()
+        tempdir = tempfile.mkdtemp()
+        try:
+            server.resources['/feed.xml'] = Resource(FEED, etag='"feed-v1"')
+            index = DownloadIndex(os.path.join(tempdir, INDEX_FILENAME))
+            IndexFeedCache(index, server.url('/feed.xml')).save('"feed-v1"', None, [{'title' : 'Extra 3 one', 'url' : 'http://localhost/episode.mp4', 'updated' : 1288086829, 'description' : 'unused'}])
+            index.close()
+
+            result = probe(['main.py', '-u', server.url('/feed.xml'), '-d', tempdir])
+
+            self.assertEqual([('GET', '/feed.xml', '"feed-v1"')], [(command, path, headers.get('if-none-match')) for command, path, headers in server.requests])
+            self.assertEqual([], self.__loaded(result['modules']))
+        finally:
+            server.stop()
+            shutil.rmtree(tempdir)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from StringIO import StringIO
+sys.path.insert(0,os.path.abspath(__file__+"/../.."))
+from rss import storage
+from rss.storage import BlockWriter, copy_stream, commit, preallocate
+
+class ReadIntoSource:
+    def __init__(self, content):
+        self.content = content
+        self.position = 0
+        self.sizes = []
+
+    def readinto(self, buffer):
+        block = self.content[self.position:self.position + len(buffer)]
+        buffer[:len(block)] = block
+        self.position += len(block)
+        self.sizes.append(len(buffer))
+        return len(block)
+
+class StorageTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'episode.mp4')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def __read(self, filename):
+        with open(filename, 'rb') as f:
+            return f.read()
+
+    def test_givenReadIntoSourceWhenCopyingThenOneBufferIsReused(self):
+        source = ReadIntoSource('x' * 2500)
+        blocks = []
+
+        with BlockWriter(self.filename) as target:
+            copied = copy_stream(source, target, 1000, blocks.append)
+
+        self.assertEqual(2500, copied)
+        self.assertEqual([1000, 1000, 500], blocks)
+        self.assertEqual('x' * 2500, self.__read(self.filename))
+
+    def test_givenLimitWhenCopyingThenNoMoreIsRead(self):
+        source = StringIO('x' * 2500)
+
+        with BlockWriter(self.filename) as target:
+            copied = copy_stream(source, target, 1000, limit=1200)
+
+        self.assertEqual(1200, copied)
+        self.assertEqual(1200, source.tell())
+
+    def test_givenOffsetWhenWritingThenExistingContentIsContinued(self):
+        with open(self.filename, 'wb') as part:
+            part.write('abc')
+
+        with BlockWriter(self.filename, 3, length=6) as target:
+            target.write('def')
+
+        self.assertEqual('abcdef', self.__read(self.filename))
+
+    def test_givenLengthWhenPreallocatingThenSpaceIsReservedWithoutChangingTheSize(self):
+        with BlockWriter(self.filename, length=4 * 1024 * 1024) as target:
+            target.write('x')
+
+        self.assertEqual(1, os.path.getsize(self.filename))
+        if storage._fallocate is not None:
+            self.assertTrue(os.stat(self.filename).st_blocks * 512 >= 4 * 1024 * 1024)
+
+    def test_givenNoKeepSizeWhenPreallocatingThenFileIsExtended(self):
+        with open(self.filename, 'wb') as target:
+            preallocate(target, 4096, keep_size=False)
+
+        self.assertEqual(4096, os.path.getsize(self.filename))
+
+    def test_givenSyncWhenCommittingThenPartIsRenamed(self):
+        with open(self.filename + '.part', 'wb') as part:
+            part.write('episode')
+
+        commit(self.filename + '.part', self.filename, sync=True)
+
+        self.assertEqual(['episode.mp4'], os.listdir(self.tempdir))
+        self.assertEqual('episode', self.__read(self.filename))
+
+if __name__ == '__main__':
+    unittest.main()
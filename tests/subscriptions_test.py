@@ -0,0 +1,144 @@
+from datetime import datetime
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+sys.path.insert(0,os.path.abspath(__file__+"/../.."))
+from rss.subscriptions import load_subscriptions, Subscription
+from rss.rss_feed_downloader import BatchDownloadManager, VodcastDownloadManager, FeedParserPool, parse_feed, LOCAL_TIMEZONE
+from rss.transport import HttpTransport
+from range_http_server import RangeHTTPServer, Resource
+
+FEED = r'''<?xml version='1.0' encoding='UTF-8'?>
+<rss version='2.0'>
+<channel>
+<title>%s</title>
+<item>
+<title>%s one</title>
+<pubDate>Tue, 26 Oct 2010 11:53:49 +0200</pubDate>
+<description>unused</description>
+<enclosure url='%s' type='video/mp4' />
+</item></channel></rss>'''
+
+class SubscriptionsTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def __write(self, content):
+        path = os.path.join(self.tempdir, 'subscriptions')
+        with open(path, 'w') as subscriptions_file:
+            subscriptions_file.write(content)
+        return path
+
+    def __as_tuples(self, subscriptions):
+        return [(subscription.url, subscription.download_directory, subscription.day_offset) for subscription in subscriptions]
+
+    def test_givenPlainListWhenLoadingThenMissingValuesFallBackToDefaults(self):
+        path = self.__write('''# feeds
+http://www.ndr.de/podcast/extradrei196.xml /tmp/extra3
+
+http://www.daserste.de/weltspiegel.xml /tmp/weltspiegel 3
+http://www.daserste.de/tagesschau.xml
+''')
+        self.assertEqual([('http://www.ndr.de/podcast/extradrei196.xml', '/tmp/extra3', 7),
+                          ('http://www.daserste.de/weltspiegel.xml', '/tmp/weltspiegel', 3),
+                          ('http://www.daserste.de/tagesschau.xml', '/tmp/default', 7)],
+                         self.__as_tuples(load_subscriptions(path, '/tmp/default', 7)))
+
+    def test_givenOpmlWhenLoadingThenOutlinesWithFeedUrlAreSubscriptions(self):
+        path = self.__write('''<?xml version="1.0"?>
+<opml version="1.0"><body>
+<outline text="tv">
+<outline text="extra3" xmlUrl="http://www.ndr.de/podcast/extradrei196.xml" downloadDirectory="/tmp/extra3" dayOffset="2"/>
+<outline text="weltspiegel" xmlUrl="http://www.daserste.de/weltspiegel.xml"/>
+</outline>
+</body></opml>''')
+        self.assertEqual([('http://www.ndr.de/podcast/extradrei196.xml', '/tmp/extra3', 2),
+                          ('http://www.daserste.de/weltspiegel.xml', '/tmp/default', None)],
+                         self.__as_tuples(load_subscriptions(path, '/tmp/default')))
+
+    def test_givenSchedulingTagsWhenLoadingThenPriorityAndDeadlineAreSet(self):
+        path = self.__write('''http://www.ndr.de/podcast/extradrei196.xml?format=mp4 /tmp/extra3 3 priority=1 deadline=6
+http://www.daserste.de/weltspiegel.xml deadline=1.5
+''')
+        subscriptions = load_subscriptions(path, '/tmp/default')
+
+        self.assertEqual([('http://www.ndr.de/podcast/extradrei196.xml?format=mp4', '/tmp/extra3', 3),
+                          ('http://www.daserste.de/weltspiegel.xml', '/tmp/default', None)], self.__as_tuples(subscriptions))
+        self.assertEqual([(1, 6.0), (0, 1.5)], [(subscription.priority, subscription.deadline) for subscription in subscriptions])
+
+    def test_givenSubscriptionWithoutDirectoryWhenLoadingThenItFails(self):
+        path = self.__write('http://www.ndr.de/podcast/extradrei196.xml\n')
+        self.assertRaisesRegexp(Exception, 'no download directory', load_subscriptions, path)
+
+class BatchDownloadManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.server = RangeHTTPServer().start()
+        self.tempdir = tempfile.mkdtemp()
+        self.transport = HttpTransport()
+
+    def tearDown(self):
+        self.transport.close()
+        self.server.stop()
+        shutil.rmtree(self.tempdir)
+
+    def __subscribe(self, name):
+        self.server.resources['/%s.mp4' % name] = Resource(name)
+        self.server.resources['/%s.xml' % name] = Resource(FEED % (name, name, self.server.url('/%s.mp4' % name)))
+        directory = os.path.join(self.tempdir, name)
+        os.mkdir(directory)
+        return Subscription(self.server.url('/%s.xml' % name), directory)
+
+    def test_givenSeveralSubscriptionsWhenDownloadingThenEachFeedEndsUpInItsDirectory(self):
+        subscriptions = [self.__subscribe('extra3'), self.__subscribe('weltspiegel'), Subscription(self.server.url('/missing.xml'), self.tempdir)]
+        batch = BatchDownloadManager(subscriptions,
+                                     lambda subscription: VodcastDownloadManager(subscription.url, subscription.download_directory, transport=self.transport),
+                                     threads=2)
+        reference_date = LOCAL_TIMEZONE.localize(datetime(2010, 10, 1))
+
+        num_updated = batch.download_all_newer(dict((subscription, reference_date) for subscription in subscriptions))
+
+        self.assertEqual([1, 1, 0], [num_updated[subscription] for subscription in subscriptions])
+        for name in ('extra3', 'weltspiegel'):
+            with open(os.path.join(self.tempdir, name, '%s.mp4' % name)) as episode:
+                self.assertEqual(name, episode.read())
+
+    def test_givenParserPoolWhenFetchingFeedsThenTheyAreParsedInWorkerProcesses(self):
+        subscriptions = [self.__subscribe('extra3'), self.__subscribe('weltspiegel')]
+        parser = FeedParserPool(2)
+        try:
+            batch = BatchDownloadManager(subscriptions,
+                                         lambda subscription: VodcastDownloadManager(subscription.url, subscription.download_directory, transport=self.transport, parser=parser),
+                                         threads=2)
+        finally:
+            parser.close()
+
+        self.assertEqual([('extra3 one', self.server.url('/extra3.mp4')), ('weltspiegel one', self.server.url('/weltspiegel.mp4'))],
+                         [(manager.vodcasts[0].title, manager.vodcasts[0].url) for manager in batch.managers])
+
+class FeedParserPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.parser = FeedParserPool(1)
+
+    def tearDown(self):
+        self.parser.close()
+
+    def test_givenFeedWhenParsedInWorkerThenVodcastsEqualThoseParsedInProcess(self):
+        feed = FEED % ('Extra3', 'Extra 3', 'http://localhost/extra3.mp4')
+
+        parsed_feed = self.parser.parse(feed)
+
+        self.assertEqual(1, parsed_feed.entries)
+        self.assertEqual(parse_feed(feed).vodcasts, parsed_feed.vodcasts)
+
+    def test_givenUnknownEnclosureTypeWhenParsedInWorkerThenErrorIsRaised(self):
+        feed = (FEED % ('Extra3', 'Extra 3', 'http://localhost/extra3.mp3')).replace('video/mp4', 'audio/mpeg')
+
+        self.assertRaises(Exception, self.parser.parse, feed)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+from datetime import datetime
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from urllib2 import HTTPError
+sys.path.insert(0,os.path.abspath(__file__+"/../.."))
+from rss.transport import HttpTransport
+from rss.rate_limit import RateLimiter
+from rss.rss_feed_downloader import VodcastDownloadManager, LOCAL_TIMEZONE
+from range_http_server import RangeHTTPServer, Resource
+
+FEED = r'''<?xml version='1.0' encoding='UTF-8'?>
+<rss version='2.0'>
+<channel>
+<title>Extra3</title>
+<item>
+<title>Extra 3 one</title>
+<pubDate>Tue, 26 Oct 2010 11:53:49 +0200</pubDate>
+<description>unused</description>
+<enclosure url='%s' type='video/mp4' />
+</item></channel></rss>'''
+
+class RecordingRateLimiter(RateLimiter):
+    def __init__(self, *args, **kwargs):
+        RateLimiter.__init__(self, *args, **kwargs)
+        self.amounts = []
+
+    def throttle(self, host, amount):
+        self.amounts.append(amount)
+        RateLimiter.throttle(self, host, amount)
+
+class HttpTransportTest(unittest.TestCase):
+    def setUp(self):
+        self.server = RangeHTTPServer().start()
+        self.tempdir = tempfile.mkdtemp()
+        self.transport = HttpTransport(buffer_size=4096)
+
+    def tearDown(self):
+        self.transport.close()
+        self.server.stop()
+        shutil.rmtree(self.tempdir)
+
+    def __read(self, filename):
+        with open(filename, 'rb') as f:
+            return f.read()
+
+    def test_givenManyDownloadsFromSameHostWhenRetrievingThenConnectionIsReused(self):
+        for number in range(5):
+            self.server.resources['/episode%d.mp4' % number] = Resource('episode %d' % number * 3000)
+        for number in range(5):
+            target = os.path.join(self.tempdir, 'episode%d.mp4' % number)
+            self.transport.retrieve(self.server.url('/episode%d.mp4' % number), target)
+            self.assertEqual('episode %d' % number * 3000, self.__read(target))
+
+        self.assertEqual(1, self.transport.connections_opened)
+        self.assertEqual(1, len(self.server.connections))
+
+    def test_givenRedirectWhenOpeningThenItIsFollowedOnTheSameConnection(self):
+        self.server.resources['/latest.mp4'] = Resource(redirect=self.server.url('/episode.mp4'))
+        self.server.resources['/episode.mp4'] = Resource('episode')
+
+        response = self.transport.open(self.server.url('/latest.mp4'))
+
+        self.assertEqual('episode', response.read())
+        self.assertEqual(self.server.url('/episode.mp4'), response.geturl())
+        response.close()
+        self.assertEqual(1, self.transport.connections_opened)
+
+    def test_givenMissingResourceWhenOpeningThenHttpErrorIsRaised(self):
+        try:
+            self.transport.open(self.server.url('/missing.mp4'))
+            self.fail('expected HTTPError')
+        except HTTPError as e:
+            self.assertEqual(404, e.code)
+
+    def test_givenReportHookWhenRetrievingThenItIsCalledPerBuffer(self):
+        self.server.resources['/episode.mp4'] = Resource('x' * 10000)
+        calls = []
+
+        self.transport.retrieve(self.server.url('/episode.mp4'), os.path.join(self.tempdir, 'episode.mp4'),
+                                lambda block_number, block_size, total_size: calls.append((block_number, total_size)))
+
+        self.assertEqual([(0, 10000), (1, 10000), (2, 10000), (3, 10000)], calls)
+
+    def test_givenFeedAndEnclosuresOnSameHostWhenManagerDownloadsThenOneConnectionIsUsed(self):
+        self.server.resources['/episode.mp4'] = Resource('episode')
+        self.server.resources['/feed.xml'] = Resource(FEED % self.server.url('/episode.mp4'))
+
+        manager = VodcastDownloadManager(self.server.url('/feed.xml'), self.tempdir, transport=self.transport)
+        self.assertEqual(1, len(manager.vodcasts))
+        manager.download_all_newer(LOCAL_TIMEZONE.localize(datetime(2010, 10, 1)))
+
+        self.assertEqual('episode', self.__read(os.path.join(self.tempdir, 'episode.mp4')))
+        self.assertEqual(1, self.transport.connections_opened)
+
+    def test_givenRateLimiterWhenRetrievingThenThroughputStaysAtMaxRate(self):
+        self.server.resources['/episode.mp4'] = Resource('x' * 300 * 1024)
+        transport = HttpTransport(buffer_size=16 * 1024, rate_limiter=RateLimiter(max_rate=200 * 1024))
+
+        start = time.time()
+        transport.retrieve(self.server.url('/episode.mp4'), os.path.join(self.tempdir, 'episode.mp4'))
+        elapsed = time.time() - start
+        transport.close()
+
+        # a quarter second burst, the remaining 250k at 200k/s
+        self.assertTrue(1.2 <= elapsed < 2, elapsed)
+
+    def test_givenLargeBufferAndRateLimiterWhenRetrievingThenNoReadExceedsTheBurst(self):
+        self.server.resources['/episode.mp4'] = Resource('x' * 300 * 1024)
+        rate_limiter = RecordingRateLimiter(max_rate=400 * 1024)
+        transport = HttpTransport(buffer_size=1024 * 1024, rate_limiter=rate_limiter)
+
+        transport.retrieve(self.server.url('/episode.mp4'), os.path.join(self.tempdir, 'episode.mp4'))
+        transport.close()
+
+        self.assertEqual(300 * 1024, sum(rate_limiter.amounts))
+        self.assertEqual(100 * 1024, max(rate_limiter.amounts))
+
+    def test_givenTooManyRequestsWhenOpeningThenHostIsDeferredByRetryAfter(self):
+        self.server.resources['/episode.mp4'] = Resource(retry_after=120)
+        rate_limiter = RateLimiter()
+        transport = HttpTransport(rate_limiter=rate_limiter)
+
+        try:
+            transport.open(self.server.url('/episode.mp4'))
+            self.fail('expected HTTPError')
+        except HTTPError as e:
+            self.assertEqual(429, e.code)
+        transport.close()
+
+        self.assertTrue(115 < rate_limiter.wait_time('127.0.0.1') <= 120)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+import os
+import sys
+import unittest
+from datetime import datetime, timedelta
+sys.path.insert(0,os.path.abspath(__file__+"/../.."))
+from rss.rss_feed_downloader import VodcastDownloadManager
+from rss.watch import PublishHistory, PollScheduler, FeedWatcher, MIN_INTERVAL, MAX_INTERVAL, DEFAULT_INTERVAL
+from calendar import timegm
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+START = datetime(2010, 10, 1, 18, 0, 0)
+
+class VodcastMock:
+    def __init__(self, updated):
+        self.timestamp = timegm(updated.timetuple())
+
+class FakeClock:
+    def __init__(self):
+        self.now = timegm(START.timetuple())
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+class ManagerMock:
+    def __init__(self, vodcasts, not_modified=False, ttl=None, retries=()):
+        self.vodcasts = vodcasts
+        self.not_modified = not_modified
+        self.retries = set(retries)
+        self.ttl = ttl
+        self.update_period = None
+        self.refreshed = 0
+
+    def refresh(self):
+        self.refreshed += 1
+
+def daily(count):
+    return [VodcastMock(START - timedelta(days=day)) for day in range(count)]
+
+class PublishHistoryTest(unittest.TestCase):
+    def setUp(self):
+        self.now = timegm(START.timetuple())
+
+    def test_givenDailyShowJustPublishedWhenSchedulingThenNextPollIsShortlyBeforeTheNextEpisode(self):
+        history = PublishHistory()
+        history.observe(daily(5))
+
+        self.assertEqual(DAY - HOUR - 60, history.interval(self.now + 60))
+
+    def test_givenOverdueEpisodeWhenSchedulingThenFeedIsPolledOftenWithinTheGap(self):
+        history = PublishHistory()
+        history.observe(daily(5))
+
+        self.assertEqual(HOUR, history.interval(self.now + DAY))
+
+    def test_givenRarelyUpdatedFeedWhenSchedulingThenMaxIntervalApplies(self):
+        history = PublishHistory()
+        history.observe([VodcastMock(START - timedelta(days=30 * month)) for month in range(4)])
+
+        self.assertEqual(MAX_INTERVAL, history.interval(self.now + HOUR))
+
+    def test_givenTtlWhenSchedulingThenItIsNotUndercut(self):
+        history = PublishHistory()
+        history.observe(daily(5), ttl=3 * HOUR)
+
+        self.assertEqual(3 * HOUR, history.interval(self.now + DAY))
+
+    def test_givenNoHistoryWhenSchedulingThenUpdatePeriodOrDefaultIsUsed(self):
+        history = PublishHistory()
+        self.assertEqual(DEFAULT_INTERVAL, history.interval(self.now))
+
+        history.observe([VodcastMock(START)], update_period=12 * HOUR)
+
+        self.assertEqual(12 * HOUR, history.interval(self.now))
+
+    def test_givenManyObservationsWhenObservingThenOnlyRecentDistinctUpdatesAreKept(self):
+        history = PublishHistory(size=3)
+        history.observe(daily(5))
+        history.observe(daily(2))
+
+        self.assertEqual([timegm((START - timedelta(days=day)).timetuple()) for day in (2, 1, 0)], history.updates)
+
+class PollSchedulerTest(unittest.TestCase):
+    def test_givenFeedsWhenRunningThenTheyArePolledInOrderOfTheirDueTime(self):
+        clock = FakeClock()
+        scheduler = PollScheduler(clock, clock.sleep)
+        polled = []
+        intervals = {'hourly' : HOUR, 'daily' : DAY}
+        def poll(feed):
+            polled.append((feed, clock.now - timegm(START.timetuple())))
+            return intervals[feed]
+        scheduler.schedule('daily')
+        scheduler.schedule('hourly', 30 * 60)
+
+        scheduler.run(poll, max_polls=4)
+
+        self.assertEqual([('daily', 0), ('hourly', 30 * 60), ('hourly', 90 * 60), ('hourly', 150 * 60)], polled)
+        self.assertEqual(2, len(scheduler))
+
+    def test_givenFailingPollWhenRunningThenFeedIsRetriedAfterErrorInterval(self):
+        clock = FakeClock()
+        scheduler = PollScheduler(clock, clock.sleep)
+        def poll(feed):
+            raise IOError('connection refused')
+        scheduler.schedule('feed')
+
+        scheduler.run(poll, error_interval=MIN_INTERVAL, max_polls=2)
+
+        self.assertEqual([MIN_INTERVAL], clock.sleeps)
+
+class FeedWatcherTest(unittest.TestCase):
+    def test_givenFeedWhenPolledRepeatedlyThenManagerIsKeptAndRefreshed(self):
+        clock = FakeClock()
+        manager = ManagerMock(daily(5))
+        created = []
+        downloads = []
+        def create_manager(feed):
+            created.append(feed)
+            return manager
+
+        watcher = FeedWatcher(['feed'], create_manager, lambda feed, vdm: downloads.append(feed), clock=clock, sleep=clock.sleep)
+        watcher.run(max_polls=3)
+
+        self.assertEqual(['feed'], created)
+        self.assertEqual(2, manager.refreshed)
+        self.assertEqual(['feed'] * 3, downloads)
+        self.assertEqual([DAY - HOUR, HOUR], clock.sleeps)
+
+    def test_givenNotModifiedFeedWhenPolledThenNothingIsDownloaded(self):
+        clock = FakeClock()
+        downloads = []
+
+        watcher = FeedWatcher(['feed'], lambda feed: ManagerMock(daily(5), not_modified=True), lambda feed, vdm: downloads.append(feed), clock=clock, sleep=clock.sleep)
+        interval = watcher.poll('feed')
+
+        self.assertEqual([], downloads)
+        self.assertEqual(DAY - HOUR, interval)
+
+    def test_givenNotModifiedFeedWithFailedDownloadsWhenPolledThenTheyAreRetried(self):
+        clock = FakeClock()
+        downloads = []
+
+        watcher = FeedWatcher(['feed'], lambda feed: ManagerMock(daily(5), not_modified=True, retries=['guid1']), lambda feed, vdm: downloads.append(feed), clock=clock, sleep=clock.sleep)
+        watcher.poll('feed')
+
+        self.assertEqual(['feed'], downloads)
+
+class UpdateHintsTest(unittest.TestCase):
+    FEED = '''<?xml version='1.0' encoding='UTF-8'?>
+<rss version='2.0' xmlns:sy='http://purl.org/rss/1.0/modules/syndication/'><channel><title>Extra3</title>
+<ttl>90</ttl><sy:updatePeriod>daily</sy:updatePeriod><sy:updateFrequency>2</sy:updateFrequency>
+<item><title>Extra 3 one</title><pubDate>Tue, 26 Oct 2010 11:53:49 +0200</pubDate><description>unused</description>
+<enclosure url='http://localhost/episode.mp4' type='video/mp4' /></item></channel></rss>'''
+
+    def test_givenTtlAndSyndicationHintsWhenParsingThenManagerExposesThemInSeconds(self):
+        manager = VodcastDownloadManager(self.FEED, '/tmp')
+
+        self.assertEqual(90 * 60, manager.ttl)
+        self.assertEqual(12 * HOUR, manager.update_period)
+
+    def test_givenRefreshWhenFeedIsFetchedAgainThenVodcastsAreReplaced(self):
+        manager = VodcastDownloadManager(self.FEED, '/tmp')
+
+        manager.refresh()
+
+        self.assertEqual(1, len(manager.vodcasts))
+
+if __name__ == '__main__':
+    unittest.main()